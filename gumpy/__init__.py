@@ -13,7 +13,9 @@ from .framework import (
 )
 
 from .configuration import (
-    LocalConfiguration
+    LocalConfiguration,
+    JournalConfiguration,
+    SqliteConfiguration,
 )
 
 from .executor import (
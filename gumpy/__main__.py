@@ -6,7 +6,9 @@ import sys
 import threading
 from .console import GumCmd
 from .framework import Framework
-from .configuration import LocalConfiguration
+from .configuration import STORES, open_configuration
+from .supervisor import Supervisor, run_worker
+from .remote import SECRET_ENV
 
 
 def main():
@@ -19,21 +21,94 @@ def main():
     parser.add_argument('-a', '--autostep', default=False,
                         dest='autostep', action='store_true',
                         help='auto push step')
+    parser.add_argument('-l', '--listen', default=None,
+                        dest='listen', metavar='[HOST:]PORT',
+                        help='serve local services to gum:// clients knowing the secret in ${0}, '
+                             'implies --autostep'.format(SECRET_ENV))
+    parser.add_argument('-e', '--event-bus', default=None,
+                        dest='event_bus', metavar='NAME',
+                        help='share events with local frameworks attached to bus NAME')
+    parser.add_argument('--accounting', default=None, type=float,
+                        dest='accounting', metavar='SECONDS',
+                        help='account resources per bundle, sampling every SECONDS (0 samples on demand)')
+    parser.add_argument('--profile-startup', default=None,
+                        dest='profile_startup', metavar='FILE',
+                        help='write startup phases to FILE (.json for chrome trace, folded stacks otherwise)')
+    parser.add_argument('-r', '--hot-reload', default=None, type=float, nargs='?', const=1.0,
+                        dest='hot_reload', metavar='SECONDS',
+                        help='reload changed bundles, restarting only services whose classes changed')
+    parser.add_argument('--watch-configuration', default=None, type=float, nargs='?', const=1.0,
+                        dest='watch_configuration', metavar='SECONDS',
+                        help='deliver external edits of .configuration documents as on_configuration_changed')
+    parser.add_argument('--call-metrics', default=False,
+                        dest='call_metrics', action='store_true',
+                        help='record call counts, errors and latency of every service method')
+    parser.add_argument('-c', '--config-store', default='local', choices=sorted(STORES),
+                        dest='config_store',
+                        help='configuration store: JSON documents (local), append-only journals (journal) '
+                             'or one database shared by processes (sqlite)')
+    parser.add_argument('-w', '--workers', default=0, type=int,
+                        dest='workers', metavar='N',
+                        help='shard bundles over N worker processes')
+    parser.add_argument('--worker', default=None, type=int,
+                        dest='worker', help=argparse.SUPPRESS)
+    parser.add_argument('--directory', default=None,
+                        dest='directory', help=argparse.SUPPRESS)
     args = parser.parse_args()
     pt = os.path.abspath(args.plugins_path)
-    autostep = args.autostep
+    if args.listen and not args.workers and not os.environ.get(SECRET_ENV):
+        parser.error('--listen needs the shared secret of gum:// peers in ${0}'.format(SECRET_ENV))
+    # remote calls are answered on the executor
+    autostep = args.autostep or bool(args.listen and not args.workers)
 
     sys.path.append(pt)
 
     conf_pt = os.path.join(pt, '.configuration')
     if not os.path.isdir(conf_pt):
         os.mkdir(conf_pt)
-    fmk = Framework(LocalConfiguration(conf_pt), pt)
+    if args.worker is not None:
+        host, _, port = args.directory.rpartition(':')
+        run_worker(pt, args.worker, args.workers, (host or '127.0.0.1', int(port)), store=args.config_store)
+        return
+    elif args.workers:
+        host, _, port = (args.listen or '3040').rpartition(':')
+        supervisor = Supervisor(pt, args.workers, host or '127.0.0.1', int(port), store=args.config_store).start()
+        try:
+            supervisor.monitor()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            supervisor.close()
+        return
+    fmk = Framework(open_configuration(conf_pt, args.config_store), pt)
+    if args.listen:
+        host, _, port = args.listen.rpartition(':')
+        fmk.listen(host or '127.0.0.1', int(port))
+    if args.event_bus:
+        fmk.attach_event_bus(args.event_bus)
+    if args.accounting is not None:
+        fmk.enable_accounting(args.accounting)
+    if args.call_metrics:
+        fmk.enable_call_metrics()
+    if args.profile_startup:
+        fmk.enable_profiling()
     cmd = GumCmd(fmk, pt)
+    if args.hot_reload:
+        fmk.watch_bundles(args.hot_reload)
+    if args.watch_configuration:
+        fmk.watch_configuration(args.watch_configuration)
     if autostep:
         t = threading.Thread(target=fmk.__executor__.loop, args=(True, ))
         t.setDaemon(True)
         t.start()
+    if args.profile_startup:
+        if autostep:
+            cmd.startup.wait()
+        else:
+            fmk.__executor__.loop()
+        profiler = fmk.disable_profiling()
+        profiler.write(args.profile_startup)
+        print(profiler.format_summary())
     try:
         cmd.cmdloop()
     finally:
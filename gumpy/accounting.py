@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import threading
+import collections
+from .executor import _cpu_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceAccountant(object):
+    def __init__(self, framework, interval=10.0, trace_memory=True):
+        self._framework = framework
+        self._interval = interval
+        self._trace_memory = bool(trace_memory and tracemalloc)
+        self._started_tracing = False
+        self._lock = threading.Lock()
+        # owner -> [steps, wall time, cpu time]
+        self._usage = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        self._report = None
+        self._closed = threading.Event()
+        self._thread = None
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def record(self, owner, wall, cpu):
+        with self._lock:
+            usage = self._usage[owner]
+            usage[0] += 1
+            usage[1] += wall
+            if cpu is not None:
+                usage[2] += cpu
+
+    def _memory(self, bundles):
+        snapshot = tracemalloc.take_snapshot()
+        memory = {}
+        for bdl in bundles:
+            filters = [tracemalloc.Filter(True, fn) for fn in bdl.source_files()]
+            if filters:
+                stats = snapshot.filter_traces(filters).statistics('filename')
+                memory[bdl.name] = sum(stat.size for stat in stats)
+        return memory
+
+    def sample(self):
+        bundles = list(self._framework.bundles.values())
+        pending = self._framework.__executor__.pending_owners()
+        memory = self._memory(bundles) if self._trace_memory else {}
+        with self._lock:
+            usage = dict((owner, tuple(u)) for owner, u in self._usage.items())
+        report = {}
+        for bdl in bundles:
+            references = [sr for sr in bdl.service_references.values() if sr.is_avaliable]
+            steps, wall, cpu = usage.get(bdl.name, (0, 0.0, 0.0))
+            report[bdl.name] = dict(
+                memory=memory.get(bdl.name),
+                steps=steps,
+                wall_time=wall,
+                # None without a per-thread cpu clock
+                cpu_time=cpu if _cpu_timer else None,
+                services=len(references),
+                futures=pending.get(bdl.name, 0),
+                events=sum(len(sr.events) for sr in references),
+            )
+        self._report = report
+        return report
+
+    def report(self):
+        # the periodic sampler keeps the report fresh, otherwise sample on demand
+        if self._report is None or not self._thread:
+            return self.sample()
+        return self._report
+
+    def _sample_forever(self):
+        while not self._closed.wait(self._interval):
+            try:
+                self.sample()
+            except BaseException as err:
+                logger.exception(err)
+
+    def start(self):
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self._interval:
+            self._thread = threading.Thread(target=self._sample_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
@@ -3,6 +3,10 @@ __author__ = 'chinfeng'
 
 import os
 import json
+import time
+import tempfile
+import sqlite3
+import threading
 
 import logging
 
@@ -30,23 +34,64 @@ class _DictObject(dict):
         return self.get(key)
 
 
+_replace = getattr(os, 'replace', os.rename)
+_MISSING = object()
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True)
+
+
+def _atomic_write(fn, text):
+    # readers see either the old file or the new one, never a truncated document
+    fd, tmp = tempfile.mkstemp(prefix='.{0}.'.format(os.path.basename(fn)), dir=os.path.dirname(fn) or '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _signature(fn):
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size, st.st_ino
+
+
+def _load_document(fn):
+    with open(fn, 'r') as fd:
+        return _DictObject(json.load(fd, object_hook=lambda dct: _DictObject(dct) if type(dct) is dict else dct))
+
+
 class _LocalDocument(object):
-    def __init__(self, fn=None):
-        super(self.__class__, self).__setattr__('_fn', fn)
+    def __init__(self, fn=None, on_dirty=None):
+        _set = super(self.__class__, self).__setattr__
+        _set('_fn', fn)
+        _set('_on_dirty', on_dirty)
+        _set('_lock', threading.RLock())
+        _set('_dirty', False)
+        _set('_dirty_keys', set())
+        _set('_version', 0)
+        _set('_signature', _signature(fn) if fn else None)
         try:
-            with open(fn, 'r') as fd:
-                super(self.__class__, self).__setattr__(
-                    '_dict_object',
-                    _DictObject(json.load(fd, object_hook=lambda dct: _DictObject(dct) if type(dct) is dict else dct)))
+            _set('_dict_object', _load_document(fn))
         except BaseException as err:
-            super(self.__class__, self).__setattr__(
-                '_dict_object', _DictObject())
+            _set('_dict_object', _DictObject())
+        # content as last read or written, catches in-place changes of nested values
+        _set('_written', _dumps(self._dict_object))
 
     def __setattr__(self, key, value):
         if key in dir(self):
             super(self.__class__, self).__setattr__(key, value)
         else:
-            self._dict_object[key] = value
+            self.__setitem__(key, value)
 
     def __getattr__(self, key):
         try:
@@ -55,19 +100,25 @@ class _LocalDocument(object):
             return self._dict_object[key]
 
     def __setitem__(self, key, value):
-        self.__setattr__(key, value)
+        if self._dict_object.get(key, _MISSING) != value:
+            self._dict_object[key] = value
+            self.touch(key)
+        else:
+            self._dict_object[key] = value
 
     def __getitem__(self, item):
         return self.__getattr__(item)
 
     def pop(self, key):
-        return self._dict_object.pop(key)
+        value = self._dict_object.pop(key)
+        self.touch(key)
+        return value
 
     def get(self, key, default=None):
         return self._dict_object.get(key, default)
 
     def set(self, key, value):
-        return self._dict_object.set(key, value)
+        self.__setattr__(key, value)
 
     def keys(self):
         return self._dict_object.keys()
@@ -81,56 +132,673 @@ class _LocalDocument(object):
     def __iter__(self):
         return self._dict_object.__iter__()
 
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @property
+    def version(self):
+        # moves on every change made through the document, not on in-place edits of nested values
+        return self._version
+
+    def touch(self, key=None):
+        if key is not None:
+            self._dirty_keys.add(key)
+        super(self.__class__, self).__setattr__('_version', self._version + 1)
+        super(self.__class__, self).__setattr__('_dirty', True)
+        if self._on_dirty:
+            self._on_dirty(self)
+
+    def discard(self):
+        super(self.__class__, self).__setattr__('_dirty', False)
+        super(self.__class__, self).__setattr__('_on_dirty', None)
+        super(self.__class__, self).__setattr__('_fn', None)
+        # tells holders of this document that it was replaced
+        super(self.__class__, self).__setattr__('_version', self._version + 1)
+
     def persist(self):
-        if self._fn:
-            with open(self._fn, 'w') as fd:
-                json.dump(self._dict_object, fd)
+        with self._lock:
+            if not self._fn or not self._dirty:
+                return False
+            super(self.__class__, self).__setattr__('_dirty', False)
+            try:
+                text = _dumps(self._dict_object)
+                if text == self._written:
+                    # the keys ended up as written, later edits of the file apply to them again
+                    self._dirty_keys.clear()
+                    return False
+                _atomic_write(self._fn, text)
+            except BaseException:
+                super(self.__class__, self).__setattr__('_dirty', True)
+                raise
+            super(self.__class__, self).__setattr__('_written', text)
+            super(self.__class__, self).__setattr__('_signature', _signature(self._fn))
+            self._dirty_keys.clear()
+            return True
+
+    def refresh(self):
+        # apply changes someone else made to the file, returning them key by key
+        with self._lock:
+            if not self._fn:
+                return {}
+            signature = _signature(self._fn)
+            if signature == self._signature:
+                return {}
+            try:
+                data = _load_document(self._fn) if signature else _DictObject()
+            except (IOError, OSError, ValueError) as err:
+                # most likely caught halfway through a write, the next poll tries again
+                logger.warning('configuration {0} unreadable: {1}'.format(self._fn, err))
+                return {}
+            super(self.__class__, self).__setattr__('_signature', signature)
+            super(self.__class__, self).__setattr__('_written', _dumps(data))
+            changes = {}
+            for key in set(data) | set(self._dict_object):
+                if key in self._dirty_keys:
+                    # a local change not written yet is newer than the file
+                    continue
+                if key not in data:
+                    self._dict_object.pop(key)
+                    changes[key] = None
+                elif self._dict_object.get(key, _MISSING) != data[key]:
+                    self._dict_object[key] = data[key]
+                    changes[key] = data[key]
+            if changes:
+                super(self.__class__, self).__setattr__('_version', self._version + 1)
+            return changes
 
     def close(self):
-        self.persist()
+        if self._fn and not self._dirty and _dumps(self._dict_object) != self._written:
+            super(self.__class__, self).__setattr__('_dirty', True)
+        return self.persist()
 
     def __del__(self):
-        self.close()
+        try:
+            self.close()
+        except BaseException as err:
+            logger.exception(err)
+
+
+class _WriteBehind(object):
+    def __init__(self, delay, action=lambda doc: doc.persist()):
+        self._delay = delay
+        self._action = action
+        self._cond = threading.Condition()
+        self._pending = []
+        self._due = None
+        self._closed = False
+        self._thread = None
+
+    def schedule(self, doc):
+        with self._cond:
+            if doc in self._pending:
+                return
+            self._pending.append(doc)
+            if self._due is None:
+                # later changes inside the window ride along with the first one
+                self._due = time.time() + self._delay
+            if not self._thread:
+                self._closed = False
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _take(self):
+        with self._cond:
+            docs, self._pending, self._due = self._pending, [], None
+        return docs
+
+    def flush(self):
+        written = 0
+        for doc in self._take():
+            try:
+                written += bool(self._action(doc))
+            except BaseException as err:
+                logger.exception(err)
+        return written
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (self._due is None or self._due > time.time()):
+                    self._cond.wait(None if self._due is None else max(self._due - time.time(), 0))
+                if self._closed:
+                    return
+            self.flush()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread, self._thread = self._thread, None
+        if thread and thread is not threading.current_thread():
+            thread.join()
+        return self.flush()
 
 
 class LocalConfiguration(Configuration):
-    def __init__(self, path=None):
+    def __init__(self, path=None, flush_delay=1.0):
         if path and os.path.isdir(path):
             self._dir = os.path.abspath(path)
         else:
             self._dir = None
         self._docs = {}
+        self._writer = _WriteBehind(flush_delay) if flush_delay else None
+
+    def _open(self, key):
+        on_dirty = self._writer.schedule if self._writer else None
+        if self._dir:
+            return _LocalDocument(os.path.join(self._dir, key), on_dirty)
+        return _LocalDocument()
 
     def __getattr__(self, key):
-        if key in self._docs:
-            return self._docs[key]
+        if key.startswith('_'):
+            raise AttributeError(key)
+        return self.__getitem__(key)
 
-        if self._dir:
-            fn = os.path.join(self._dir, key)
-            self._docs[key] = _LocalDocument(fn)
+    def __getitem__(self, item):
+        if item not in self._docs:
+            self._docs[item] = self._open(item)
+        return self._docs[item]
+
+    def __del__(self):
+        if '_docs' in self.__dict__:
+            self.close()
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+        for doc in list(self._docs.values()):
+            doc.close()
+
+    def flush(self):
+        if self._writer:
+            return self._writer.flush()
+        return sum(doc.persist() for doc in list(self._docs.values()))
+
+    def persist(self):
+        for doc in list(self._docs.values()):
+            doc.persist()
+
+    def poll_changes(self, names=None):
+        # only documents whose mtime, size or inode moved are read again
+        changes = {}
+        for name in (list(self._docs) if names is None else names):
+            diff = self[name].refresh()
+            if diff:
+                changes[name] = diff
+        return changes
+
+    def reload(self):
+        for key in list(self._docs):
+            # changes not yet written are dropped in favour of the files
+            self._docs[key].discard()
+            self._docs[key] = self._open(key)
+
+
+class _JournalDocument(object):
+    def __init__(self, fn, on_append=None):
+        _set = super(self.__class__, self).__setattr__
+        _set('_fn', fn)
+        _set('_journal_fn', fn + '.journal')
+        _set('_on_append', on_append)
+        _set('_lock', threading.RLock())
+        _set('_journal', None)
+        _set('_records', 0)
+        _set('_version', 0)
+        _set('_signature', None)
+        self._replay()
+
+    def _replay(self, repair=True):
+        _set = super(self.__class__, self).__setattr__
+        # taken before reading, an append racing the read shows up on the next refresh
+        _set('_signature', (_signature(self._fn), _signature(self._journal_fn)))
+        try:
+            with open(self._fn, 'r') as fd:
+                data = _DictObject(json.load(fd, object_hook=lambda dct: _DictObject(dct) if type(dct) is dict else dct))
+        except BaseException as err:
+            data = _DictObject()
+        records = 0
+        if os.path.exists(self._journal_fn):
+            size = 0
+            with open(self._journal_fn, 'r') as fd:
+                for line in fd:
+                    if not line.endswith('\n'):
+                        if not repair:
+                            # another process is appending it right now
+                            break
+                        # a torn last line from an interrupted append, cut it before appending again
+                        logger.warning('drop torn journal record in {0}'.format(self._journal_fn))
+                        with open(self._journal_fn, 'r+') as journal:
+                            journal.truncate(size)
+                        break
+                    size += len(line)
+                    try:
+                        record = json.loads(line, object_hook=lambda dct: _DictObject(dct))
+                    except ValueError:
+                        logger.warning('skip broken journal record in {0}'.format(self._journal_fn))
+                        continue
+                    if 'v' in record:
+                        data[record['k']] = record['v']
+                    else:
+                        data.pop(record['k'], None)
+                    records += 1
+        _set('_dict_object', data)
+        _set('_records', records)
+
+    def _append(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            if self._journal is None:
+                super(self.__class__, self).__setattr__('_journal', open(self._journal_fn, 'a'))
+            self._journal.write(line)
+            self._journal.flush()
+            super(self.__class__, self).__setattr__('_records', self._records + 1)
+            super(self.__class__, self).__setattr__('_version', self._version + 1)
+        if self._on_append:
+            self._on_append(self)
+
+    def __setattr__(self, key, value):
+        if key in dir(self):
+            super(self.__class__, self).__setattr__(key, value)
         else:
-            self._docs[key] = _LocalDocument()
-        return self._docs[key]
+            self.__setitem__(key, value)
+
+    def __getattr__(self, key):
+        try:
+            return super(self.__class__, self).__getattr__(key)
+        except AttributeError:
+            return self._dict_object[key]
+
+    def __setitem__(self, key, value):
+        if self._dict_object.get(key, _MISSING) != value:
+            with self._lock:
+                self._dict_object[key] = value
+                self._append(dict(k=key, v=value))
 
     def __getitem__(self, item):
         return self.__getattr__(item)
 
-    def __del__(self):
+    def pop(self, key):
+        with self._lock:
+            value = self._dict_object.pop(key)
+            self._append(dict(k=key))
+        return value
+
+    def get(self, key, default=None):
+        return self._dict_object.get(key, default)
+
+    def set(self, key, value):
+        self.__setattr__(key, value)
+
+    def keys(self):
+        return self._dict_object.keys()
+
+    def values(self):
+        return self._dict_object.values()
+
+    def items(self):
+        return self._dict_object.items()
+
+    def __iter__(self):
+        return self._dict_object.__iter__()
+
+    def touch(self, key):
+        # journal a value changed in place
+        with self._lock:
+            self._append(dict(k=key, v=self._dict_object[key]))
+
+    @property
+    def records(self):
+        return self._records
+
+    @property
+    def version(self):
+        return self._version
+
+    def refresh(self):
+        # apply what other processes appended or compacted, returning the changes key by key
+        with self._lock:
+            if (_signature(self._fn), _signature(self._journal_fn)) == self._signature:
+                return {}
+            previous = self._dict_object
+            self._replay(repair=False)
+            changes = {}
+            for key in set(previous) | set(self._dict_object):
+                if key not in self._dict_object:
+                    changes[key] = None
+                elif previous.get(key, _MISSING) != self._dict_object[key]:
+                    changes[key] = self._dict_object[key]
+            if changes:
+                super(self.__class__, self).__setattr__('_version', self._version + 1)
+            return changes
+
+    def should_compact(self, min_records, ratio):
+        return self._records >= max(min_records, ratio * len(self._dict_object))
+
+    def compact(self):
+        with self._lock:
+            if not self._records:
+                return False
+            _atomic_write(self._fn, _dumps(self._dict_object))
+            # replaying a journal over the newer snapshot is harmless, so a crash here loses nothing
+            if self._journal is not None:
+                self._journal.close()
+            with open(self._journal_fn, 'w'):
+                pass
+            super(self.__class__, self).__setattr__('_journal', None)
+            super(self.__class__, self).__setattr__('_records', 0)
+            return True
+
+    def persist(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self.persist()
+                self._journal.close()
+                super(self.__class__, self).__setattr__('_journal', None)
+
+    def discard(self):
         self.close()
+        super(self.__class__, self).__setattr__('_version', self._version + 1)
+
+    def __del__(self):
+        try:
+            self.close()
+        except BaseException as err:
+            logger.exception(err)
+
+
+class JournalConfiguration(Configuration):
+    def __init__(self, path, compact_delay=5.0, compact_records=1000, compact_ratio=4):
+        self._dir = os.path.abspath(path)
+        if not os.path.isdir(self._dir):
+            os.makedirs(self._dir)
+        self._docs = {}
+        self._compact_records = compact_records
+        self._compact_ratio = compact_ratio
+        self._compactor = _WriteBehind(compact_delay, lambda doc: doc.compact()) if compact_delay else None
+
+    def _on_append(self, doc):
+        if self._compactor and doc.should_compact(self._compact_records, self._compact_ratio):
+            self._compactor.schedule(doc)
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        return self.__getitem__(key)
+
+    def __getitem__(self, item):
+        if item not in self._docs:
+            self._docs[item] = _JournalDocument(os.path.join(self._dir, item), self._on_append)
+        return self._docs[item]
+
+    def __del__(self):
+        if '_docs' in self.__dict__:
+            self.close()
+
+    def compact(self):
+        return sum(doc.compact() for doc in list(self._docs.values()))
 
     def close(self):
-        for doc in self._docs.values():
+        if self._compactor:
+            self._compactor.close()
+        for doc in list(self._docs.values()):
             doc.close()
 
     def persist(self):
-        for doc in self._docs.values():
+        for doc in list(self._docs.values()):
             doc.persist()
 
+    def poll_changes(self, names=None):
+        # only documents whose snapshot or journal moved are replayed
+        changes = {}
+        for name in (list(self._docs) if names is None else names):
+            diff = self[name].refresh()
+            if diff:
+                changes[name] = diff
+        return changes
+
     def reload(self):
-        if self._dir:
-            for key in self._docs:
-                fn = os.path.join(self._dir, key)
-                self._docs[key] = _LocalDocument(fn)
+        for key, doc in list(self._docs.items()):
+            doc.discard()
+            self._docs[key] = _JournalDocument(doc._fn, self._on_append)
+
+
+def _loads(text):
+    return json.loads(text, object_hook=lambda dct: _DictObject(dct) if type(dct) is dict else dct)
+
+
+class _SqliteDocument(object):
+    def __init__(self, store, name):
+        super(self.__class__, self).__setattr__('_store', store)
+        super(self.__class__, self).__setattr__('_name', name)
+
+    def __setattr__(self, key, value):
+        if key in dir(self):
+            super(self.__class__, self).__setattr__(key, value)
         else:
-            for key in self._docs:
-                self._docs[key] = _LocalDocument()
+            self.__setitem__(key, value)
+
+    def __getattr__(self, key):
+        try:
+            return super(self.__class__, self).__getattr__(key)
+        except AttributeError:
+            value = self._store.lookup(self._name, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+
+    def __setitem__(self, key, value):
+        self._store.put(self._name, key, value)
+
+    def __getitem__(self, item):
+        return self.__getattr__(item)
+
+    def pop(self, key):
+        value = self.__getattr__(key)
+        self._store.delete(self._name, key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._store.lookup(self._name, key)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        self._store.put(self._name, key, value)
+
+    def keys(self):
+        return self._store.document(self._name).keys()
+
+    def values(self):
+        return self._store.document(self._name).values()
+
+    def items(self):
+        return self._store.document(self._name).items()
+
+    def __iter__(self):
+        return iter(list(self.keys()))
+
+    @property
+    def version(self):
+        return self._store.version
+
+    def persist(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteConfiguration(Configuration):
+    def __init__(self, path, timeout=30.0, check_interval=0.1):
+        if os.path.isdir(path):
+            path = os.path.join(path, 'configuration.db')
+        self._path = os.path.abspath(path)
+        self._timeout = timeout
+        self._check_interval = check_interval
+        self._checked = None
+        self._lock = threading.RLock()
+        self._db = None
+        self._docs = {}
+        # document -> {key: value or _MISSING}, shared by all documents of this store
+        self._cache = {}
+        self._complete = set()
+        self._data_version = None
+        self._version = 0
+        # document -> values at the last poll_changes, local writes are applied to it as they happen
+        self._polled = {}
+        self._polled_version = None
+        self._connect()
+
+    def _connect(self):
+        # close() only releases the connection, the next access opens it again
+        if self._db is None:
+            db = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS configuration ('
+                'document TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (document, key))')
+            self._db = db
+            self._data_version = None
+        return self._db
+
+    def _validate(self):
+        # data_version moves when another connection, in any process, commits
+        version = self._connect().execute('PRAGMA data_version').fetchone()[0]
+        self._checked = time.time()
+        if version != self._data_version:
+            self._cache.clear()
+            self._complete.clear()
+            self._data_version = version
+            self._version += 1
+
+    @property
+    def version(self):
+        # own writes move it at once, commits of other connections are looked for every check_interval
+        checked = self._checked
+        if checked is not None and time.time() - checked < self._check_interval:
+            return self._version
+        with self._lock:
+            self._validate()
+            return self._version
+
+    def lookup(self, document, key):
+        with self._lock:
+            self._validate()
+            cached = self._cache.setdefault(document, {})
+            if key in cached:
+                return cached[key]
+            if document in self._complete:
+                return _MISSING
+            row = self._db.execute(
+                'SELECT value FROM configuration WHERE document = ? AND key = ?', (document, key)).fetchone()
+            cached[key] = _loads(row[0]) if row else _MISSING
+            return cached[key]
+
+    def document(self, name):
+        with self._lock:
+            self._validate()
+            if name not in self._complete:
+                self._cache[name] = dict(
+                    (key, _loads(value)) for key, value in
+                    self._db.execute('SELECT key, value FROM configuration WHERE document = ?', (name, )))
+                self._complete.add(name)
+            return dict((k, v) for k, v in self._cache[name].items() if v is not _MISSING)
+
+    def _write(self, sql, args):
+        with self._lock:
+            # take the write lock up front so concurrent writers wait on busy_timeout instead of failing
+            db = self._connect()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                self._validate()
+                db.execute(sql, args)
+                db.execute('COMMIT')
+                self._version += 1
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def put(self, document, key, value):
+        if self.lookup(document, key) == value:
+            return
+        text = json.dumps(value, sort_keys=True)
+        with self._lock:
+            self._write('INSERT OR REPLACE INTO configuration (document, key, value) VALUES (?, ?, ?)',
+                        (document, key, text))
+            self._cache.setdefault(document, {})[key] = _loads(text)
+            if document in self._polled:
+                self._polled[document][key] = _loads(text)
+
+    def delete(self, document, key):
+        with self._lock:
+            self._write('DELETE FROM configuration WHERE document = ? AND key = ?', (document, key))
+            self._cache.setdefault(document, {})[key] = _MISSING
+            if document in self._polled:
+                self._polled[document].pop(key, None)
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        return self.__getitem__(key)
+
+    def __getitem__(self, item):
+        if item not in self._docs:
+            self._docs[item] = _SqliteDocument(self, item)
+        return self._docs[item]
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+
+    def persist(self):
+        pass
+
+    def poll_changes(self, names=None):
+        # commits of other connections move data_version, documents are read again only then
+        with self._lock:
+            names = list(self._docs) if names is None else names
+            self._validate()
+            if self._version == self._polled_version and all(name in self._polled for name in names):
+                return {}
+            self._polled_version = self._version
+            changes = {}
+            for name in names:
+                current = self.document(name)
+                previous = self._polled.get(name)
+                self._polled[name] = current
+                if previous is None:
+                    # a document polled for the first time is the baseline
+                    continue
+                diff = {}
+                for key in set(previous) | set(current):
+                    if key not in current:
+                        diff[key] = None
+                    elif previous.get(key, _MISSING) != current[key]:
+                        diff[key] = current[key]
+                if diff:
+                    changes[name] = diff
+            return changes
+
+    def reload(self):
+        with self._lock:
+            self._cache.clear()
+            self._complete.clear()
+            self._version += 1
+
+
+STORES = dict(local=LocalConfiguration, journal=JournalConfiguration, sqlite=SqliteConfiguration)
+
+
+def open_configuration(path, store='local'):
+    return STORES[store](path)
@@ -12,7 +12,7 @@ class GumCmd(Cmd):
         self._framework = framework
         self._plugins_path = os.path.abspath(plugins_path)
 
-        self._framework.restore_state()
+        self.startup = self._framework.restore_state()
 
         self.intro = 'Gumpy runtime console'
         self.prompt = '>>> '
@@ -58,8 +58,16 @@ class GumCmd(Cmd):
 
     def do_list(self, line):
         print(' ========================================================')
+        usage = self._framework.resource_usage()
         for bdl in self._framework.bundles.values():
             print('  BUNDLE: {:<24}{:}'.format(bdl.name, '(STATUS: %s)' % bdl.state[1]))
+            if bdl.name in usage:
+                u = usage[bdl.name]
+                print('    memory: {0}  cpu: {1}  wall: {2:.3f}s  steps: {3}'.format(
+                    '-' if u['memory'] is None else '%.1fKiB' % (u['memory'] / 1024.0),
+                    '-' if u['cpu_time'] is None else '%.3fs' % u['cpu_time'], u['wall_time'], u['steps']))
+                print('    services: {0}  futures: {1}  events: {2}'.format(
+                    u['services'], u['futures'], u['events']))
             print('  ------------------------------------------------------')
             for sr in bdl.service_references.values():
                 print('    [ SERVICE: {:<24}{:} ]'.format(sr.name, 'satisfied' if sr.is_satisfied else 'unsatisfied'))
@@ -103,6 +111,26 @@ class GumCmd(Cmd):
         else:
             print('bundle not found')
 
+    def do_uninstall(self, line):
+        if line[-1] == '&':
+            async = True
+            bn = line[:-1]
+        else:
+            async = False
+            bn = line
+
+        if bn in self._framework.bundles:
+            try:
+                f = self._framework.uninstall_bundle(bn)
+                if not async:
+                    f.wait()
+                    if not f.result():
+                        print('bundle uninstalled, but its module is still referenced')
+            except:
+                print(traceback.format_exc())
+        else:
+            print('bundle not found')
+
     def do_call(self, line):
         try:
             service_uri, call_caluse = line.split('.', 1)
@@ -118,7 +146,6 @@ class GumCmd(Cmd):
             conf[key] = val
             evt = self._framework.bundles[bn].em.on_configuration_changed
             evt.send(key, val)
-            conf.persist()
         except:
             print(traceback.format_exc())
 
@@ -5,7 +5,7 @@ import functools
 
 from .framework import (
     Consumer, Annotation, ServiceAnnotation, Task,
-    EventSlot, Activator, Deactivator, Requirement)
+    EventSlot, Activator, Deactivator, Requirement, CachedCall)
 
 
 class _RequirementHepler(object):
@@ -23,28 +23,33 @@ require = lambda *args, **kwargs: functools.partial(_RequirementHepler, args=arg
 
 
 class _ConsumerHelper(object):
-    def __init__(self, fn, resource_uri, cardinality):
+    def __init__(self, fn, resource_uri, cardinality, filter_expr=None):
         assert (cardinality in ('0..1', '0..n', '1..1', '1..n'))
         self._fn = fn
         self._resource_uri = resource_uri
         self._cardinality = cardinality
+        self._filter_expr = filter_expr
         self._unbind_fn = lambda instance, service: None
-        self._consumers = {}
 
     def __get__(self, instance, owner):
+        # the consumer lives on its instance, so it goes away together with the instance
         _inst = instance or owner
-        _id = id(_inst)
-        if _id not in self._consumers:
-            self._consumers[_id] = Consumer(_inst, self._fn, self._unbind_fn, self._resource_uri, self._cardinality)
-        return self._consumers[_id]
+        key = '__consumer_{0}'.format(id(self))
+        try:
+            return _inst.__dict__[key]
+        except KeyError:
+            consumer = Consumer(_inst, self._fn, self._unbind_fn, self._resource_uri, self._cardinality,
+                                self._filter_expr)
+            setattr(_inst, key, consumer)
+            return consumer
 
     def unbind(self, fn):
         self._unbind_fn = fn
         return self
 
 
-bind = lambda resource, cardinality='1..n': functools.partial(_ConsumerHelper, resource_uri=resource,
-                                                              cardinality=cardinality)
+bind = lambda resource, cardinality='1..n', filter=None: functools.partial(
+    _ConsumerHelper, resource_uri=resource, cardinality=cardinality, filter_expr=filter)
 
 
 class _EventHepler(object):
@@ -61,22 +66,46 @@ class _EventHepler(object):
 event = _EventHepler
 
 
+class _CachedHelper(object):
+    def __init__(self, fn, maxsize, ttl, invalidate_on):
+        self._fn = fn
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._invalidate_on = invalidate_on
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self._fn
+        # one cache per instance, kept beside it like the consumers
+        key = '__cached_{0}'.format(id(self))
+        try:
+            return instance.__dict__[key]
+        except KeyError:
+            cache = CachedCall(instance, self._fn, self._maxsize, self._ttl, self._invalidate_on)
+            setattr(instance, key, cache)
+            return cache
+
+
+cached = lambda maxsize=128, ttl=None, invalidate_on=('on_configuration_changed', ): functools.partial(
+    _CachedHelper, maxsize=maxsize, ttl=ttl, invalidate_on=invalidate_on)
+
+
 def configuration(**config_map):
+    # resolved once here: (parameter, configuration key, default)
+    fields = []
+    for p, c in config_map.items():
+        if isinstance(c, str):
+            fields.append((p, c, None))
+        elif isinstance(c, (tuple, list)) and isinstance(c[0], str):
+            fields.append((p, c[0], c[1] if len(c) > 1 else None))
+    fields = tuple(fields)
+
     def deco(func):
         def configuration_injected_func(self, *args, **kwargs):
+            config = self.__reference__.__context__.configuration_snapshot
             _kwargs = kwargs.copy()
-            config = self.__reference__.__context__.configuration
-            for p, c in config_map.items():
-                try:
-                    if isinstance(c, str):
-                        ck, default = c, None
-                    elif isinstance(c, (tuple, list)) and isinstance(c[0], str):
-                        ck, default = c[0], c[1] if len(c) > 1 else None
-                    else:
-                        break
-                    _kwargs[p] = config.get(ck, default)
-                except KeyError:
-                    pass
+            for p, ck, default in fields:
+                _kwargs[p] = config.get(ck, default)
             return func(self, *args, **_kwargs)
 
         return configuration_injected_func
@@ -97,6 +126,7 @@ class deactivate(Annotation):
 
 
 provide = lambda provides: functools.partial(Annotation, provides=provides)
+properties = lambda **props: functools.partial(Annotation, properties=props)
 service = lambda name: ServiceAnnotation(name) if not isinstance(name, str) else functools.partial(ServiceAnnotation,
                                                                                                    name=name)
 
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import os
+import mmap
+import time
+import errno
+import random
+import select
+import socket
+import struct
+import tempfile
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from .remote import loads
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED = fcntl is not None
+
+# segment header: magic, slot count, slot size; the 8 byte head counter lives at _HEAD_OFFSET
+_MAGIC = b'GUMB'
+_META = struct.Struct('<4sII')
+_COUNTER = struct.Struct('<Q')
+_HEAD_OFFSET = 16
+_HEADER_SIZE = 64
+# slot header: sequence number, publisher id, payload length
+_SLOT_ORIGIN = struct.Struct('<QI')
+_SLOT_HEADER_SIZE = _COUNTER.size + _SLOT_ORIGIN.size
+_PICKLE_PROTOCOL = 2
+
+
+class _Segment(object):
+    def __init__(self, name, size):
+        self._shm = None
+        self._mmap = None
+        if shared_memory:
+            try:
+                self._shm = shared_memory.SharedMemory('gumpy-' + name, True, size)
+            except FileExistsError:
+                self._shm = shared_memory.SharedMemory('gumpy-' + name)
+            try:
+                # the segment outlives any single process, keep the tracker from unlinking it
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+            except (ImportError, AttributeError):
+                pass
+            self.buf = self._shm.buf
+        else:
+            fd = os.open(_segment_path(name), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size == 0:
+                    os.ftruncate(fd, size)
+                self._mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+            finally:
+                os.close(fd)
+            self.buf = self._mmap
+
+    def close(self):
+        self.buf = None
+        if self._shm:
+            self._shm.close()
+        if self._mmap:
+            self._mmap.close()
+
+
+def _segment_path(name):
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'gumpy-' + name)
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), 'gumpy-{0}.lock'.format(name))
+
+
+def _bells_path(name):
+    return os.path.join(tempfile.gettempdir(), 'gumpy-{0}.bells'.format(name))
+
+
+def unlink(name):
+    if shared_memory:
+        try:
+            shm = shared_memory.SharedMemory('gumpy-' + name)
+        except OSError:
+            pass
+        else:
+            shm.close()
+            shm.unlink()
+    for pt in (_segment_path(name), _lock_path(name)):
+        if os.path.exists(pt):
+            os.remove(pt)
+    bells = _bells_path(name)
+    if os.path.isdir(bells):
+        for entry in os.listdir(bells):
+            os.remove(os.path.join(bells, entry))
+        os.rmdir(bells)
+
+
+# a subscriber spins a little after each event, then sleeps on a unix datagram socket of its own, the
+# doorbell; publishers ring every doorbell of the bus after writing a slot
+class EventBus(object):
+    def __init__(self, name='gumpy', slots=1024, slot_size=1024, spin=200, max_wait=1.0):
+        self._name = name
+        self._origin = random.SystemRandom().getrandbits(63) + 1
+        self._spin = spin
+        self._max_wait = max_wait
+        self._bell = None
+        self._ringer = None
+        self._handlers = []
+        self._thread_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        self._lost = 0
+        self._lock_fd = os.open(_lock_path(name), os.O_RDWR | os.O_CREAT, 0o600)
+        self._flock()
+        try:
+            self._segment = _Segment(name, _HEADER_SIZE + slots * slot_size)
+            buf = self._segment.buf
+            magic, self._slots, self._slot_size = _META.unpack_from(buf, 0)
+            if magic != _MAGIC:
+                self._slots, self._slot_size = slots, slot_size
+                _COUNTER.pack_into(buf, _HEAD_OFFSET, 1)
+                _META.pack_into(buf, 0, _MAGIC, slots, slot_size)
+        finally:
+            self._funlock()
+        self._next = self.head
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def head(self):
+        return _COUNTER.unpack_from(self._segment.buf, _HEAD_OFFSET)[0]
+
+    @property
+    def lost(self):
+        return self._lost
+
+    def _flock(self):
+        self._thread_lock.acquire()
+        if fcntl:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+
+    def _funlock(self):
+        if fcntl:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def _offset(self, seq):
+        return _HEADER_SIZE + (seq % self._slots) * self._slot_size
+
+    def publish(self, name, args=(), kwargs=None):
+        payload = pickle.dumps((name, tuple(args), kwargs or {}), _PICKLE_PROTOCOL)
+        if len(payload) > self._slot_size - _SLOT_HEADER_SIZE:
+            raise ValueError('event {0} payload of {1} bytes exceeds slot size'.format(name, len(payload)))
+        buf = self._segment.buf
+        self._flock()
+        try:
+            seq = _COUNTER.unpack_from(buf, _HEAD_OFFSET)[0]
+            offset = self._offset(seq)
+            # seqlock: the slot reads as busy until its sequence number is written last
+            _COUNTER.pack_into(buf, offset, 0)
+            _SLOT_ORIGIN.pack_into(buf, offset + _COUNTER.size, self._origin, len(payload))
+            buf[offset + _SLOT_HEADER_SIZE:offset + _SLOT_HEADER_SIZE + len(payload)] = payload
+            _COUNTER.pack_into(buf, offset, seq)
+            _COUNTER.pack_into(buf, _HEAD_OFFSET, seq + 1)
+        finally:
+            self._funlock()
+        self._ring()
+        return seq
+
+    def _bell_path(self, origin):
+        return os.path.join(_bells_path(self._name), str(origin))
+
+    def _ring(self, origins=None):
+        bells = _bells_path(self._name)
+        if origins is None:
+            try:
+                origins = [entry for entry in os.listdir(bells) if entry != str(self._origin)]
+            except OSError:
+                return
+        if origins and self._ringer is None:
+            self._ringer = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._ringer.setblocking(False)
+        for origin in origins:
+            pt = os.path.join(bells, str(origin))
+            try:
+                self._ringer.sendto(b'\0', pt)
+            except socket.error as err:
+                # a full bell has woken its subscriber already, a refused one was left by a dead subscriber
+                if err.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    try:
+                        os.remove(pt)
+                    except OSError:
+                        pass
+
+    def _open_bell(self):
+        bells = _bells_path(self._name)
+        try:
+            os.mkdir(bells, 0o700)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        self._bell = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._bell.bind(self._bell_path(self._origin))
+        self._bell.setblocking(False)
+
+    def _close_bell(self):
+        if self._bell:
+            self._bell.close()
+            self._bell = None
+            try:
+                os.remove(self._bell_path(self._origin))
+            except OSError:
+                pass
+        if self._ringer:
+            self._ringer.close()
+            self._ringer = None
+
+    def _wait(self):
+        # drain the rings, the head counter tells what is new
+        readable, _, _ = select.select([self._bell], [], [], self._max_wait)
+        try:
+            while readable:
+                self._bell.recv(64)
+        except socket.error:
+            pass
+
+    def _read(self, seq):
+        buf = self._segment.buf
+        offset = self._offset(seq)
+        if _COUNTER.unpack_from(buf, offset)[0] != seq:
+            return None
+        origin, length = _SLOT_ORIGIN.unpack_from(buf, offset + _COUNTER.size)
+        data = bytes(buf[offset + _SLOT_HEADER_SIZE:offset + _SLOT_HEADER_SIZE + length])
+        if _COUNTER.unpack_from(buf, offset)[0] != seq:
+            return None
+        return origin, data
+
+    def poll(self):
+        head = self.head
+        if head - self._next > self._slots:
+            self._lost += head - self._next - self._slots
+            self._next = head - self._slots
+        delivered = 0
+        while self._next < head:
+            slot = self._read(self._next)
+            self._next += 1
+            if slot is None:
+                self._lost += 1
+            elif slot[0] != self._origin:
+                try:
+                    # any local process can write the segment, decode plain data only
+                    name, args, kwargs = loads(slot[1])
+                except BaseException as err:
+                    logger.warning('dropping undecodable event {0}: {1!r}'.format(self._next - 1, err))
+                    self._lost += 1
+                    continue
+                for handler in list(self._handlers):
+                    try:
+                        handler(name, args, kwargs)
+                    except BaseException as err:
+                        logger.exception(err)
+                delivered += 1
+        return delivered
+
+    def _poll_forever(self):
+        idle = 0
+        while not self._closed.is_set():
+            if self._next < self.head:
+                self.poll()
+                idle = 0
+            elif idle < self._spin:
+                idle += 1
+                time.sleep(0)
+            else:
+                self._wait()
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+        if not self._thread:
+            self._open_bell()
+            self._thread = threading.Thread(target=self._poll_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def unsubscribe(self, handler):
+        self._handlers.remove(handler)
+
+    def close(self):
+        self._closed.set()
+        if self._thread:
+            self._ring((self._origin, ))
+            self._thread.join()
+            self._thread = None
+        self._close_bell()
+        self._segment.close()
+        os.close(self._lock_fd)
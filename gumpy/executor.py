@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 __author__ = 'Chinfeng'
 
+import sys
+import time
 from types import GeneratorType
-from collections import deque
+from collections import deque, Counter
 from inspect import isgeneratorfunction
 from functools import partial
-from threading import current_thread, Lock, Event, ThreadError
+from threading import current_thread, Lock, RLock, Event, ThreadError
 
 try:
     from queue import Queue, Empty
@@ -15,6 +17,39 @@ except ImportError:
 import logging
 logger = logging.getLogger(__name__)
 
+try:
+    _timer = time.perf_counter
+except AttributeError:
+    _timer = time.time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# cpu time of the calling thread only, None where there is no per-thread clock; process time would
+# charge every other thread (pollers, remote connections ...) to whichever task happens to run
+def _thread_rusage_timer():
+    # RUSAGE_THREAD is 1 on linux, python 2 does not name it
+    who = getattr(resource, 'RUSAGE_THREAD', 1 if sys.platform.startswith('linux') else None)
+    if who is None:
+        return None
+    try:
+        resource.getrusage(who)
+    except (ValueError, OSError, resource.error):
+        return None
+
+    def _thread_cpu():
+        usage = resource.getrusage(who)
+        return usage.ru_utime + usage.ru_stime
+    return _thread_cpu
+
+
+try:
+    _cpu_timer = time.thread_time
+except AttributeError:
+    _cpu_timer = _thread_rusage_timer() if resource else None
+
 
 def _is_gen(fn):
     return isgeneratorfunction(fn) or (isinstance(fn, partial) and isgeneratorfunction(fn.func))
@@ -55,57 +90,91 @@ class CloseableQueue(Queue):
         self._close_event.wait()
 
 
+def _notify_done(future, callback):
+    try:
+        while True:
+            yield
+    finally:
+        callback(future)
+
+
+def on_done(future, callback):
+    # the future closes generator consumers when it is done, even one added afterwards
+    future.add_consumer(partial(_notify_done, future, callback))
+
+
+class WaitFor(object):
+    # yielded by a task to sleep until the futures are done, instead of polling them every step
+    def __init__(self, futures):
+        self.futures = list(futures)
+
+
 class Future(object):
     def __init__(self, executor):
         self._executor = executor
         self._exc = None
         self._done = False
-        self._lock = Lock()
+        self._lock = RLock()
         self._consumers = []
         self._error_callbacks = []
         self._result_cache = []
 
     def set_done(self):
-        for c in self._consumers:
-            if isinstance(c, GeneratorType):
-                c.close()
-        self._done = True
-
-    def consume_result(self, result):
-        if self._done:
-            raise RuntimeError('result receive after future close')
-        else:
+        with self._lock:
             for c in self._consumers:
                 if isinstance(c, GeneratorType):
-                    c.send(result)
-                else:
-                    c(result)
-            self._result_cache.append(result)
+                    c.close()
+            self._done = True
+
+    @property
+    def is_done(self):
+        return self._done
+
+    @property
+    def exception(self):
+        return self._exc
+
+    def consume_result(self, result):
+        with self._lock:
+            if self._done:
+                raise RuntimeError('result receive after future close')
+            else:
+                for c in self._consumers:
+                    if isinstance(c, GeneratorType):
+                        c.send(result)
+                    else:
+                        c(result)
+                self._result_cache.append(result)
 
     def set_exception(self, exc):
-        self._exc = exc
-        for cb in self._error_callbacks:
-            cb(exc)
-        self.set_done()
+        with self._lock:
+            self._exc = exc
+            for cb in self._error_callbacks:
+                cb(exc)
+            self.set_done()
 
     def add_consumer(self, callback):
-        if _is_gen(callback):
-            c = callback()
-            next(c)
-            for result in self._result_cache:
-                c.send(result)
-        else:
-            c = callback
-            for result in self._result_cache:
-                c(result)
-        self._consumers.append(c)
+        with self._lock:
+            if _is_gen(callback):
+                c = callback()
+                next(c)
+                for result in self._result_cache:
+                    c.send(result)
+                if self._done:
+                    # completed before the consumer arrived, e.g. from another thread
+                    c.close()
+            else:
+                c = callback
+                for result in self._result_cache:
+                    c(result)
+            self._consumers.append(c)
 
     def add_error_callback(self, callback):
-        if self._exc:
-            for cb in self._error_callbacks:
-                cb(self._exc)
-        else:
-            self._error_callbacks.append(callback)
+        with self._lock:
+            if self._exc:
+                callback(self._exc)
+            else:
+                self._error_callbacks.append(callback)
 
     def result_queue(self):
         queue = CloseableQueue()
@@ -125,6 +194,10 @@ class Future(object):
         if self._exc:
             raise self._exc
 
+    def result(self):
+        self.wait()
+        return self._result_cache[-1] if self._result_cache else None
+
 
 class Executor(object):
     def __init__(self):
@@ -132,12 +205,25 @@ class Executor(object):
         self._lock = Lock()
         self._thread_ident = None
         self._closed = False
+        self.accounting = None
 
     def _step(self):
         try:
-            future, gen = self._task_deque.popleft()
-            future.consume_result(next(gen))
-            self._task_deque.append((future, gen))
+            task = self._task_deque.popleft()
+            future, gen, owner = task
+            if self.accounting:
+                wall, cpu = _timer(), _cpu_timer() if _cpu_timer else None
+                try:
+                    result = next(gen)
+                finally:
+                    self.accounting(owner, _timer() - wall, None if cpu is None else _cpu_timer() - cpu)
+            else:
+                result = next(gen)
+            if isinstance(result, WaitFor):
+                self._park(task, result.futures)
+                return True
+            future.consume_result(result)
+            self._task_deque.append(task)
             return True
         except StopIteration:
             future.set_done()
@@ -149,6 +235,24 @@ class Executor(object):
             future.set_exception(err)
             return True
 
+    def _park(self, task, futures):
+        pending = [f for f in futures if not f.is_done]
+        if not pending:
+            self._task_deque.append(task)
+            return
+        remaining = [len(pending)]
+        lock = Lock()
+
+        def _resume(f):
+            with lock:
+                remaining[0] -= 1
+                last = not remaining[0]
+            if last:
+                self._task_deque.append(task)
+
+        for f in pending:
+            on_done(f, _resume)
+
     def loop(self, forever=False):
         with self._lock:
             if not self._thread_ident:
@@ -164,15 +268,30 @@ class Executor(object):
     def close(self):
         self._closed = True
 
-    def call(self, fn):
-        return self.call_posterior(fn)
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def thread_ident(self):
+        return self._thread_ident
+
+    @property
+    def queue_depth(self):
+        return len(self._task_deque)
+
+    def pending_owners(self):
+        return Counter(owner for future, gen, owner in list(self._task_deque))
+
+    def call(self, fn, owner=None):
+        return self.call_posterior(fn, owner)
 
-    def call_prior(self, fn):
+    def call_prior(self, fn, owner=None):
         future = Future(self)
-        self._task_deque.appendleft((future, _gen(fn)))
+        self._task_deque.appendleft((future, _gen(fn), owner))
         return future
 
-    def call_posterior(self, fn):
+    def call_posterior(self, fn, owner=None):
         future = Future(self)
-        self._task_deque.append((future, _gen(fn)))
+        self._task_deque.append((future, _gen(fn), owner))
         return future
\ No newline at end of file
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import fnmatch
+import threading
+import collections
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+
+class InvalidFilterError(RuntimeError):
+    pass
+
+
+def _index_key(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value if isinstance(value, _string_types) else str(value)
+
+
+def _index_keys(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return {_index_key(v) for v in value}
+    return {_index_key(value)}
+
+
+def _ranking(reference):
+    try:
+        return float(reference.properties.get('ranking', 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _ordered(a, b):
+    # numeric comparison when both sides are numbers, string comparison otherwise
+    try:
+        return float(a), float(b)
+    except (TypeError, ValueError):
+        return a, b
+
+
+class _Comparison(object):
+    def __init__(self, attr, op, value):
+        self._attr = attr
+        self._op = op
+        self._value = value
+        self._wildcard = op == '=' and '*' in value
+
+    def _test(self, key):
+        if self._op == '=':
+            if self._wildcard:
+                return fnmatch.fnmatchcase(key, self._value)
+            return key == self._value
+        elif self._op == '~=':
+            return key.lower() == self._value.lower()
+        a, b = _ordered(key, self._value)
+        return a >= b if self._op == '>=' else a <= b
+
+    def match(self, properties):
+        if self._attr not in properties:
+            return False
+        return any(self._test(k) for k in _index_keys(properties[self._attr]))
+
+    def select(self, index):
+        if self._op == '=' and not self._wildcard:
+            return index.refs(self._attr, self._value)
+        selected = set()
+        for k, refs in index.values(self._attr).items():
+            if self._test(k):
+                selected.update(refs)
+        return selected
+
+
+class _And(object):
+    def __init__(self, operands):
+        self._operands = operands
+
+    def match(self, properties):
+        return all(o.match(properties) for o in self._operands)
+
+    def select(self, index):
+        selected = None
+        for o in self._operands:
+            refs = o.select(index)
+            selected = refs if selected is None else selected & refs
+            if not selected:
+                break
+        return selected or set()
+
+
+class _Or(object):
+    def __init__(self, operands):
+        self._operands = operands
+
+    def match(self, properties):
+        return any(o.match(properties) for o in self._operands)
+
+    def select(self, index):
+        selected = set()
+        for o in self._operands:
+            selected.update(o.select(index))
+        return selected
+
+
+class _Not(object):
+    def __init__(self, operand):
+        self._operand = operand
+
+    def match(self, properties):
+        return not self._operand.match(properties)
+
+    def select(self, index):
+        return index.all() - self._operand.select(index)
+
+
+class _Parser(object):
+    def __init__(self, expr):
+        self._expr = expr
+        self._pos = 0
+
+    def parse(self):
+        node = self._filter()
+        self._skip_spaces()
+        if self._pos != len(self._expr):
+            self._error('unexpected trailing characters')
+        return node
+
+    def _error(self, msg):
+        raise InvalidFilterError('{0} at {1} in {2!r}'.format(msg, self._pos, self._expr))
+
+    def _skip_spaces(self):
+        while self._pos < len(self._expr) and self._expr[self._pos].isspace():
+            self._pos += 1
+
+    def _expect(self, ch):
+        self._skip_spaces()
+        if self._expr[self._pos:self._pos + 1] != ch:
+            self._error('expect {0!r}'.format(ch))
+        self._pos += 1
+
+    def _filter(self):
+        self._expect('(')
+        self._skip_spaces()
+        ch = self._expr[self._pos:self._pos + 1]
+        if ch in ('&', '|'):
+            self._pos += 1
+            operands = []
+            self._skip_spaces()
+            while self._expr[self._pos:self._pos + 1] == '(':
+                operands.append(self._filter())
+                self._skip_spaces()
+            if not operands:
+                self._error('empty operand list')
+            node = _And(operands) if ch == '&' else _Or(operands)
+        elif ch == '!':
+            self._pos += 1
+            node = _Not(self._filter())
+        else:
+            node = self._comparison()
+        self._expect(')')
+        return node
+
+    def _comparison(self):
+        end = self._expr.find(')', self._pos)
+        if end < 0:
+            self._error('unclosed comparison')
+        item = self._expr[self._pos:end]
+        for op in ('>=', '<=', '~=', '='):
+            attr, sep, value = item.partition(op)
+            if sep:
+                break
+        attr, value = attr.strip(), value.strip()
+        if not sep or not attr or not value:
+            self._error('invalid comparison {0!r}'.format(item))
+        self._pos = end
+        return _Comparison(attr, op, value)
+
+
+_compiled = {}
+
+
+def compile_filter(expr):
+    if expr not in _compiled:
+        if len(_compiled) > 1024:
+            _compiled.clear()
+        _compiled[expr] = _Parser(expr).parse()
+    return _compiled[expr]
+
+
+class ServiceIndex(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._all = set()
+        self._provides = collections.defaultdict(set)
+        self._properties = collections.defaultdict(lambda: collections.defaultdict(set))
+
+    def add(self, reference):
+        with self._lock:
+            self._all.add(reference)
+            for resource in reference.provides:
+                self._provides[resource].add(reference)
+            for attr, value in reference.properties.items():
+                for k in _index_keys(value):
+                    self._properties[attr][k].add(reference)
+
+    def remove(self, reference):
+        with self._lock:
+            self._all.discard(reference)
+            for resource in reference.provides:
+                self._provides[resource].discard(reference)
+                if not self._provides[resource]:
+                    del self._provides[resource]
+            for attr, value in reference.properties.items():
+                for k in _index_keys(value):
+                    self._properties[attr][k].discard(reference)
+                    if not self._properties[attr][k]:
+                        del self._properties[attr][k]
+                if not self._properties[attr]:
+                    del self._properties[attr]
+
+    def all(self):
+        with self._lock:
+            return set(self._all)
+
+    def values(self, attr):
+        with self._lock:
+            if attr not in self._properties:
+                return {}
+            return {k: set(refs) for k, refs in self._properties[attr].items()}
+
+    def refs(self, attr, key):
+        with self._lock:
+            if attr not in self._properties:
+                return set()
+            return set(self._properties[attr].get(key, ()))
+
+    def providers(self, resource):
+        with self._lock:
+            return set(self._provides.get(resource, ()))
+
+    def lookup(self, filter_expr=None, provides=None):
+        if provides is not None:
+            selected = self.providers(provides)
+            if filter_expr and selected:
+                selected &= compile_filter(filter_expr).select(self)
+        elif filter_expr:
+            selected = compile_filter(filter_expr).select(self)
+        else:
+            selected = self.all()
+        return sorted(selected, key=lambda sr: (-_ranking(sr), sr.__context__.name, sr.name))
@@ -3,11 +3,16 @@ __author__ = 'chinfeng'
 
 import zipfile
 import os
+import gc
+import sys
+import weakref
 import functools
 import itertools
 import zipimport
 import threading
 import collections
+import time
+import hashlib
 
 try:
     import ConfigParser as configparser
@@ -30,33 +35,147 @@ try:
     load_source = lambda fullname, path: SourceFileLoader(fullname, path).load_module()
 except ImportError:
     from imp import load_source
+try:
+    from types import MappingProxyType
+except ImportError:
+    class MappingProxyType(collections.Mapping):
+        # read-only view for python 2
+        def __init__(self, mapping):
+            self._mapping = mapping
+
+        def __getitem__(self, key):
+            return self._mapping[key]
+
+        def __iter__(self):
+            return iter(self._mapping)
+
+        def __len__(self):
+            return len(self._mapping)
+
+        def __repr__(self):
+            return 'mappingproxy({0!r})'.format(self._mapping)
 from importlib import import_module
 from .configuration import LocalConfiguration
-from .executor import Executor
-from inspect import isgeneratorfunction
+from .executor import Executor, WaitFor, on_done
+from .filters import ServiceIndex, compile_filter
+from .remote import RemoteServer, ConnectionPool, RemoteServiceProxy, RemoteBatch, default_secret
+from .eventbus import EventBus
+from .accounting import ResourceAccountant
+from .profiling import StartupProfiler, NO_PHASE
+from .metrics import CallMetrics, MetricsRegistry, call_metrics_collector
+from inspect import isgeneratorfunction, isclass, isfunction
 import types
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+try:
+    _timer = time.perf_counter
+except AttributeError:
+    _timer = time.time
+
 
 def async(func):
     def _async_callable(instance, *args, **kwargs):
         if hasattr(instance, '__executor__'):
             method = types.MethodType(func, instance)
-            return instance.__executor__.call(functools.partial(method, *args, **kwargs))
+            return instance.__executor__.call(functools.partial(method, *args, **kwargs), _owner_of(instance))
         else:
             return func
 
     return _async_callable
 
 
+def _owner_of(instance):
+    # tasks are accounted to the bundle of the service, reference or context that spawned them
+    context = getattr(instance, '__context__', instance)
+    return context.name if isinstance(context, BundleContext) else None
+
+
 _immutable_prop = lambda v: property(lambda self, value=v: value)
 _uri_class = collections.namedtuple('GumURI', ('host', 'port', 'bundle', 'service'))
 _subtract_dir = lambda a, b: {an for an in dir(a) if an not in dir(b) and not an.startswith('_')}
 _BUNDLE_LEVEL = 0
 _SERVICE_LEVEL = 1
+_consumer_key = lambda c: (c.__reference__.__context__.name, c.__reference__.name, c.resource_uri)
+_producer_key = lambda p: (p.__context__.name, p.name)
+
+
+def _hash_files(files):
+    digest = hashlib.sha1()
+    base = os.path.dirname(files[0]) if files else ''
+    for fn in files:
+        digest.update(os.path.relpath(fn, base).encode('utf-8'))
+        with open(fn, 'rb') as fd:
+            digest.update(fd.read())
+    return digest.hexdigest()
+
+
+def _freeze(value):
+    # snapshots are shared by every caller, nested values are made read-only as well
+    if isinstance(value, dict):
+        return MappingProxyType(dict((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def _module_source(module):
+    fn = getattr(module, '__file__', None)
+    if fn and fn.endswith(('.pyc', '.pyo')):
+        fn = fn[:-1]
+    return fn if fn and os.path.isfile(fn) else None
+
+
+def _digest_code(code, digest):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names + code.co_varnames + code.co_freevars).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _digest_code(const, digest)
+        else:
+            digest.update(repr(const).encode('utf-8'))
+
+
+def _digest_attribute(attr, digest, depth=0):
+    # line numbers and file names stay out, moving a class around its module is no change
+    if isinstance(attr, types.FunctionType):
+        _digest_code(attr.__code__, digest)
+        digest.update(repr(attr.__defaults__).encode('utf-8'))
+    elif isinstance(attr, (staticmethod, classmethod)):
+        _digest_attribute(attr.__func__, digest, depth)
+    elif isinstance(attr, property):
+        for fn in (attr.fget, attr.fset, attr.fdel):
+            _digest_attribute(fn, digest, depth)
+    elif attr is None or isinstance(attr, (bool, int, float, str, bytes, tuple, frozenset)):
+        digest.update(repr(attr).encode('utf-8'))
+    elif depth < 2 and hasattr(attr, '__dict__') and not isinstance(attr, (type, types.ModuleType)):
+        # decorator helpers like @bind and @event keep their functions in instance attributes
+        digest.update(type(attr).__name__.encode('utf-8'))
+        for an, value in sorted(vars(attr).items()):
+            digest.update(an.encode('utf-8'))
+            _digest_attribute(value, digest, depth + 1)
+    else:
+        digest.update(type(attr).__name__.encode('utf-8'))
+
+
+def _fingerprint(cls, *declared):
+    digest = hashlib.sha1(repr(declared).encode('utf-8'))
+    if isinstance(cls, type):
+        for klass in cls.__mro__:
+            digest.update('{0}.{1}'.format(klass.__module__, klass.__name__).encode('utf-8'))
+            if klass.__module__ != cls.__module__:
+                continue
+            for an, attr in sorted(vars(klass).items()):
+                if an not in ('__dict__', '__weakref__', '__module__', '__doc__') and not an.startswith('__consumer_'):
+                    digest.update(an.encode('utf-8'))
+                    _digest_attribute(attr, digest)
+    else:
+        _digest_attribute(cls, digest)
+    return digest.hexdigest()
 
 
 def service_uri(uri, pwd_level=_SERVICE_LEVEL):
@@ -177,17 +296,22 @@ class ServiceAnnotation(Annotation):
     @property
     def subject(self):
         metadata = self.root_nesting.metadata
-        return ServiceReferenceFactory(self._subject, metadata.get('name'), metadata.get('provides', None))
+        properties = metadata.get('properties', None)
+        if isinstance(properties, list):
+            properties = dict(itertools.chain.from_iterable(p.items() for p in reversed(properties)))
+        return ServiceReferenceFactory(
+            self._subject, metadata.get('name'), metadata.get('provides', None), properties)
 
 
 class ServiceReferenceFactory(object):
-    def __init__(self, cls, name=None, provides=None):
+    def __init__(self, cls, name=None, provides=None, properties=None):
         self._cls = cls
         self._name = name
         self._provides = provides
+        self._properties = properties
 
     def create(self, bundle):
-        return ServiceReference(bundle, self._cls, self._name, self._provides)
+        return ServiceReference(bundle, self._cls, self._name, self._provides, self._properties)
 
 
 class _Callable(object):
@@ -231,19 +355,21 @@ class Task(object):
         else:
             extr = kwargs.pop('__executor__', None)
         if extr:
-            extr.call(functools.partial(method, *args, **kwargs))
+            extr.call(functools.partial(method, *args, **kwargs), _owner_of(self._instance))
         else:
             raise RuntimeError('no executor specify for {0}'.format(self._fn.__name__))
 
 
 class Consumer(object):
-    def __init__(self, instance, bind_fn, unbind_fn, resource_uri, cardinality):
+    def __init__(self, instance, bind_fn, unbind_fn, resource_uri, cardinality, filter_expr=None):
         self._instance = instance
         self._bind_fn = bind_fn
         self._unbind_fn = unbind_fn
         self._resource_uri = resource_uri
+        self._filter = compile_filter(filter_expr) if filter_expr else None
         self._optionality, self._multiplicity = cardinality.split('..')
         self._consumed_resources = set()
+        self._bound_services = {}
 
     def bind(self, resource_reference):
         try:
@@ -254,7 +380,11 @@ class Consumer(object):
                     (resource_reference not in self._consumed_resources)
             )):
                 self._consumed_resources.add(resource_reference)
-                self._bind_fn(self._instance, resource_reference.get_service())
+                service = resource_reference.get_service()
+                self._bound_services[resource_reference] = service
+                self._bind_fn(self._instance, service)
+                self._count_change('bind')
+                CachedCall.invalidate_all(self._instance)
                 return True
             else:
                 return False
@@ -266,7 +396,10 @@ class Consumer(object):
         try:
             if resource_reference in self._consumed_resources:
                 self._consumed_resources.remove(resource_reference)
-                self._unbind_fn(self._instance, resource_reference.get_service())
+                # hand back the very object given at bind time, even if the reference now serves another
+                self._unbind_fn(self._instance, self._bound_services.pop(resource_reference))
+                self._count_change('unbind')
+                CachedCall.invalidate_all(self._instance)
                 return True
             else:
                 return False
@@ -274,8 +407,14 @@ class Consumer(object):
             logger.exception(err)
             return False
 
+    def _count_change(self, change):
+        framework = getattr(self._instance, '__framework__', None)
+        if isinstance(framework, Framework):
+            framework.metrics.get('gumpy_binding_changes_total').labels(change).inc()
+
     def match(self, reference):
-        return self.resource_uri in reference.provides
+        return self.resource_uri in reference.provides and \
+            (self._filter is None or self._filter.match(reference.properties))
 
     @property
     def __reference__(self):
@@ -285,6 +424,10 @@ class Consumer(object):
     def resource_uri(self):
         return self._resource_uri
 
+    @property
+    def consumed_resources(self):
+        return self._consumed_resources
+
     @property
     def is_satisfied(self):
         return len(self._consumed_resources) >= int(self._optionality)
@@ -294,8 +437,8 @@ class Consumer(object):
 
 
 class EventSlot(object):
-    def __init__(self, instance, func):
-        self._name = func.__name__
+    def __init__(self, instance, func, name=None):
+        self._name = name or func.__name__
         self._instance = instance
         self._func = func
 
@@ -307,22 +450,142 @@ class EventSlot(object):
         return self._name
 
 
+class _PendingCall(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CachedCall(object):
+    _MISSING = object()
+    # separates positional from keyword arguments in a key, f(('a', 1)) is not f(a=1)
+    _KWARGS = object()
+
+    def __init__(self, instance, fn, maxsize=128, ttl=None, invalidate_on=()):
+        self._instance = instance
+        self._fn = fn
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._invalidate_on = tuple(invalidate_on)
+        self._lock = threading.Lock()
+        # key -> (expires at, result), oldest use first
+        self._entries = collections.OrderedDict()
+        self._pending = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        # callers that shared the outcome of a computation in flight
+        self.waits = 0
+        functools.update_wrapper(self, fn)
+
+    @staticmethod
+    def invalidate_all(instance):
+        for attr in list(getattr(instance, '__dict__', {}).values()):
+            if isinstance(attr, CachedCall):
+                attr.invalidate()
+
+    def _key(self, args, kwargs):
+        key = args + (self._KWARGS, ) + tuple(sorted(kwargs.items())) if kwargs else args
+        try:
+            hash(key)
+        except TypeError:
+            return self._MISSING
+        return key
+
+    def _lookup(self, key):
+        entry = self._entries.pop(key, self._MISSING)
+        if entry is self._MISSING:
+            return entry
+        expires, result = entry
+        if expires is not None and expires <= _timer():
+            return self._MISSING
+        self._entries[key] = entry
+        return result
+
+    def __call__(self, *args, **kwargs):
+        key = self._key(args, kwargs)
+        if key is self._MISSING:
+            return self._fn(self._instance, *args, **kwargs)
+        with self._lock:
+            result = self._lookup(key)
+            if result is not self._MISSING:
+                self.hits += 1
+                return result
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                self.misses += 1
+                pending = self._pending[key] = _PendingCall()
+                generation = self._generation
+            else:
+                self.waits += 1
+        if not owner:
+            # another caller is computing the same key, share its outcome
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+        try:
+            pending.result = self._fn(self._instance, *args, **kwargs)
+        except BaseException as err:
+            pending.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+                # an invalidation while computing makes the result stale for later callers
+                if pending.error is None and generation == self._generation and self._maxsize != 0:
+                    self._entries[key] = (_timer() + self._ttl if self._ttl else None, pending.result)
+                    while self._maxsize and len(self._entries) > self._maxsize:
+                        self._entries.popitem(last=False)
+            pending.done.set()
+        return pending.result
+
+    def invalidate(self, *args, **kwargs):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def cache_info(self):
+        return dict(hits=self.hits, misses=self.misses, waits=self.waits,
+                    maxsize=self._maxsize, currsize=len(self._entries))
+
+    @property
+    def invalidators(self):
+        return [EventSlot(self, CachedCall.invalidate, name) for name in self._invalidate_on]
+
+
 class _EventProxy(object):
-    def __init__(self, events=None):
+    def __init__(self, events=None, name=None, relays=(), deliveries=None):
         self._events = events or set()
+        self._name = name
+        self._relays = relays
+        self._deliveries = deliveries
 
     def send(self, *args, **kwargs):
+        delivered = 0
         for e in self._events:
             e.call(*args, **kwargs)
+            delivered += 1
+        if self._deliveries and delivered:
+            self._deliveries.labels(self._name).inc(delivered)
+        for relay in self._relays:
+            try:
+                relay(self._name, args, kwargs)
+            except BaseException as err:
+                logger.exception(err)
 
 
 class _EventManager(object):
-    def __init__(self, owner):
+    def __init__(self, owner, relays=(), deliveries=None):
         self._owner = owner
+        self._relays = relays
+        self._deliveries = deliveries
 
     def __getattr__(self, key):
         return _EventProxy(
-            (e for e in (self._owner.events() or set()) if e.name == key)
+            (e for e in (self._owner.events() or set()) if e.name == key), key, self._relays, self._deliveries
         )
 
     def __getitem__(self, item):
@@ -349,6 +612,10 @@ class Requirement(object):
                 _kwargs[k] = None
         return self._fn(self._instance, *_args, **_kwargs)
 
+    @property
+    def service_uris(self):
+        return tuple(itertools.chain(self._service_names, self._service_dict.values()))
+
     def check_satisfied(self, ctx):
         return all(itertools.chain(
             (ctx.get_service_reference(sn).is_avaliable for sn in self._service_names),
@@ -357,7 +624,7 @@ class Requirement(object):
 
 
 class ServiceReference(object):
-    def __init__(self, bundle, cls, name=None, provides=None):
+    def __init__(self, bundle, cls, name=None, provides=None, properties=None):
         self.__context__ = bundle
         self._cls = cls
         self._name = name or cls.__name__
@@ -369,7 +636,11 @@ class ServiceReference(object):
             self._provides = {provides}
         else:
             self._provides = set()
+        self._properties = dict(properties or {})
+        self._declared = (sorted(self._provides), sorted(self._properties.items()))
         self._instance = None
+        self._proxy = None
+        self._fingerprint = None
 
         self._consumers = set()
         self._events = set()
@@ -383,6 +654,25 @@ class ServiceReference(object):
     def provides(self):
         return self._provides
 
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = _fingerprint(self._cls, self._name, *self._declared)
+        return self._fingerprint
+
+    @property
+    def properties(self):
+        return self._properties
+
+    def set_properties(self, **properties):
+        if self._instance:
+            self.__framework__.unregister(self)
+            self._properties.update(properties)
+            self.__framework__.register(self)
+            self.__framework__.revise(self)
+        else:
+            self._properties.update(properties)
+
     @property
     def cls(self):
         return self._cls
@@ -391,6 +681,14 @@ class ServiceReference(object):
     def consumers(self):
         return self._consumers
 
+    @property
+    def consumes(self):
+        return {c.resource_uri for c in self._class_attributes(Consumer)}
+
+    @property
+    def requires(self):
+        return set(itertools.chain.from_iterable(r.service_uris for r in self._class_attributes(Requirement)))
+
     @property
     def events(self):
         return self._events
@@ -413,49 +711,57 @@ class ServiceReference(object):
 
     def start(self):
         if not self._instance:
-            if isinstance(self._cls, type):
-                instance = self._cls.__new__(self._cls)
-                instance.__context__ = self.__context__
-                instance.__framework__ = self.__framework__
-                instance.__executor__ = self.__executor__
-                instance.__reference__ = self
-                instance.__init__()
-            elif isinstance(self._cls, types.FunctionType):
-                kwargs = {}
-                varnames = self._cls.__code__.co_varnames
-                if '__context__' in varnames:
-                    kwargs['__context__'] = self.__context__
-                if '__framework__' in varnames:
-                    kwargs['__framework__'] = self.__framework__
-                if '__executor__' in varnames:
-                    kwargs['__executor__'] = self.__executor__
-                if '__reference__' in varnames:
-                    kwargs['__reference__'] = self
-                instance = self._cls(**kwargs)
-                instance.__context__ = self.__context__
-                instance.__framework__ = self.__framework__
-                instance.__executor__ = self.__executor__
-                instance.__reference__ = self
-            instance_dir = _subtract_dir(instance, object)
-            if 'on_start' in instance_dir:
-                instance.on_start()
-            self._instance = instance
-            self._events = set(filter(
-                lambda obj: isinstance(obj, EventSlot),
-                (getattr(instance, an) for an in instance_dir)))
-            self._consumers = set(filter(
-                lambda obj: isinstance(obj, Consumer),
-                (getattr(instance, an) for an in instance_dir)))
-
-            if self._consumers:
-                for c in self._consumers:
-                    self.__framework__.digest(c)
-            elif self._provides:
-                self.__framework__.digest(self)
-
-    def stop(self):
+            with self.__framework__.phase('start', '{0}:{1}'.format(self.__context__.name, self._name)):
+                self._start_instance()
+
+    def _start_instance(self):
+        if isinstance(self._cls, type):
+            instance = self._cls.__new__(self._cls)
+            instance.__context__ = self.__context__
+            instance.__framework__ = self.__framework__
+            instance.__executor__ = self.__executor__
+            instance.__reference__ = self
+            instance.__init__()
+        elif isinstance(self._cls, types.FunctionType):
+            kwargs = {}
+            varnames = self._cls.__code__.co_varnames
+            if '__context__' in varnames:
+                kwargs['__context__'] = self.__context__
+            if '__framework__' in varnames:
+                kwargs['__framework__'] = self.__framework__
+            if '__executor__' in varnames:
+                kwargs['__executor__'] = self.__executor__
+            if '__reference__' in varnames:
+                kwargs['__reference__'] = self
+            instance = self._cls(**kwargs)
+            instance.__context__ = self.__context__
+            instance.__framework__ = self.__framework__
+            instance.__executor__ = self.__executor__
+            instance.__reference__ = self
+        instance_dir = _subtract_dir(instance, object)
+        if 'on_start' in instance_dir:
+            instance.on_start()
+        self._instance = instance
+        self.__framework__.register(self)
+        self._events = set(filter(
+            lambda obj: isinstance(obj, EventSlot),
+            (getattr(instance, an) for an in instance_dir)))
+        for cache in set(filter(lambda obj: isinstance(obj, CachedCall), (getattr(instance, an) for an in instance_dir))):
+            self._events.update(cache.invalidators)
+        self._consumers = set(filter(
+            lambda obj: isinstance(obj, Consumer),
+            (getattr(instance, an) for an in instance_dir)))
+
+        if self._consumers:
+            for c in self._consumers:
+                self.__framework__.digest(c)
+        elif self._provides:
+            self.__framework__.digest(self)
+
+    def stop(self, dismiss=True):
         if self._instance:
-            if self._provides:
+            self.__framework__.unregister(self)
+            if dismiss and self._provides:
                 self.__framework__.dismiss(self)
             self._consumers = set()
             self._events = set()
@@ -463,13 +769,26 @@ class ServiceReference(object):
                 self._instance.on_stop()
             del self._instance
             self._instance = None
+            self._proxy = None
 
     def get_service(self):
         if self._instance:
-            return self._instance
+            metrics = self.__context__.__framework__.call_metrics
+            if metrics is None:
+                return self._instance
+            if self._proxy is None:
+                self._proxy = metrics.wrap(self._instance, '{0}:{1}'.format(self.__context__.name, self._name))
+            return self._proxy
         else:
             raise ServiceUnavaliableError('{0}:{1}'.format(self.__context__.name, self._name))
 
+    def _class_attributes(self, tp):
+        if isinstance(self._cls, type):
+            for an in dir(self._cls):
+                attr = getattr(self._cls, an, None)
+                if isinstance(attr, tp):
+                    yield attr
+
     def check_requirement(self):
         instance_dir = dir(self._cls)
         requirements = filter(
@@ -494,43 +813,122 @@ class BundleContext(object):
         self._uri = uri
         self._state = self.ST_INSTALLED
         self._service_references = {}
-        self._activator = lambda: None
-        self._deactivator = lambda: None
         self._module = None
+        self._content_hash = None
+        # (document, version, snapshot), replaced as a whole when the configuration moves
+        self._configuration_snapshot = None
 
         self._events = set()
-        self._event_manager = _EventManager(self)
+        self._event_manager = _EventManager(self, deliveries=framework.metrics.get('gumpy_event_deliveries_total'))
 
         abspath = os.path.abspath(uri)
-        if os.path.isfile(abspath):
-            fn, ext = os.path.splitext(os.path.basename(abspath))
-            if ext == '.py':
-                self._module = load_source(fn, abspath)
-            elif ext == '.zip':
-                self._module = zipimport.zipimporter(abspath).load_module(fn)
-            self._path = abspath
-        else:
-            self._module = import_module(uri)
-            reload(self._module)
-            self._path = os.path.dirname(self._module.__file__)
+        with framework.phase('import', uri) as phase:
+            if os.path.isfile(abspath):
+                fn, ext = os.path.splitext(os.path.basename(abspath))
+                if ext == '.py':
+                    self._module = load_source(fn, abspath)
+                elif ext == '.zip':
+                    self._module = zipimport.zipimporter(abspath).load_module(fn)
+                self._path = abspath
+            else:
+                # a module imported for the first time is already fresh, reload only a stale one
+                fresh = uri not in sys.modules
+                self._module = import_module(uri)
+                if not fresh:
+                    reload(self._module)
+                self._path = os.path.dirname(self._module.__file__)
+
+            name = getattr(self._module, '__gum__', None)
+            name = name or getattr(self._module, '__symbol__', None)
+            self._name = name or self._module.__name__
+            phase.bundle = self._name
+
+        with framework.phase('scan', self._name):
+            self._activator, self._deactivator, self._service_references = self._scan()
+        self._submodule_hashes = self._hash_submodules()
 
-        name = getattr(self._module, '__gum__', None)
-        name = name or getattr(self._module, '__symbol__', None)
-        self._name = name or self._module.__name__
+        self._state = self.ST_RESOLVED
 
+    def _scan(self):
+        activator, deactivator, service_references = lambda: None, lambda: None, {}
         for attr_name in _subtract_dir(self._module, types.ModuleType):
             attr = getattr(self._module, attr_name)
             if isinstance(attr, Annotation):
                 subject = attr.subject
                 if isinstance(subject, Activator):
-                    self._activator = subject
+                    activator = subject
                 elif isinstance(subject, Deactivator):
-                    self._deactivator = subject
+                    deactivator = subject
                 elif isinstance(subject, ServiceReferenceFactory):
                     sr = subject.create(self)
-                    self._service_references[sr.name] = sr
+                    service_references[sr.name] = sr
+        return activator, deactivator, service_references
 
-        self._state = self.ST_RESOLVED
+    def _rescan(self):
+        # execute the module again and split its services into kept, outgoing and incoming references
+        abspath = os.path.abspath(self._uri)
+        if os.path.isfile(abspath):
+            fn, ext = os.path.splitext(os.path.basename(abspath))
+            if ext == '.py':
+                self._module = load_source(fn, abspath)
+            elif ext == '.zip':
+                self._module = zipimport.zipimporter(abspath).load_module(fn)
+        else:
+            self._reload_submodules()
+            self._module = reload(self._module)
+        self._content_hash = _hash_files(self.source_files())
+        self._activator, self._deactivator, scanned = self._scan()
+        kept, outgoing, incoming = {}, [], []
+        for name, sr in self._service_references.items():
+            if name in scanned and scanned[name].fingerprint == sr.fingerprint:
+                kept[name] = sr
+            else:
+                outgoing.append(sr)
+        for name, sr in scanned.items():
+            if name not in kept:
+                kept[name] = sr
+                incoming.append(sr)
+        self._service_references = kept
+        return outgoing, incoming
+
+    def _submodules(self):
+        if not self._module or os.path.isfile(os.path.abspath(self._uri)):
+            return {}
+        prefix = self._module.__name__ + '.'
+        return dict((name, m) for name, m in list(sys.modules.items())
+                    if m is not None and name.startswith(prefix) and _module_source(m))
+
+    def _hash_submodules(self):
+        return dict((name, _hash_files([_module_source(m)])) for name, m in self._submodules().items())
+
+    def _reload_submodules(self):
+        # changed submodules and the ones importing from them run again, imported ones first
+        modules = self._submodules()
+        hashes = dict((name, _hash_files([_module_source(m)])) for name, m in modules.items())
+        previous, self._submodule_hashes = self._submodule_hashes, hashes
+        imports = {}
+        for name, m in modules.items():
+            imports[name] = set()
+            for value in list(vars(m).values()):
+                if isinstance(value, types.ModuleType):
+                    imported = value.__name__
+                elif isclass(value) or isfunction(value):
+                    imported = value.__module__
+                else:
+                    imported = getattr(type(value), '__module__', None)
+                if imported in modules and imported != name:
+                    imports[name].add(imported)
+        stale = set(name for name in modules if previous.get(name) != hashes[name])
+        while True:
+            dependents = set(name for name in modules if name not in stale and imports[name] & stale)
+            if not dependents:
+                break
+            stale.update(dependents)
+        while stale:
+            ready = sorted(name for name in stale if not imports[name] & stale) or sorted(stale)
+            for name in ready:
+                reload(modules[name])
+            stale.difference_update(ready)
 
     @property
     def __executor__(self):
@@ -540,6 +938,30 @@ class BundleContext(object):
     def path(self):
         return self._path
 
+    @property
+    def module(self):
+        return self._module
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = _hash_files(self.source_files())
+        return self._content_hash
+
+    def source_files(self):
+        if os.path.isfile(self._path):
+            return [self._path, ]
+        fn = self._module.__file__
+        if fn.endswith(('.pyc', '.pyo')):
+            fn = fn[:-1]
+        if os.path.splitext(os.path.basename(fn))[0] == '__init__':
+            files = []
+            for root, dirs, filenames in os.walk(os.path.dirname(fn)):
+                dirs.sort()
+                files.extend(os.path.join(root, f) for f in sorted(filenames) if f.endswith('.py'))
+            return files
+        return [fn, ]
+
     @property
     def uri(self):
         return self._uri
@@ -564,6 +986,18 @@ class BundleContext(object):
     def configuration(self):
         return self._framework.configuration[self._name]
 
+    @property
+    def configuration_snapshot(self):
+        # a document dropped by reload moves its version too, so the document is resolved again only then
+        cached = self._configuration_snapshot
+        if cached is not None and cached[1] is not None and cached[0].version == cached[1]:
+            return cached[2]
+        doc = self.configuration
+        version = getattr(doc, 'version', None)
+        cached = (doc, version, _freeze(dict(doc.items())))
+        self._configuration_snapshot = cached
+        return cached[2]
+
     @property
     def event_manager(self):
         return self._event_manager
@@ -576,15 +1010,14 @@ class BundleContext(object):
         if self.state == self.ST_ACTIVE:
             for sr in self.service_references.values():
                 for e in sr.events: yield e
-        else:
-            raise StopIteration
 
     @async
     def start(self):
         if self._state == self.ST_RESOLVED:
             try:
                 self._state = self.ST_STARTING
-                self._activator()
+                with self._framework.phase('activate', self._name):
+                    self._activator()
                 sr_list = collections.deque(self._service_references.values())
                 while sr_list:
                     sr = sr_list.popleft()
@@ -607,8 +1040,10 @@ class BundleContext(object):
     def stop(self):
         if self._state == self.ST_ACTIVE:
             self._state = self.ST_STOPING
+            self._framework.dismiss_all(
+                sr for sr in self._service_references.values() if sr.is_avaliable)
             for sr in self._service_references.values():
-                sr.stop()
+                sr.stop(dismiss=False)
             self._deactivator()
             self._state = self.ST_RESOLVED
         elif self._state == self.ST_STOPING:
@@ -616,9 +1051,34 @@ class BundleContext(object):
         else:
             raise BundleUnavailableError('bundle {0} cannot stop while {1}'.format(self.name, self.state[1]))
 
+    def _unload(self):
+        # drop the module and its submodules, returning weak probes to verify they get collected
+        probes = [(sr.name, weakref.ref(sr._cls)) for sr in self._service_references.values()]
+        try:
+            probes.append((self._name, weakref.ref(self._module)))
+        except TypeError:
+            pass  # modules are not weak referenceable on python 2, the service classes tell
+        module_name = self._module.__name__
+        if sys.modules.get(module_name) is self._module:
+            for mn in [mn for mn in sys.modules if mn == module_name or mn.startswith(module_name + '.')]:
+                module = sys.modules.pop(mn)
+                parent, _, child = mn.rpartition('.')
+                if parent in sys.modules and getattr(sys.modules[parent], child, None) is module:
+                    delattr(sys.modules[parent], child)
+        self._module = None
+        self._service_references = {}
+        self._activator = self._deactivator = lambda: None
+        self._events = set()
+        self._state = self.ST_UNINSTALLED
+        return probes
+
     def get_service_reference(self, uri):
+        if uri.startswith('('):
+            return self._framework.get_service_reference(uri)
         u = service_uri(uri)
-        if u.bundle:
+        if u.bundle and u.bundle not in self._framework.bundles:
+            return self._framework.get_service_reference(uri)
+        elif u.bundle:
             return self._framework.bundles[u.bundle].get_service_reference_by_name(u.service)
         else:
             return self.get_service_reference_by_name(u.service)
@@ -630,9 +1090,14 @@ class BundleContext(object):
             return None
 
     def get_service(self, uri):
+        if uri.startswith('gum://'):
+            return self._framework.get_service(uri)
         sr = self.get_service_reference(uri)
         return sr.get_service() if sr else None
 
+    def find_service_references(self, filter_expr=None, provides=None):
+        return self._framework.find_service_references(filter_expr, provides)
+
     def get(self, uri):
         u = service_uri(uri)
         if u.service:
@@ -641,28 +1106,183 @@ class BundleContext(object):
             return self.__framework__.bundles[u.bundle]
 
 
+class _BundleWatcher(object):
+    def __init__(self, framework, interval=1.0):
+        self._framework = framework
+        self._interval = interval
+        self._stamps = {}
+        self._closed = threading.Event()
+        self._thread = None
+
+    def _stamp(self, bdl):
+        stamps = []
+        for fn in bdl.source_files():
+            try:
+                stamps.append(os.stat(fn).st_mtime)
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def check(self):
+        # mtimes are cheap to poll, the content hash decides whether the sources really changed
+        futures = []
+        for bdl in list(self._framework.bundles.values()):
+            if bdl.state not in (bdl.ST_RESOLVED, bdl.ST_ACTIVE):
+                continue
+            stamp = self._stamp(bdl)
+            previous = self._stamps.get(bdl.name)
+            self._stamps[bdl.name] = stamp
+            if previous is None:
+                bdl.content_hash
+            elif stamp != previous and _hash_files(bdl.source_files()) != bdl.content_hash:
+                futures.append(self._framework.reload_bundle(bdl.name))
+        return futures
+
+    def _watch_forever(self):
+        while not self._closed.wait(self._interval):
+            try:
+                self.check()
+            except BaseException as err:
+                logger.exception(err)
+
+    def start(self):
+        self.check()
+        self._thread = threading.Thread(target=self._watch_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+class _ConfigurationWatcher(object):
+    def __init__(self, framework, interval=1.0):
+        self._framework = framework
+        self._interval = interval
+        self._closed = threading.Event()
+        self._thread = None
+
+    def check(self):
+        configuration = self._framework.configuration
+        # looked up on the class, documents of some stores are reachable as attributes
+        if getattr(type(configuration), 'poll_changes', None) is None:
+            return {}
+        changes = configuration.poll_changes(list(self._framework.bundles))
+        for name, diff in changes.items():
+            self._framework.call(self._framework.configuration_changed, name, diff)
+        return changes
+
+    def _watch_forever(self):
+        while not self._closed.wait(self._interval):
+            try:
+                self.check()
+            except BaseException as err:
+                logger.exception(err)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._watch_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
 class Framework(object):
-    def __init__(self, configuration=None, repo_path=None):
+    def __init__(self, configuration=None, repo_path=None, persist_state=True):
         self.__executor__ = Executor()
         self._repo_path = repo_path
+        # a worker sharing its configuration reads .state and .wiring but leaves writing them to the owner
+        self._persist_state = persist_state
         self._bundles = {}
         self._lock = threading.Lock()
         self._configuration = configuration or LocalConfiguration()
         self._state_conf = self.configuration['.state']
-        self._event_manager = _EventManager(self)
+        self._event_relays = []
+        self._metrics = MetricsRegistry()
+        self._event_deliveries = self._metrics.counter(
+            'gumpy_event_deliveries_total', 'Events delivered to event slots', ('event', ))
+        self._binding_changes = self._metrics.counter(
+            'gumpy_binding_changes_total', 'Consumer binds and unbinds', ('change', ))
+        self._action_seconds = self._metrics.histogram(
+            'gumpy_bundle_action_seconds', 'Bundle install, start and stop durations', ('action', ))
+        self._metrics.gauge('gumpy_bundles', 'Bundles by state', ('state', ), self._bundles_by_state)
+        self._metrics.gauge('gumpy_services', 'Services by requirement status', ('status', ), self._services_by_status)
+        self._metrics.gauge('gumpy_executor_queue_depth', 'Tasks waiting in the executor',
+                            function=lambda: self.__executor__.queue_depth)
+        self._metrics.add_collector(call_metrics_collector(self))
+        self._event_manager = _EventManager(self, self._event_relays, self._event_deliveries)
+        self._timing = collections.defaultdict(dict)
+        self._replay = None
+        self._index = ServiceIndex()
+        self._remote_server = None
+        self._remote_pools = {}
+        self._remote_secret = default_secret()
+        self._remote_references = {}
+        self._event_bus = None
+        self._accountant = None
+        self._profiler = None
+        self._watcher = None
+        self._configuration_watcher = None
+        self._call_metrics = None
+
+    def register(self, reference):
+        self._index.add(reference)
+
+    def unregister(self, reference):
+        self._index.remove(reference)
+
+    def find_service_references(self, filter_expr=None, provides=None):
+        return self._index.lookup(filter_expr, provides)
 
     def dismiss(self, producer):
-        for c in self.consumers():
-            if c.unbind(producer) and (not c.is_filled()):
-                # find another provider if instance become unfilled
-                for p in filter(lambda sr, dismiss=producer: sr is not dismiss, self.producers()):
-                    c.bind(p)
+        self.dismiss_all((producer, ))
+
+    def dismiss_all(self, references, rebind=True):
+        dismissed = set(references)
+        producers = [sr for sr in dismissed if sr.provides]
+        unfilled = []
+        if not producers:
+            return unfilled
+        for c in list(self.consumers()):
+            unbound = [p for p in producers if c.unbind(p)]
+            if unbound and (not c.is_filled()) and (c.__reference__ not in dismissed):
+                if rebind:
+                    # find another provider if instance become unfilled, references
+                    # dismissed together are neither candidates nor rebound
+                    for p in self._index.lookup(provides=c.resource_uri):
+                        if p not in dismissed:
+                            c.bind(p)
+                else:
+                    unfilled.append(c)
+        return unfilled
+
+    def revise(self, producer):
+        # properties of a running producer changed: drop bindings whose filter stopped matching,
+        # let those consumers look for another provider, then bind where the filter matches now
+        for c in list(self.consumers()):
+            if producer in c.consumed_resources and not c.match(producer) and c.unbind(producer):
+                if not c.is_filled():
+                    for p in self._index.lookup(provides=c.resource_uri):
+                        if p is not producer:
+                            c.bind(p)
+        self.digest(producer)
 
     def digest(self, entry):
         if isinstance(entry, ServiceReference):
-            self._digest_from_producer(entry)
+            with self.phase('digest', entry.__context__.name):
+                self._digest_from_producer(entry)
         elif isinstance(entry, Consumer):
-            self._digest_from_consumer(entry)
+            with self.phase('digest', entry.__reference__.__context__.name):
+                self._digest_from_consumer(entry)
 
     def _digest_from_producer(self, producer):
         if not producer.provides:
@@ -672,16 +1292,92 @@ class Framework(object):
         while work_list:
             p = work_list.pop(0)
             if p.is_satisfied:
-                for c in self.consumers():
+                consumers = self._replayed_consumers(p) if self._replay else self.consumers()
+                for c in consumers:
                     if c.bind(p) and c.__reference__.provides:
                         work_list.append(c.__reference__)
 
     def _digest_from_consumer(self, consumer):
-        for p in self.producers():
+        if self._replay:
+            producers = self._replayed_producers(consumer)
+        else:
+            producers = self._index.lookup(provides=consumer.resource_uri)
+        for p in producers:
             if p.is_satisfied:
                 consumer.bind(p)
         self._digest_from_producer(consumer.__reference__)
 
+    def _lookup_reference(self, bundle_name, service_name):
+        bdl = self._bundles.get(bundle_name)
+        sr = bdl.get_service_reference_by_name(service_name) if bdl else None
+        return sr if sr and sr.is_avaliable else None
+
+    def _replayed_producers(self, consumer):
+        for key in self._replay[0].get(_consumer_key(consumer), ()):
+            sr = self._lookup_reference(*key)
+            if sr:
+                yield sr
+
+    def _replayed_consumers(self, producer):
+        for bundle_name, service_name, resource_uri in self._replay[1].get(_producer_key(producer), ()):
+            sr = self._lookup_reference(bundle_name, service_name)
+            if sr:
+                for c in sr.consumers:
+                    if c.resource_uri == resource_uri:
+                        yield c
+
+    def _complete_wiring(self):
+        for c in list(self.consumers()):
+            if not c.is_satisfied:
+                self._digest_from_consumer(c)
+
+    def wiring_snapshot(self):
+        active = [bdl for bdl in self._bundles.values() if bdl.state == bdl.ST_ACTIVE]
+        bundles = {}
+        for bdl in active:
+            bundles[bdl.uri] = dict(name=bdl.name, hash=bdl.content_hash, services={
+                sr.name: sorted(sr.provides) for sr in bdl.service_references.values()})
+        edges = []
+        for c in self.consumers():
+            for p in c.consumed_resources:
+                edges.append(list(_consumer_key(c) + _producer_key(p)))
+        return dict(bundles=bundles, edges=sorted(edges), order=self.plan_bundles(bdl.name for bdl in active))
+
+    def _save_wiring(self):
+        if not self._persist_state:
+            return
+        try:
+            wiring = self.configuration['.wiring']
+            for k, v in self.wiring_snapshot().items():
+                wiring[k] = v
+        except BaseException as err:
+            logger.warning('wiring snapshot not saved:')
+            logger.exception(err)
+
+    def _load_wiring(self, names):
+        # validate the snapshot against the bundles going to start, None means full resolution
+        wiring = self.configuration['.wiring']
+        expected = {self._bundles[n].uri: self._bundles[n] for n in names}
+        recorded = wiring.get('bundles') or {}
+        if not expected or set(recorded) != set(expected):
+            return None
+        if any(bdl.state == bdl.ST_ACTIVE for bdl in self._bundles.values()):
+            return None
+        for uri, bdl in expected.items():
+            services = {sr.name: sorted(sr.provides) for sr in bdl.service_references.values()}
+            if (recorded[uri].get('name'), recorded[uri].get('hash'), recorded[uri].get('services')) != \
+                    (bdl.name, bdl.content_hash, services):
+                return None
+        order = [list(level) for level in wiring.get('order') or ()]
+        if sorted(itertools.chain(*order)) != sorted(names):
+            return None
+        by_consumer, by_producer = collections.defaultdict(list), collections.defaultdict(list)
+        for edge in wiring.get('edges') or ():
+            consumer_key, producer_key = tuple(edge[:3]), tuple(edge[3:])
+            by_consumer[consumer_key].append(producer_key)
+            by_producer[producer_key].append(consumer_key)
+        return order, (by_consumer, by_producer)
+
     @property
     def repo_path(self):
         return self._repo_path
@@ -694,6 +1390,10 @@ class Framework(object):
     def configuration(self):
         return self._configuration
 
+    @property
+    def timing(self):
+        return self._timing
+
     def events(self):
         for bdl in self.bundles.values():
             for e in bdl.events():
@@ -755,26 +1455,256 @@ class Framework(object):
                         repo_list[filename] = dict(tp='ZIP', uri=filename)
         return repo_list
 
-    @async
-    def install_bundle(self, uri):
+    def _install_bundle(self, uri):
         bdl = BundleContext(self, uri)
         self._bundles[bdl.name] = bdl
         return bdl
 
+    @async
+    def install_bundle(self, uri):
+        return self._install_bundle(uri)
+
+    @async
+    def uninstall_bundle(self, name):
+        bdl, f = self._bundles[name], None
+        if bdl.state in (bdl.ST_ACTIVE, bdl.ST_STOPING):
+            f = bdl.stop()
+            while not f.is_done:
+                yield
+        with self._lock:
+            self._bundles.pop(name)
+        if self._persist_state and bdl.uri in self._state_conf.keys():
+            self._state_conf.pop(bdl.uri)
+        self._timing.pop(name, None)
+        probes = bdl._unload()
+        bdl = f = None
+        gc.collect()
+        leaked = [pn for pn, probe in probes if probe() is not None]
+        if leaked:
+            logger.warning('bundle {0} uninstalled but still referenced: {1}'.format(name, ', '.join(leaked)))
+        yield not leaked
+
+    @async
+    def reload_bundle(self, name):
+        started = _timer()
+        bdl = self._bundles[name]
+        active = bdl.state == bdl.ST_ACTIVE
+        with self.phase('reload', name):
+            outgoing, incoming = bdl._rescan()
+        if active:
+            # unchanged services keep running, consumers of changed ones wait for the replacements
+            running = [sr for sr in outgoing if sr.is_avaliable]
+            unfilled = self.dismiss_all(running, rebind=False)
+            for sr in running:
+                sr.stop(dismiss=False)
+            pending = collections.deque(incoming)
+            stalled = 0
+            while pending and stalled <= len(pending):
+                sr = pending.popleft()
+                if sr.check_requirement():
+                    sr.start()
+                    stalled = 0
+                else:
+                    pending.append(sr)
+                    stalled += 1
+                yield
+            if pending:
+                logger.warning('bundle {0} reloaded, requirements of {1} unmet, not started'.format(
+                    name, ', '.join(sorted(sr.name for sr in pending))))
+            for c in unfilled:
+                if c.__reference__.is_avaliable and not c.is_filled():
+                    for p in self._index.lookup(provides=c.resource_uri):
+                        c.bind(p)
+        self._record_timing(name, 'reload', _timer() - started)
+        yield [sr.name for sr in incoming]
+
+    def watch_bundles(self, interval=1.0):
+        if not self._watcher:
+            self._watcher = _BundleWatcher(self, interval).start()
+        return self._watcher
+
+    def unwatch_bundles(self):
+        if self._watcher:
+            self._watcher.close()
+            self._watcher = None
+
+    def watch_configuration(self, interval=1.0):
+        if not self._configuration_watcher:
+            self._configuration_watcher = _ConfigurationWatcher(self, interval).start()
+        return self._configuration_watcher
+
+    def unwatch_configuration(self):
+        if self._configuration_watcher:
+            self._configuration_watcher.close()
+            self._configuration_watcher = None
+
+    def configuration_changed(self, name, changes):
+        # removed keys are delivered with None
+        bdl = self._bundles.get(name)
+        if bdl:
+            for key, value in sorted(changes.items()):
+                bdl.em.on_configuration_changed.send(key, value)
+
     def install_bundles(self, tp_list):
         return [self.install_bundle(tp) for tp in tp_list]
 
     def get_service_reference(self, uri):
+        if uri.startswith('('):
+            references = self.find_service_references(uri)
+            return references[0] if references else None
         u = service_uri(uri, _BUNDLE_LEVEL)
         if u.bundle in self._bundles:
             return self._bundles[u.bundle].get_service_reference_by_name(u.service)
         else:
-            return None
+            return self._remote_references.get((u.bundle, u.service))
+
+    def update_remote(self, attached=(), detached=()):
+        # services published by peer frameworks join the index and binding like local providers
+        detached = [sr for sr in detached if self._remote_references.get(_producer_key(sr)) is sr]
+        for sr in detached:
+            self.unregister(sr)
+            self._remote_references.pop(_producer_key(sr))
+        self.dismiss_all(detached)
+        for sr in attached:
+            self._remote_references[_producer_key(sr)] = sr
+            self.register(sr)
+        for sr in attached:
+            if sr.provides:
+                self._digest_from_producer(sr)
+
+    def add_event_relay(self, relay):
+        self._event_relays.append(relay)
+
+    def remove_event_relay(self, relay):
+        self._event_relays.remove(relay)
+
+    def deliver_event(self, name, args=(), kwargs=None):
+        _EventProxy(
+            (e for e in self.events() if e.name == name), name, deliveries=self._event_deliveries
+        ).send(*args, **(kwargs or {}))
 
     def get_service(self, name):
+        if name.startswith('gum://'):
+            u = service_uri(name)
+            return RemoteServiceProxy(self.connect(u.host, u.port), '{0}:{1}'.format(u.bundle, u.service))
         service = self.get_service_reference(name)
         return service.get_service() if service else None
 
+    def phase(self, name, bundle=None):
+        return self._profiler.phase(name, bundle) if self._profiler else NO_PHASE
+
+    def enable_profiling(self):
+        if not self._profiler:
+            self._profiler = StartupProfiler()
+        return self._profiler
+
+    def disable_profiling(self):
+        profiler, self._profiler = self._profiler, None
+        return profiler
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def _bundles_by_state(self):
+        states = dict.fromkeys(('INSTALLED', 'RESOLVED', 'STARTING', 'ACTIVE', 'STOPING'), 0)
+        for bdl in list(self._bundles.values()):
+            states[bdl.state[1]] = states.get(bdl.state[1], 0) + 1
+        return states
+
+    def _services_by_status(self):
+        status = {'satisfied': 0, 'unsatisfied': 0}
+        for bdl in list(self._bundles.values()):
+            for sr in list(bdl.service_references.values()):
+                status['satisfied' if sr.is_satisfied else 'unsatisfied'] += 1
+        return status
+
+    @property
+    def call_metrics(self):
+        return self._call_metrics
+
+    def enable_call_metrics(self):
+        # services handed out from now on are wrapped, consumers bound before keep the plain instance
+        if not self._call_metrics:
+            self._call_metrics = CallMetrics()
+        return self._call_metrics
+
+    def disable_call_metrics(self):
+        metrics, self._call_metrics = self._call_metrics, None
+        for bdl in self.bundles.values():
+            for sr in bdl.service_references.values():
+                sr._proxy = None
+        return metrics
+
+    @property
+    def accountant(self):
+        return self._accountant
+
+    def enable_accounting(self, interval=10.0, trace_memory=True):
+        if not self._accountant:
+            self._accountant = ResourceAccountant(self, interval, trace_memory).start()
+            self.__executor__.accounting = self._accountant.record
+        return self._accountant
+
+    def disable_accounting(self):
+        if self._accountant:
+            self.__executor__.accounting = None
+            self._accountant.close()
+            self._accountant = None
+
+    def resource_usage(self):
+        return self._accountant.report() if self._accountant else {}
+
+    def attach_event_bus(self, name='gumpy', slots=1024, slot_size=1024):
+        if not self._event_bus:
+            # slots run on the executor, not on the thread polling the bus
+            self._event_bus = EventBus(name, slots, slot_size).subscribe(
+                functools.partial(self.call, self.deliver_event))
+            self.add_event_relay(self._event_bus.publish)
+        return self._event_bus
+
+    def _close_event_bus(self):
+        if self._event_bus:
+            self.remove_event_relay(self._event_bus.publish)
+            self._event_bus.close()
+            self._event_bus = None
+
+    @property
+    def remote_secret(self):
+        return self._remote_secret
+
+    @remote_secret.setter
+    def remote_secret(self, secret):
+        self._remote_secret = secret
+
+    def listen(self, host='127.0.0.1', port=3040):
+        # calls are served on the executor, it has to be looping for them to be answered
+        if not self._remote_server:
+            self._remote_server = RemoteServer(self, host, port, self._remote_secret).start()
+        return self._remote_server
+
+    def connect(self, host, port=3040, size=2, batch_window=None):
+        with self._lock:
+            if (host, port) not in self._remote_pools:
+                self._remote_pools[(host, port)] = ConnectionPool(host, port, size, secret=self._remote_secret)
+            pool = self._remote_pools[(host, port)]
+        if batch_window is not None:
+            pool.batch_window = batch_window
+        return pool
+
+    def batch(self, uri):
+        u = service_uri(uri)
+        return RemoteBatch(self.connect(u.host, u.port), '{0}:{1}'.format(u.bundle, u.service))
+
+    def _close_remote(self):
+        if self._remote_server:
+            self._remote_server.close()
+            self._remote_server = None
+        with self._lock:
+            pools, self._remote_pools = list(self._remote_pools.values()), {}
+        for pool in pools:
+            pool.close()
+
     def get(self, uri):
         u = service_uri(uri, _BUNDLE_LEVEL)
         if u.service:
@@ -782,45 +1712,155 @@ class Framework(object):
         else:
             return self._bundles[u.bundle]
 
+    def bundle_dependencies(self, names=None):
+        names = set(self._bundles) if names is None else set(names)
+        providers = collections.defaultdict(set)
+        for bdl in self._bundles.values():
+            for sr in bdl.service_references.values():
+                for resource in sr.provides:
+                    providers[resource].add(bdl.name)
+        binds, requires = {}, {}
+        for name in names:
+            bdl = self._bundles[name]
+            binds[name], requires[name] = set(), set()
+            for sr in bdl.service_references.values():
+                for resource in sr.consumes:
+                    binds[name].update(providers.get(resource, ()))
+                for uri in sr.requires:
+                    requires[name].add(service_uri(uri).bundle or name)
+            binds[name] = (binds[name] | requires[name]) & (names - {name})
+            requires[name] = requires[name] & (names - {name})
+        return binds, requires
+
+    def plan_bundles(self, names=None):
+        binds, requires = self.bundle_dependencies(names)
+        pending = set(binds)
+        levels = []
+        while pending:
+            for deps in (binds, requires):
+                level = [n for n in pending if not (deps[n] & pending)]
+                if level:
+                    break
+            else:
+                # cyclic requirements, let them wait for each other while starting
+                level = list(pending)
+            levels.append(sorted(level))
+            pending.difference_update(level)
+        return levels
+
+    def _record_timing(self, name, action, elapsed, exc=None):
+        self._timing[name][action] = elapsed
+        self._action_seconds.labels(action).observe(elapsed)
+        if exc:
+            logger.warning('bundle {0} {1} failed after {2:.3f}s'.format(name, action, elapsed))
+        else:
+            logger.info('bundle {0} {1} in {2:.3f}s'.format(name, action, elapsed))
+
+    def _run_bundles(self, action, names):
+        # fire the action on every bundle of a level, they interleave on the executor while this task sleeps
+        futures = []
+        for name in names:
+            started = _timer()
+            f = getattr(self._bundles[name], action)()
+            on_done(f, lambda f, name=name, started=started: self._record_timing(
+                name, action, _timer() - started, f.exception))
+            futures.append(f)
+        yield WaitFor(futures)
+
     @async
-    def restore_state(self):
+    def restore_state(self, state=None):
+        state = self._state_conf if state is None else state
         uri_dict = {bdl.uri: bdl for bdl in self.bundles.values()}
         invalid_uris = set()
-        for uri, start in self._state_conf.items():
+        start_names = []
+        for uri, start in list(state.items()):
             try:
-                if uri not in uri_dict:
-                    def _start_later(f, b):
-                        if f:
-                            b.start()
-
-                    f = self.install_bundle(uri)
-                    f.add_consumer(functools.partial(_start_later, start))
-                else:
+                if uri in uri_dict:
                     bdl = uri_dict[uri]
-                    if start:
-                        bdl.start()
+                else:
+                    t = _timer()
+                    bdl = self._install_bundle(uri)
+                    self._record_timing(bdl.name, 'install', _timer() - t)
+                if start and bdl.state == bdl.ST_RESOLVED:
+                    start_names.append(bdl.name)
             except BaseException as err:
                 logger.warning('bundle {0} init error:'.format(uri))
                 logger.exception(err)
                 invalid_uris.add(uri)
-        for uri in invalid_uris:
-            self._state_conf.pop(uri)
+            yield
+        if self._persist_state or state is not self._state_conf:
+            for uri in invalid_uris:
+                state.pop(uri)
+        try:
+            wiring = self._load_wiring(start_names)
+        except BaseException as err:
+            logger.exception(err)
+            wiring = None
+        if wiring:
+            logger.info('replaying wiring snapshot')
+            plan, self._replay = wiring
+        else:
+            plan = self.plan_bundles(start_names)
+        try:
+            for level in plan:
+                for waiting in self._run_bundles('start', level):
+                    yield waiting
+        finally:
+            self._replay = None
+        if wiring:
+            self._complete_wiring()
+        self._save_wiring()
 
+    @async
     def stop(self):
-        for bdl in self.bundles.values():
-            bdl.stop()
-        self._save_status()
+        self.save_state()
+        active_names = [bdl.name for bdl in self.bundles.values() if bdl.state == bdl.ST_ACTIVE]
+        try:
+            for level in reversed(self.plan_bundles(active_names)):
+                for waiting in self._run_bundles('stop', level):
+                    yield waiting
+        finally:
+            # bundles may still write while they stop
+            self.configuration.close()
 
     def terminate(self):
         self._save_status()
 
+    def close(self):
+        self.unwatch_bundles()
+        self.unwatch_configuration()
+        # the planned shutdown also records which bundles to start next time and closes the configuration
+        if self.__executor__.closed:
+            self._save_status()
+        else:
+            self._await(self.stop())
+        self.disable_accounting()
+        self._close_event_bus()
+        self._close_remote()
+
+    def _await(self, future):
+        # drive the executor here when no loop runs it, otherwise leave the future to the loop thread
+        executor = self.__executor__
+        if executor.closed:
+            return
+        if executor.thread_ident is None:
+            executor.loop()
+        elif executor.thread_ident != threading.current_thread().ident:
+            future.wait()
+
+    def save_state(self):
+        # record which bundles are active, the configuration writes it out behind
+        if self._persist_state:
+            for bdl in self.bundles.values():
+                self._state_conf[bdl.uri] = (bdl.state == bdl.ST_ACTIVE)
+        self._save_wiring()
+
     def _save_status(self):
-        for bdl in self.bundles.values():
-            self._state_conf[bdl.uri] = (bdl.state == bdl.ST_ACTIVE)
+        self.save_state()
         self.configuration.close()
 
     def call(self, fn, *args, **kwargs):
-        self.__executor__.call(functools.partial(fn, *args, **kwargs))
+        return self.__executor__.call(functools.partial(fn, *args, **kwargs))
 
 
 class DefaultFrameworkSingleton(object):
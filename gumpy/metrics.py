@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import threading
+import functools
+
+from .executor import _timer
+
+# log-linear buckets over microseconds: values below 2 ** _SUB_BITS get a bucket each,
+# every further power of two is split into 2 ** _SUB_BITS buckets (about 6% relative error)
+_SUB_BITS = 4
+_SUB_COUNT = 1 << _SUB_BITS
+_MAX_SHIFT = 40
+
+
+def _bucket_index(micros):
+    if micros < _SUB_COUNT:
+        return micros
+    shift = min(micros.bit_length() - _SUB_BITS - 1, _MAX_SHIFT)
+    return _SUB_COUNT + shift * _SUB_COUNT + min((micros >> shift) - _SUB_COUNT, _SUB_COUNT - 1)
+
+
+def _bucket_bounds(index):
+    if index < _SUB_COUNT:
+        return index, index + 1
+    shift, sub = divmod(index - _SUB_COUNT, _SUB_COUNT)
+    return (_SUB_COUNT + sub) << shift, (_SUB_COUNT + sub + 1) << shift
+
+
+class LatencyHistogram(object):
+    def __init__(self, lock=None):
+        self._lock = lock or threading.Lock()
+        self._counts = [0] * (_SUB_COUNT * (_MAX_SHIFT + 2))
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def record(self, seconds):
+        index = _bucket_index(int(seconds * 1e6))
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+            if seconds > self._max:
+                self._max = seconds
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def buckets(self):
+        with self._lock:
+            return [(i, n) for i, n in enumerate(self._counts) if n]
+
+    def quantile(self, q):
+        buckets = self.buckets()
+        total = sum(n for i, n in buckets)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, n in buckets:
+            seen += n
+            if seen >= rank:
+                lower, upper = _bucket_bounds(i)
+                return min((lower + upper) / 2.0 / 1e6, self._max)
+        return self._max
+
+    def snapshot(self):
+        return dict(
+            count=self._count,
+            mean=self._sum / self._count if self._count else 0.0,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+            max=self._max,
+        )
+
+
+class MethodMetrics(object):
+    def __init__(self):
+        # calls on several threads count their errors under the lock of the histogram
+        self._lock = threading.Lock()
+        self.errors = 0
+        self.latency = LatencyHistogram(self._lock)
+
+    def record(self, seconds, failed=False):
+        if failed:
+            with self._lock:
+                self.errors += 1
+        self.latency.record(seconds)
+
+    @property
+    def calls(self):
+        return self.latency.count
+
+    def snapshot(self):
+        rt = self.latency.snapshot()
+        rt['calls'] = rt.pop('count')
+        rt['errors'] = self.errors
+        return rt
+
+
+class CallMetrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def method(self, key):
+        metrics = self._methods.get(key)
+        if metrics is None:
+            with self._lock:
+                metrics = self._methods.setdefault(key, MethodMetrics())
+        return metrics
+
+    def wrap(self, instance, service_uri):
+        return MetricsProxy(instance, service_uri, self)
+
+    def snapshot(self):
+        with self._lock:
+            methods = list(self._methods.items())
+        return dict((key, metrics.snapshot()) for key, metrics in methods)
+
+
+def _measured(fn, metrics):
+    @functools.wraps(fn)
+    def _measured_call(*args, **kwargs):
+        started, failed = _timer(), True
+        try:
+            rt = fn(*args, **kwargs)
+            failed = False
+            return rt
+        finally:
+            metrics.record(_timer() - started, failed)
+
+    return _measured_call
+
+
+class MetricsProxy(object):
+    def __init__(self, instance, service_uri, registry):
+        object.__setattr__(self, '_instance', instance)
+        object.__setattr__(self, '_service_uri', service_uri)
+        object.__setattr__(self, '_registry', registry)
+
+    def __getattr__(self, key):
+        attr = getattr(self._instance, key)
+        if key.startswith('_') or not callable(attr):
+            return attr
+        measured = _measured(attr, self._registry.method('{0}.{1}'.format(self._service_uri, key)))
+        # later lookups find the wrapper without reaching __getattr__
+        object.__setattr__(self, key, measured)
+        return measured
+
+    def __setattr__(self, key, value):
+        setattr(self._instance, key, value)
+
+    def __repr__(self):
+        return '<MetricsProxy {0} of {1!r}>'.format(self._service_uri, self._instance)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, _escape(v)) for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+class _Value(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+
+class _Metric(object):
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            yield self.name, list(zip(self.labelnames, key)), child.value
+
+    def render(self, lines):
+        lines.append('# HELP {0} {1}'.format(self.name, self.documentation))
+        lines.append('# TYPE {0} {1}'.format(self.name, self.kind))
+        for name, pairs, value in self.samples():
+            lines.append('{0}{1} {2}'.format(name, _format_labels(pairs), _format_value(value)))
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super(self.__class__, self).__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def samples(self):
+        if not self._function:
+            for sample in super(self.__class__, self).samples():
+                yield sample
+            return
+        # sampled at scrape time; a dict maps label values to readings
+        values = self._function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            key = key if isinstance(key, tuple) else (key, )
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _HistogramValue(object):
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.count += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(self.__class__, self).__init__(name, documentation, labelnames)
+        self._buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self._buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(child.buckets, child.counts):
+                cumulative += n
+                yield self.name + '_bucket', pairs + [('le', _format_value(float(bound)))], cumulative
+            yield self.name + '_bucket', pairs + [('le', '+Inf')], child.count
+            yield self.name + '_sum', pairs, child.sum
+            yield self.name + '_count', pairs, child.count
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._by_name = {}
+        self._collectors = []
+        self._rendered = (None, '')
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+            self._by_name[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        # collector() yields extra metrics built at scrape time
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self):
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        for metric in metrics:
+            yield metric
+        for collector in collectors:
+            for metric in collector():
+                yield metric
+
+    def render(self, max_age=0):
+        # frequent scrapers share one rendering for max_age seconds
+        rendered_at, text = self._rendered
+        now = _timer()
+        if rendered_at is not None and now - rendered_at < max_age:
+            return text
+        lines = []
+        for metric in self.collect():
+            metric.render(lines)
+        text = '\n'.join(lines) + '\n'
+        self._rendered = (now, text)
+        return text
+
+
+def call_metrics_collector(framework):
+    def _collect():
+        metrics = framework.call_metrics
+        if not metrics:
+            return
+        snapshot = sorted(metrics.snapshot().items())
+        calls = Counter('gumpy_service_calls_total', 'Service method calls', ('service', 'method'))
+        errors = Counter('gumpy_service_call_errors_total', 'Service method calls raising', ('service', 'method'))
+        latency = Gauge('gumpy_service_call_seconds', 'Service method latency quantiles',
+                        ('service', 'method', 'quantile'))
+        for key, stats in snapshot:
+            service, _, method = key.rpartition('.')
+            calls.labels(service, method).value = stats['calls']
+            errors.labels(service, method).value = stats['errors']
+            for q, quantile in (('p50', '0.5'), ('p90', '0.9'), ('p99', '0.99')):
+                latency.labels(service, method, quantile).value = stats[q]
+        yield calls
+        yield errors
+        yield latency
+
+    return _collect
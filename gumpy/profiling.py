@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import os
+import json
+import threading
+import collections
+
+from .executor import _timer, _cpu_timer
+
+_Record = collections.namedtuple('PhaseRecord', ('phase', 'bundle', 'stack', 'thread', 'start', 'wall', 'cpu', 'self_wall'))
+
+
+class _NoPhase(object):
+    bundle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NO_PHASE = _NoPhase()
+
+
+class _Phase(object):
+    def __init__(self, profiler, name, bundle):
+        self._profiler = profiler
+        self._name = name
+        self.bundle = bundle
+        self._children_wall = 0.0
+
+    @property
+    def label(self):
+        return '{0} {1}'.format(self._name, self.bundle) if self.bundle else self._name
+
+    def __enter__(self):
+        self._stack = self._profiler._stack()
+        self._stack.append(self)
+        self._start, self._cpu = _timer(), _cpu_timer() if _cpu_timer else None
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        wall, cpu = _timer() - self._start, None if self._cpu is None else _cpu_timer() - self._cpu
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1]._children_wall += wall
+        self._profiler._add(_Record(
+            self._name, self.bundle, tuple(p.label for p in self._stack) + (self.label, ),
+            threading.current_thread().ident, self._start, wall, cpu, wall - self._children_wall))
+        return False
+
+
+class StartupProfiler(object):
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._records = []
+        self._origin = _timer()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _add(self, record):
+        with self._lock:
+            self._records.append(record)
+
+    @property
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def phase(self, name, bundle=None):
+        return _Phase(self, name, bundle)
+
+    def trace_events(self):
+        # chrome://tracing and speedscope read complete ('X') events
+        pid = os.getpid()
+        return dict(traceEvents=[
+            dict(name=r.stack[-1], cat=r.phase, ph='X', pid=pid, tid=r.thread,
+                 ts=(r.start - self._origin) * 1e6, dur=r.wall * 1e6,
+                 args=dict(bundle=r.bundle, cpu_ms=None if r.cpu is None else r.cpu * 1e3))
+            for r in self.records
+        ], displayTimeUnit='ms')
+
+    def folded(self):
+        # folded stacks for flamegraph.pl, weighted by self time in microseconds
+        stacks = collections.defaultdict(int)
+        for r in self.records:
+            stacks[';'.join(r.stack)] += int(round(r.self_wall * 1e6))
+        return ['{0} {1}'.format(stack, weight) for stack, weight in sorted(stacks.items()) if weight > 0]
+
+    def summary(self):
+        # cpu is None without a per-thread cpu clock
+        totals = collections.defaultdict(lambda: [0, 0.0, 0.0 if _cpu_timer else None])
+        for r in self.records:
+            total = totals[(r.phase, r.bundle)]
+            total[0] += 1
+            total[1] += r.wall
+            if r.cpu is not None:
+                total[2] += r.cpu
+        return sorted(((phase, bundle, n, wall, cpu) for (phase, bundle), (n, wall, cpu) in totals.items()),
+                      key=lambda item: item[3], reverse=True)
+
+    def format_summary(self, limit=None):
+        lines = ['  {0:<10}{1:<40}{2:>6}{3:>12}{4:>12}'.format('PHASE', 'BUNDLE', 'COUNT', 'WALL(ms)', 'CPU(ms)')]
+        for phase, bundle, n, wall, cpu in self.summary()[:limit]:
+            lines.append('  {0:<10}{1:<40}{2:>6}{3:>12.3f}{4:>12}'.format(
+                phase, bundle or '-', n, wall * 1e3, '-' if cpu is None else '%.3f' % (cpu * 1e3)))
+        return '\n'.join(lines)
+
+    def write(self, path):
+        with open(path, 'w') as fd:
+            if path.endswith('.json'):
+                json.dump(self.trace_events(), fd)
+            else:
+                fd.write('\n'.join(self.folded()) + '\n')
@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import os
+import hmac
+import codecs
+import hashlib
+import functools
+import itertools
+import socket
+import struct
+import threading
+import traceback
+from io import BytesIO
+from types import GeneratorType
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .executor import Future, on_done
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# frame header: payload length, call id, frame kind
+_HEADER = struct.Struct('!IIB')
+_PICKLE_PROTOCOL = 2
+
+KIND_CALL = 1
+KIND_RESULT = 2
+KIND_ERROR = 3
+KIND_BATCH = 4
+KIND_EVENT = 5
+
+SECRET_ENV = 'GUMPY_SECRET'
+_NONCE_SIZE = 32
+_HANDSHAKE_TIMEOUT = 10.0
+_LOOPBACK = ('127.0.0.1', 'localhost', '::1')
+
+# frames carry plain data only, unpickling any other global is refused
+_SAFE_GLOBALS = {}
+for _module in ('__builtin__', 'builtins'):
+    for _cls in (set, frozenset, complex, bytearray):
+        _SAFE_GLOBALS[(_module, _cls.__name__)] = _cls
+_SAFE_GLOBALS[('_codecs', 'encode')] = codecs.encode
+
+
+class RemoteCallError(RuntimeError):
+    pass
+
+
+class RemoteConnectionError(RemoteCallError):
+    pass
+
+
+class AuthenticationError(RemoteConnectionError):
+    pass
+
+
+def default_secret():
+    secret = os.environ.get(SECRET_ENV)
+    return secret.encode('utf-8') if secret else None
+
+
+def _require_secret(secret):
+    if not secret:
+        raise AuthenticationError('gum:// peers need a shared secret, pass one or set {0}'.format(SECRET_ENV))
+    return secret.encode('utf-8') if not isinstance(secret, bytes) else secret
+
+
+def _find_global(module, name):
+    try:
+        return _SAFE_GLOBALS[(module, name)]
+    except KeyError:
+        raise pickle.UnpicklingError('{0}.{1} is not allowed in a gum:// frame'.format(module, name))
+
+
+if hasattr(pickle, 'Unpickler') and isinstance(pickle.Unpickler, type):
+    class _DataUnpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            return _find_global(module, name)
+
+    def loads(data):
+        return _DataUnpickler(BytesIO(data)).load()
+else:
+    def loads(data):
+        unpickler = pickle.Unpickler(BytesIO(data))
+        unpickler.find_global = _find_global
+        return unpickler.load()
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise RemoteConnectionError('connection closed by peer')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame(sock):
+    # the payload is returned undecoded, so a refused frame fails its call and not the connection
+    length, call_id, kind = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return call_id, kind, _recv_exactly(sock, length) if length else None
+
+
+def decode_payload(data):
+    return loads(data) if data else None
+
+
+def encode_frame(call_id, kind, payload):
+    data = pickle.dumps(payload, _PICKLE_PROTOCOL)
+    return _HEADER.pack(len(data), call_id, kind) + data
+
+
+def _digest(secret, nonce, role):
+    return hmac.new(secret, role + nonce, hashlib.sha256).digest()
+
+
+def _challenge(sock, secret, role):
+    nonce = os.urandom(_NONCE_SIZE)
+    sock.sendall(nonce)
+    if not hmac.compare_digest(_recv_exactly(sock, hashlib.sha256().digest_size), _digest(secret, nonce, role)):
+        sock.sendall(b'\x00')
+        raise AuthenticationError('peer failed authentication')
+    sock.sendall(b'\x01')
+
+
+def _answer(sock, secret, role):
+    sock.sendall(_digest(secret, _recv_exactly(sock, _NONCE_SIZE), role))
+    if _recv_exactly(sock, 1) != b'\x01':
+        raise AuthenticationError('secret refused by peer')
+
+
+def handshake(sock, secret, server):
+    # each side proves it knows the secret by signing a nonce of the other one, before any frame is read
+    sock.settimeout(_HANDSHAKE_TIMEOUT)
+    if server:
+        _challenge(sock, secret, b'client')
+        _answer(sock, secret, b'server')
+    else:
+        _answer(sock, secret, b'client')
+        _challenge(sock, secret, b'server')
+    sock.settimeout(None)
+
+
+def _error_payload(err):
+    return type(err).__name__, str(err), traceback.format_exc()
+
+
+class _ServerConnection(object):
+    def __init__(self, server, sock):
+        self._server = server
+        self._sock = sock
+        self._write_lock = threading.Lock()
+
+    def send(self, call_id, kind, payload):
+        try:
+            frame = encode_frame(call_id, kind, payload)
+        except BaseException as err:
+            frame = encode_frame(call_id, KIND_ERROR, _error_payload(err))
+        with self._write_lock:
+            self._sock.sendall(frame)
+
+    def serve(self):
+        try:
+            handshake(self._sock, self._server.secret, True)
+            while True:
+                call_id, kind, data = read_frame(self._sock)
+                try:
+                    payload = decode_payload(data)
+                except BaseException as err:
+                    self.send(call_id, KIND_ERROR, _error_payload(err))
+                    continue
+                self._server.dispatch(self, call_id, kind, payload)
+        except AuthenticationError as err:
+            logger.warning('gum:// connection refused: {0}'.format(err))
+        except (RemoteConnectionError, socket.error):
+            pass
+        except BaseException as err:
+            logger.exception(err)
+        finally:
+            self._server.forget(self)
+            self.close()
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+
+
+# calls run through framework.call on the framework executor, one at a time with the bundles' own tasks;
+# a method returning a generator is driven as a cooperative task, so a slow one does not hold the others
+class RemoteServer(object):
+    def __init__(self, framework, host='127.0.0.1', port=3040, secret=None):
+        self._framework = framework
+        self._address = (host, port)
+        self.secret = _require_secret(secret or default_secret())
+        self._sock = None
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @property
+    def address(self):
+        return self._sock.getsockname() if self._sock else self._address
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(self._address)
+        self._sock.listen(64)
+        if self._address[0] not in _LOOPBACK:
+            logger.warning('gum:// calls served on {0}:{1}, reachable beyond this host'.format(*self.address))
+        t = threading.Thread(target=self._accept_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def _accept_forever(self):
+        while not self._closed:
+            try:
+                sock, _ = self._sock.accept()
+            except socket.error:
+                if self._closed:
+                    break
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _ServerConnection(self, sock)
+            with self._lock:
+                self._connections.add(conn)
+            t = threading.Thread(target=conn.serve)
+            t.daemon = True
+            t.start()
+
+    def forget(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+
+    def dispatch(self, conn, call_id, kind, payload):
+        if kind == KIND_CALL:
+            self._submit(conn, call_id, self._call, payload)
+        elif kind == KIND_EVENT:
+            self._submit(conn, call_id, self._framework.deliver_event, *payload)
+        elif kind == KIND_BATCH:
+            # every call of the batch answers on its own, in completion order
+            for item_id, item in payload:
+                self._submit(conn, item_id, self._call, item)
+        else:
+            conn.send(call_id, KIND_ERROR, ('RemoteCallError', 'unknown frame kind {0}'.format(kind), ''))
+
+    def invoke(self, service_uri, method, args, kwargs):
+        if method.startswith('_'):
+            raise RemoteCallError('{0}.{1} is not a public method'.format(service_uri, method))
+        if service_uri.startswith('gum://'):
+            raise RemoteCallError('{0} is not a local service'.format(service_uri))
+        service = self._framework.get_service(service_uri)
+        if service is None:
+            raise RemoteCallError('{0} not found'.format(service_uri))
+        return getattr(service, method)(*args, **kwargs)
+
+    def _call(self, payload):
+        rt = self.invoke(*payload)
+        if isinstance(rt, GeneratorType):
+            for rt in rt:
+                yield rt
+        else:
+            yield rt
+
+    def _submit(self, conn, call_id, fn, *args):
+        results = []
+        future = self._framework.call(fn, *args)
+        future.add_consumer(results.append)
+        on_done(future, functools.partial(self._reply, conn, call_id, results))
+
+    def _reply(self, conn, call_id, results, future):
+        if future.exception is not None:
+            rt, kind = (type(future.exception).__name__, str(future.exception), ''), KIND_ERROR
+        else:
+            rt, kind = results[-1] if results else None, KIND_RESULT
+        try:
+            conn.send(call_id, kind, rt)
+        except socket.error:
+            pass
+
+    def close(self):
+        self._closed = True
+        if self._sock:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self._sock.close()
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            conn.close()
+
+
+class RemoteConnection(object):
+    def __init__(self, host, port, timeout=None, secret=None):
+        secret = _require_secret(secret or default_secret())
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            handshake(self._sock, secret, False)
+        except BaseException:
+            self._sock.close()
+            raise
+        self._write_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._broken = None
+        t = threading.Thread(target=self._read_forever)
+        t.daemon = True
+        t.start()
+
+    @property
+    def is_broken(self):
+        return self._broken is not None
+
+    def _register(self, future=None):
+        future = future or Future(None)
+        with self._pending_lock:
+            if self._broken:
+                raise self._broken
+            call_id = next(self._ids) & 0xffffffff
+            self._pending[call_id] = future
+        return call_id, future
+
+    def send(self, frames):
+        try:
+            with self._write_lock:
+                self._sock.sendall(b''.join(frames))
+        except socket.error as err:
+            self._fail(RemoteConnectionError(str(err)))
+
+    def submit(self, kind, payload):
+        call_id, future = self._register()
+        self.send((encode_frame(call_id, kind, payload), ))
+        return future
+
+    def submit_batch(self, calls):
+        items = []
+        for future, payload in calls:
+            call_id, _ = self._register(future)
+            items.append((call_id, payload))
+        self.send((encode_frame(0, KIND_BATCH, items), ))
+
+    def _read_forever(self):
+        try:
+            while True:
+                call_id, kind, data = read_frame(self._sock)
+                with self._pending_lock:
+                    future = self._pending.pop(call_id, None)
+                if future is None:
+                    continue
+                try:
+                    payload = decode_payload(data)
+                except BaseException as err:
+                    future.set_exception(RemoteCallError('{0}: {1}'.format(type(err).__name__, err)))
+                    continue
+                if kind == KIND_RESULT:
+                    future.consume_result(payload)
+                    future.set_done()
+                else:
+                    name, msg, tb = payload
+                    future.set_exception(RemoteCallError('{0}: {1}'.format(name, msg), tb))
+        except (RemoteConnectionError, socket.error) as err:
+            self._fail(err if isinstance(err, RemoteConnectionError) else RemoteConnectionError(str(err)))
+        except BaseException as err:
+            logger.exception(err)
+            self._fail(RemoteConnectionError(str(err)))
+
+    def _fail(self, err):
+        with self._pending_lock:
+            self._broken = self._broken or err
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(err)
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+        self._fail(RemoteConnectionError('connection closed'))
+
+
+class ConnectionPool(object):
+    def __init__(self, host, port=3040, size=2, timeout=None, batch_window=0, batch_size=64, secret=None):
+        self._host = host
+        self._port = port
+        self._size = size
+        self._timeout = timeout
+        self._secret = secret
+        self._connections = []
+        self._connecting = 0
+        self._lock = threading.Lock()
+        self._connected = threading.Condition(self._lock)
+        self._rr = itertools.count()
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self._queued = []
+        self._queue_lock = threading.Lock()
+        self._flush_timer = None
+
+    @property
+    def address(self):
+        return self._host, self._port
+
+    def connection(self):
+        with self._lock:
+            while True:
+                self._connections = [c for c in self._connections if not c.is_broken]
+                if len(self._connections) + self._connecting < self._size:
+                    # reserve the slot, connecting and the handshake run outside the lock
+                    self._connecting += 1
+                    break
+                if self._connections:
+                    return self._connections[next(self._rr) % len(self._connections)]
+                # every slot is being connected
+                self._connected.wait()
+        conn = None
+        try:
+            conn = RemoteConnection(self._host, self._port, self._timeout, self._secret)
+        finally:
+            with self._lock:
+                self._connecting -= 1
+                if conn is not None:
+                    self._connections.append(conn)
+                self._connected.notify_all()
+        return conn
+
+    def call_async(self, service, method, *args, **kwargs):
+        if self.batch_window > 0:
+            return self._enqueue(service, method, args, kwargs)
+        return self.connection().submit(KIND_CALL, (service, method, args, kwargs))
+
+    def call(self, service, method, *args, **kwargs):
+        return self.call_async(service, method, *args, **kwargs).result()
+
+    def send_event(self, name, args=(), kwargs=None):
+        return self.connection().submit(KIND_EVENT, (name, tuple(args), kwargs or {}))
+
+    def submit_batch(self, calls):
+        if calls:
+            try:
+                self.connection().submit_batch(calls)
+            except BaseException as err:
+                for future, _ in calls:
+                    if not future.is_done:
+                        future.set_exception(err)
+
+    def _enqueue(self, service, method, args, kwargs):
+        # micro-batching: calls arriving within batch_window share one frame
+        future = Future(None)
+        with self._queue_lock:
+            self._queued.append((future, (service, method, args, kwargs)))
+            flush_now = len(self._queued) >= self.batch_size
+            if not flush_now and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.batch_window, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        if flush_now:
+            self.flush()
+        return future
+
+    def flush(self):
+        with self._queue_lock:
+            calls, self._queued = self._queued, []
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        self.submit_batch(calls)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+class _RemoteMethod(object):
+    def __init__(self, pool, service, method):
+        self._pool = pool
+        self._service = service
+        self._method = method
+
+    def __call__(self, *args, **kwargs):
+        return self._pool.call(self._service, self._method, *args, **kwargs)
+
+    def spawn(self, *args, **kwargs):
+        return self._pool.call_async(self._service, self._method, *args, **kwargs)
+
+
+class RemoteBatch(object):
+    def __init__(self, pool, service):
+        self._pool = pool
+        self._service = service
+        self._queued = []
+
+    def call(self, method, *args, **kwargs):
+        future = Future(None)
+        self._queued.append((future, (self._service, method, args, kwargs)))
+        return future
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return functools.partial(self.call, method)
+
+    def flush(self):
+        calls, self._queued = self._queued, []
+        self._pool.submit_batch(calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            calls, self._queued = self._queued, []
+            for future, _ in calls:
+                future.set_exception(RemoteCallError('batch aborted'))
+
+
+class RemoteServiceProxy(object):
+    def __init__(self, pool, service):
+        self._pool = pool
+        self._service = service
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return _RemoteMethod(self._pool, self._service, method)
+
+    def __repr__(self):
+        return '<RemoteServiceProxy {0}>'.format(self._service)
+
+
+class _RemoteBundle(object):
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address
+
+
+class RemoteServiceReference(object):
+    def __init__(self, pool, bundle, name, provides=(), properties=None):
+        self.__context__ = _RemoteBundle(bundle, pool.address)
+        self._name = name
+        self._provides = set(provides)
+        self._properties = dict(properties or {})
+        self._proxy = RemoteServiceProxy(pool, '{0}:{1}'.format(bundle, name))
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def provides(self):
+        return self._provides
+
+    @property
+    def properties(self):
+        return self._properties
+
+    @property
+    def consumers(self):
+        return set()
+
+    @property
+    def events(self):
+        return set()
+
+    @property
+    def is_avaliable(self):
+        return True
+
+    @property
+    def is_satisfied(self):
+        return True
+
+    def get_service(self):
+        return self._proxy
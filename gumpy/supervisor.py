@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import os
+import sys
+import time
+import binascii
+import threading
+import subprocess
+from types import GeneratorType
+
+from .framework import Framework
+from .configuration import open_configuration
+from .executor import Future
+from .remote import RemoteServer, ConnectionPool, RemoteServiceReference, SECRET_ENV
+from . import eventbus
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY_SERVICE = 'gumpy:directory'
+
+
+def assign_bundles(configuration, workers):
+    # bundles pinned in the '.workers' document keep their worker, the rest are dealt round-robin
+    pinned = configuration['.workers']
+    assignment = dict((i, []) for i in range(workers))
+    free = 0
+    for uri in sorted(uri for uri, start in configuration['.state'].items() if start):
+        if uri in pinned:
+            worker_id = int(pinned[uri]) % workers
+        else:
+            worker_id = free % workers
+            free += 1
+        assignment[worker_id].append(uri)
+    return assignment
+
+
+class ServiceDirectory(object):
+    def __init__(self, ttl=5.0):
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def register(self, worker_id, address, services):
+        with self._lock:
+            self._entries[worker_id] = (tuple(address), services, time.time())
+
+    def unregister(self, worker_id):
+        with self._lock:
+            self._entries.pop(worker_id, None)
+
+    def entries(self):
+        deadline = time.time() - self._ttl
+        with self._lock:
+            for worker_id in [k for k, v in self._entries.items() if v[2] < deadline]:
+                self._entries.pop(worker_id)
+            return dict((k, v[:2]) for k, v in self._entries.items())
+
+
+class _DirectoryResolver(object):
+    def __init__(self, directory):
+        self._directory = directory
+
+    def get_service(self, uri):
+        return self._directory if uri == DIRECTORY_SERVICE else None
+
+    def call(self, fn, *args, **kwargs):
+        # the directory locks on its own, calls are answered right on the connection thread
+        future = Future(None)
+        try:
+            rt = fn(*args, **kwargs)
+            for rt in rt if isinstance(rt, GeneratorType) else (rt, ):
+                future.consume_result(rt)
+        except BaseException as err:
+            future.set_exception(err)
+        else:
+            future.set_done()
+        return future
+
+    def deliver_event(self, name, args=(), kwargs=None):
+        pass
+
+
+class WorkerLink(object):
+    def __init__(self, framework, worker_id, directory_address, interval=1.0, relay_events=True):
+        self._framework = framework
+        self._worker_id = worker_id
+        self._directory = ConnectionPool(
+            directory_address[0], directory_address[1], size=1, secret=framework.remote_secret)
+        self._interval = interval
+        self._references = {}
+        self._peers = set()
+        self._closed = threading.Event()
+        self._relay_events = relay_events
+        if relay_events:
+            framework.add_event_relay(self._relay)
+
+    def local_services(self):
+        services = {}
+        for bdl in list(self._framework.bundles.values()):
+            if bdl.state == bdl.ST_ACTIVE:
+                services[bdl.name] = dict(
+                    (sr.name, dict(provides=sorted(sr.provides), properties=sr.properties))
+                    for sr in bdl.service_references.values() if sr.is_avaliable)
+        return services
+
+    def sync(self):
+        address = self._framework.listen().address
+        self._directory.call(DIRECTORY_SERVICE, 'register', self._worker_id, address, self.local_services())
+        wanted = {}
+        peers = set()
+        for worker_id, (peer_address, services) in self._directory.call(DIRECTORY_SERVICE, 'entries').items():
+            if worker_id == self._worker_id:
+                continue
+            peers.add(peer_address)
+            for bundle_name, service_dict in services.items():
+                for service_name, meta in service_dict.items():
+                    wanted[(peer_address, bundle_name, service_name)] = meta
+        self._peers = peers
+        attached = []
+        for key, meta in wanted.items():
+            if key not in self._references:
+                pool = self._framework.connect(*key[0])
+                self._references[key] = RemoteServiceReference(
+                    pool, key[1], key[2], meta['provides'], meta['properties'])
+                attached.append(self._references[key])
+        detached = [self._references.pop(key) for key in list(self._references) if key not in wanted]
+        if attached or detached:
+            self._framework.call(self._framework.update_remote, attached, detached)
+
+    def _relay(self, name, args, kwargs):
+        for address in list(self._peers):
+            try:
+                self._framework.connect(*address).send_event(name, args, kwargs)
+            except BaseException as err:
+                logger.warning('event {0} not relayed to {1}: {2}'.format(name, address, err))
+
+    def _sync_forever(self):
+        while not self._closed.is_set():
+            try:
+                self.sync()
+            except BaseException as err:
+                logger.warning('worker {0} directory sync failed: {1}'.format(self._worker_id, err))
+            self._closed.wait(self._interval)
+
+    def start(self):
+        t = threading.Thread(target=self._sync_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._relay_events:
+            self._framework.remove_event_relay(self._relay)
+        try:
+            self._directory.call(DIRECTORY_SERVICE, 'unregister', self._worker_id)
+        except BaseException as err:
+            logger.warning('worker {0} unregister failed: {1}'.format(self._worker_id, err))
+        self._directory.close()
+
+
+def _bus_name(directory_address):
+    return 'workers-{0}'.format(directory_address[1])
+
+
+def run_worker(plugins_path, worker_id, workers, directory_address, host='127.0.0.1', store='local'):
+    conf_pt = os.path.join(plugins_path, '.configuration')
+    configuration = open_configuration(conf_pt, store)
+    # the shard of a worker is not the whole .state, the supervisor's configuration stays as it is
+    fmk = Framework(configuration, plugins_path, persist_state=False)
+    fmk.listen(host, 0)
+    # workers on one host share events through shared memory, sockets are the fallback
+    if eventbus.SUPPORTED:
+        fmk.attach_event_bus(_bus_name(directory_address))
+    link = WorkerLink(fmk, worker_id, directory_address, relay_events=not eventbus.SUPPORTED).start()
+    uris = assign_bundles(configuration, workers)[worker_id]
+    fmk.restore_state(dict((uri, True) for uri in uris))
+    try:
+        fmk.__executor__.loop(True)
+    finally:
+        link.close()
+        fmk._close_event_bus()
+        fmk._close_remote()
+
+
+class Supervisor(object):
+    def __init__(self, plugins_path, workers=2, host='127.0.0.1', port=3040, interval=1.0, store='local',
+                 secret=None):
+        self._plugins_path = os.path.abspath(plugins_path)
+        # workers get the secret through their environment, a fresh one is made when none is given
+        self._secret = secret or os.environ.get(SECRET_ENV) or binascii.hexlify(os.urandom(16)).decode('ascii')
+        self._store = store
+        self._workers = workers
+        self._host = host
+        self._port = port
+        self._interval = interval
+        self._directory = ServiceDirectory(ttl=interval * 5)
+        self._server = None
+        self._processes = {}
+        self._closed = threading.Event()
+
+    @property
+    def address(self):
+        return self._server.address if self._server else (self._host, self._port)
+
+    def _spawn(self, worker_id):
+        host, port = self.address
+        cmd = [sys.executable, '-m', 'gumpy', '-p', self._plugins_path,
+               '--worker', str(worker_id), '--workers', str(self._workers),
+               '--directory', '{0}:{1}'.format(host, port), '--config-store', self._store]
+        env = dict(os.environ)
+        env[SECRET_ENV] = self._secret
+        self._processes[worker_id] = subprocess.Popen(cmd, env=env)
+        logger.info('worker {0} started, pid {1}'.format(worker_id, self._processes[worker_id].pid))
+
+    def start(self):
+        self._server = RemoteServer(
+            _DirectoryResolver(self._directory), self._host, self._port, self._secret).start()
+        for worker_id in range(self._workers):
+            self._spawn(worker_id)
+        return self
+
+    def monitor(self):
+        # restart workers that exit while the supervisor is still running
+        while not self._closed.is_set():
+            for worker_id, proc in list(self._processes.items()):
+                if proc.poll() is not None and not self._closed.is_set():
+                    logger.warning('worker {0} exited with {1}, restarting'.format(worker_id, proc.returncode))
+                    self._directory.unregister(worker_id)
+                    self._spawn(worker_id)
+            self._closed.wait(self._interval)
+
+    def close(self):
+        self._closed.set()
+        for proc in self._processes.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in self._processes.values():
+            proc.wait()
+        if self._server:
+            eventbus.unlink(_bus_name(self._server.address))
+            self._server.close()
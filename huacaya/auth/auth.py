@@ -6,6 +6,7 @@ import re
 from uuid import uuid4
 from base64 import b32encode
 from .exception import RegisterError, AuthorizationError
+from huacaya.storage.cache import CachedStorage
 try:
     from urlparse import urlparse
 except ImportError:
@@ -131,9 +132,8 @@ class Server(object):
         return False
 
     def verify_token(self, token):
-        if self._dao.has_token(token):
-            return not self._dao.get_token(token).get('disabled', False)
-        return False
+        token_data = self._dao.get_token(token)
+        return token_data is not None and not token_data.get('disabled', False)
 
     def verify_scope(self, access_token, scope):
         token_data = self._dao.get_token(access_token)
@@ -259,12 +259,18 @@ class Server(object):
         return self._dao.find_account_by_token(token)
 
 class ServerDaoWithStorage(object):
-    def __init__(self, storage):
+    def __init__(self, storage, cache_size=0, cache_ttl=None):
+        # opt-in: clients and accounts are read several times per request, the ttl bounds how long a change
+        # made by another process sharing the storage goes unseen. tokens and codes are always read through,
+        # a revocation has to take effect at once
         self._storage = storage
+        self._cached = CachedStorage(storage, cache_size, cache_ttl) if cache_size else storage
+        # idempotent on every backend, an existing bucket keeps its objects
+        self._cached.create_bucket('auth.accounts', ('username', ))
 
     @property
     def _clients(self):
-        return self._storage.get_bucket('auth.clients')
+        return self._cached.get_bucket('auth.clients')
 
     @property
     def _tokens(self):
@@ -272,7 +278,7 @@ class ServerDaoWithStorage(object):
 
     @property
     def _accounts(self):
-        return self._storage.get_bucket('auth.accounts')
+        return self._cached.get_bucket('auth.accounts')
 
     @property
     def _codes(self):
@@ -308,10 +314,8 @@ class ServerDaoWithStorage(object):
         return self._accounts.get_object(account_id)
 
     def find_account(self, data):
-        for account_id in self._accounts:
-            if set(data.items()).issubset(self._accounts[account_id].items()):
-                return self._accounts[account_id]
-        return None
+        found = self._accounts.find_one(data)
+        return found[1] if found else None
 
     def get_account_by_id(self, account_id):
         return self._accounts.get_object(account_id)
@@ -335,18 +339,18 @@ class ServerDaoWithStorage(object):
         self._tokens.put_object(token, token_data)
 
     def get_token(self, token):
-        return self._tokens.get_object(token) if token in self._tokens else None
+        # one read, an absent token comes back as None
+        return self._tokens.get_object(token)
 
     def get_accounts(self):
-        for account_id in self._accounts:
-            account = self._accounts.get_object(account_id)
+        for account_id, account in self._accounts.items():
             if 'password' in account: account.pop('password')
             yield account
 
     def get_tokens(self):
-        for token in self._tokens:
-            yield self._tokens.get_object(token)
+        for token, token_data in self._tokens.items():
+            yield token_data
 
     def get_clients(self):
-        for client_id in self._clients:
-            yield self._clients.get_object(client_id)
\ No newline at end of file
+        for client_id, client_data in self._clients.items():
+            yield client_data
\ No newline at end of file
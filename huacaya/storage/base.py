@@ -17,6 +17,19 @@ class BucketBase(object):
     def update(self, entity):
         raise NotImplementedError
 
+    def put_many(self, entities):
+        return [self.put(entity) for entity in entities]
+
+    def get_many(self, stubs):
+        return dict((stub, self.get(stub)) for stub in stubs if stub in self)
+
+    def delete_many(self, stubs):
+        for stub in stubs:
+            self.delete(stub)
+
+    def items(self, keys=None):
+        raise NotImplementedError
+
     def __contains__(self, item):
         raise NotImplementedError
 
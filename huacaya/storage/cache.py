@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import copy
+import time
+import threading
+import collections
+from .base import StorageBase
+
+try:
+    _timer = time.perf_counter
+except AttributeError:
+    _timer = time.time
+
+_MISSING = object()
+
+# key/value bucket writes, each one is wrapped below; anything else reaching the bucket through
+# __getattr__ must not write
+_WRITES = ('put_object', 'delete_object', 'put_many', 'delete_many', 'delete')
+
+# read-through cache over the key/value bucket api (get_object, put_object ...); objects are copied
+# in and out, so callers may mutate what they get. an absent key is cached too, so a membership test
+# followed by a read costs one lookup. writes through this wrapper invalidate their keys, writes from
+# elsewhere are seen once the ttl expires
+class CachedBucket(object):
+    def __init__(self, bucket, maxsize=1024, ttl=None, storage=None, name=None):
+        # entity buckets (put, get, update ...) write through methods this wrapper cannot see the keys of
+        missing = [m for m in ('get_object', 'get_many') + _WRITES if not callable(getattr(bucket, m, None))]
+        if missing:
+            raise TypeError('{0} is not a key/value bucket, no {1}'.format(type(bucket).__name__, ', '.join(missing)))
+        self._bucket = bucket
+        self._storage = storage
+        self._name = name
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expires at, object or _MISSING), oldest use first
+        self._entries = collections.OrderedDict()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, key):
+        # find, find_one, keys ... go straight to the bucket
+        return getattr(self._bucket, key)
+
+    def _lookup(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        expires, obj = entry
+        if expires is not None and expires <= _timer():
+            return None
+        self._entries[key] = entry
+        return entry
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        obj = self._bucket.get_object(key)
+        obj = _MISSING if obj is None else obj
+        self._store(generation, ((key, obj), ))
+        return obj
+
+    def _store(self, generation, pairs):
+        if self._maxsize == 0:
+            return
+        expires = _timer() + self._ttl if self._ttl else None
+        with self._lock:
+            # a write while loading makes what was read stale
+            if generation != self._generation:
+                return
+            for key, obj in pairs:
+                self._entries.pop(key, None)
+                self._entries[key] = (expires, obj if obj is _MISSING else copy.deepcopy(obj))
+            while self._maxsize and len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def _invalidate(self, keys=None):
+        with self._lock:
+            self._generation += 1
+            if keys is None:
+                self._entries.clear()
+            else:
+                for key in keys:
+                    self._entries.pop(key, None)
+
+    def invalidate(self, key=None):
+        self._invalidate(None if key is None else (key, ))
+
+    def get_object(self, key):
+        obj = self._get(key)
+        return None if obj is _MISSING else copy.deepcopy(obj)
+
+    # keys are invalidated once the write is done, a read racing it stores nothing (see _store)
+
+    def put_object(self, key, content):
+        try:
+            self._bucket.put_object(key, content)
+        finally:
+            self._invalidate((key, ))
+
+    def delete_object(self, key):
+        try:
+            self._bucket.delete_object(key)
+        finally:
+            self._invalidate((key, ))
+
+    def get_many(self, keys):
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._lookup(key)
+                if entry is None:
+                    missing.append(key)
+                    continue
+                self.hits += 1
+                if entry[1] is not _MISSING:
+                    found[key] = copy.deepcopy(entry[1])
+            self.misses += len(missing)
+            generation = self._generation
+        if missing:
+            loaded = self._bucket.get_many(missing)
+            self._store(generation, [(key, loaded.get(key, _MISSING)) for key in missing])
+            found.update(loaded)
+        return found
+
+    def put_many(self, objects):
+        pairs = list(objects.items() if isinstance(objects, dict) else objects)
+        try:
+            return self._bucket.put_many(pairs)
+        finally:
+            self._invalidate(key for key, content in pairs)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        try:
+            return self._bucket.delete_many(keys)
+        finally:
+            self._invalidate(keys)
+
+    def items(self, keys=None):
+        if keys is None:
+            return self._bucket.items()
+        keys = list(keys)
+        found = self.get_many(keys)
+        return ((key, found[key]) for key in keys if key in found)
+
+    def delete(self):
+        if self._storage is not None:
+            self._storage._forget(self._name)
+        try:
+            self._bucket.delete()
+        finally:
+            self._invalidate()
+
+    def __getitem__(self, item):
+        return self.get_object(item)
+
+    def __contains__(self, item):
+        return self._get(item) is not _MISSING
+
+    def __iter__(self):
+        return iter(self._bucket)
+
+    def cache_info(self):
+        return dict(hits=self.hits, misses=self.misses, maxsize=self._maxsize, currsize=len(self._entries))
+
+
+class CachedStorage(StorageBase):
+    def __init__(self, storage, maxsize=1024, ttl=None):
+        self._storage = storage
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def __getattr__(self, key):
+        return getattr(self._storage, key)
+
+    def _wrap(self, name, bucket):
+        cached = CachedBucket(bucket, self._maxsize, self._ttl, self, name)
+        with self._lock:
+            self._buckets[name] = cached
+        return cached
+
+    def _forget(self, name):
+        with self._lock:
+            cached = self._buckets.pop(name, None)
+        if cached is not None:
+            cached.invalidate()
+
+    def create_bucket(self, name, *args, **kwargs):
+        return self._wrap(name, self._storage.create_bucket(name, *args, **kwargs))
+
+    def get_bucket(self, name):
+        # the wrapper lives until the bucket is created again or dropped through this storage
+        cached = self._buckets.get(name)
+        if cached is None:
+            cached = self._wrap(name, self._storage.get_bucket(name))
+        return cached
+
+    def _unwrap(self, bucket):
+        if isinstance(bucket, CachedBucket):
+            self._forget(bucket._name)
+            return bucket._bucket
+        self._forget(bucket)
+        return bucket
+
+    def drop(self, bucket):
+        return self._storage.drop(self._unwrap(bucket))
+
+    def delete(self, bucket):
+        return self._storage.delete(self._unwrap(bucket))
+
+    def __contains__(self, item):
+        return item in self._storage
+
+    def cache_info(self):
+        with self._lock:
+            buckets = list(self._buckets.items())
+        return dict((name, cached.cache_info()) for name, cached in buckets)
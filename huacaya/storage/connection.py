@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import time
+import sqlite3
+import threading
+import contextlib
+
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+class _PendingWrite(object):
+    def __init__(self, fn):
+        self.fn = fn
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+# one writer connection shared by threads; writes run in an explicit transaction() or in one of their own,
+# with group_commit the writes of concurrent callers share a transaction, and so a single fsync.
+# a WAL database also gets a pool of up to `readers` read-only connections, so reads do not queue behind writes
+class SqliteConnection(object):
+    def __init__(self, uri=':memory:', synchronous='NORMAL', journal_mode='WAL', group_commit=None, timeout=5.0,
+                 readers=4):
+        if synchronous.upper() not in SYNCHRONOUS_LEVELS:
+            raise ValueError('synchronous must be one of {0}'.format(', '.join(SYNCHRONOUS_LEVELS)))
+        self._uri = uri
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._group_commit = group_commit
+        self._cond = threading.Condition()
+        self._queue = []
+        self._leading = False
+        self.commits = 0
+        self._db = sqlite3.connect(uri, timeout=timeout, isolation_level=None, check_same_thread=False)
+        # in-memory databases have no WAL, sqlite answers with the mode it kept
+        self.journal_mode = self._db.execute('PRAGMA journal_mode={0}'.format(journal_mode)).fetchone()[0]
+        self._db.execute('PRAGMA synchronous={0}'.format(synchronous.upper()))
+        self._timeout = timeout
+        self._readers = readers if self.journal_mode == 'wal' else 0
+        self._pool_cond = threading.Condition()
+        self._idle = []
+        self._opened = 0
+        self._closed = False
+
+    @property
+    def uri(self):
+        return self._uri
+
+    @property
+    def in_transaction(self):
+        return getattr(self._local, 'depth', 0) > 0
+
+    @property
+    def readers(self):
+        return self._readers
+
+    def query(self, sql, params=()):
+        return self._read(lambda db: db.execute(sql, params).fetchall())
+
+    def query_one(self, sql, params=()):
+        return self._read(lambda db: db.execute(sql, params).fetchone())
+
+    @contextlib.contextmanager
+    def reader(self):
+        # pins one reader to the calling thread for the block, e.g. for a whole request
+        if not self._readers or getattr(self._local, 'reader', None) is not None:
+            yield self
+            return
+        db = self._checkout()
+        self._local.reader = db
+        try:
+            yield self
+        finally:
+            self._local.reader = None
+            self._checkin(db)
+
+    def _read(self, fn):
+        # inside a transaction only the writer sees its own uncommitted changes
+        if not self._readers or self.in_transaction:
+            with self._lock:
+                return fn(self._db)
+        db = getattr(self._local, 'reader', None)
+        if db is not None:
+            return fn(db)
+        db = self._checkout()
+        try:
+            return fn(db)
+        finally:
+            self._checkin(db)
+
+    def _checkout(self):
+        with self._pool_cond:
+            while not self._idle:
+                if self._opened < self._readers:
+                    self._opened += 1
+                    break
+                self._pool_cond.wait()
+            else:
+                return self._idle.pop()
+        try:
+            db = sqlite3.connect(self._uri, timeout=self._timeout, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA query_only=ON')
+            return db
+        except BaseException:
+            with self._pool_cond:
+                self._opened -= 1
+                self._pool_cond.notify()
+            raise
+
+    def _checkin(self, db):
+        with self._pool_cond:
+            if self._closed:
+                db.close()
+            else:
+                self._idle.append(db)
+            self._pool_cond.notify()
+
+    def execute(self, sql, params=()):
+        return self._write(lambda db: db.execute(sql, params).rowcount)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        return self._write(lambda db: db.executemany(sql, seq_of_params).rowcount)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            depth = getattr(self._local, 'depth', 0)
+            if not depth:
+                self._db.execute('BEGIN IMMEDIATE')
+            self._local.depth = depth + 1
+            try:
+                yield self
+            except BaseException:
+                self._local.depth = depth
+                if not depth:
+                    self._db.execute('ROLLBACK')
+                raise
+            self._local.depth = depth
+            if not depth:
+                try:
+                    self._commit()
+                except BaseException:
+                    # a failed COMMIT may leave the transaction open, later writes must not join it
+                    self._rollback()
+                    raise
+
+    def _rollback(self):
+        try:
+            self._db.execute('ROLLBACK')
+        except sqlite3.OperationalError:
+            # sqlite already rolled it back
+            pass
+
+    def _commit(self):
+        self._db.execute('COMMIT')
+        self.commits += 1
+
+    def _write(self, fn):
+        if self.in_transaction:
+            return fn(self._db)
+        if not self._group_commit:
+            with self.transaction():
+                return fn(self._db)
+        pending = _PendingWrite(fn)
+        with self._cond:
+            self._queue.append(pending)
+            leading = not self._leading
+            if leading:
+                self._leading = True
+        if leading:
+            self._lead()
+        else:
+            pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _lead(self):
+        # let concurrent writers join the batch, then commit it as one transaction
+        time.sleep(self._group_commit)
+        with self._cond:
+            batch, self._queue = self._queue, []
+            self._leading = False
+        try:
+            with self._lock:
+                self._db.execute('BEGIN IMMEDIATE')
+                try:
+                    for pending in batch:
+                        # a failing write is rolled back alone, the rest of the batch still commits
+                        self._db.execute('SAVEPOINT grouped')
+                        try:
+                            pending.result = pending.fn(self._db)
+                        except BaseException as err:
+                            pending.error = err
+                            self._db.execute('ROLLBACK TO grouped')
+                        self._db.execute('RELEASE grouped')
+                    self._commit()
+                except BaseException:
+                    self._db.execute('ROLLBACK')
+                    raise
+        except BaseException as err:
+            for pending in batch:
+                if pending.error is None:
+                    pending.error = err
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+    def close(self):
+        with self._pool_cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for db in idle:
+            db.close()
+        with self._lock:
+            self._db.close()
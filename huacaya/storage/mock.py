@@ -4,11 +4,15 @@ __author__ = 'chinfeng'
 from .base import BucketBase, StorageBase
 from time import mktime
 import json
+import numbers
 import datetime
 import base64
 import sqlite3
+from .connection import SqliteConnection
 
 _singleton_storage = None
+# stays below the 999 host parameters older sqlite builds allow
+_CHUNK = 500
 
 class EnhancedJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -36,45 +40,103 @@ def _dumps(dct):
 def _loads(raw):
     return json.loads(raw, cls=EnhancedJSONDecoder)
 
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+def _json_path(field):
+    return '$."{0}"'.format(field.replace('"', ''))
+
+def _matches(fields, v):
+    return set(fields.items()).issubset(set(v.items()))
+
 class MockBucket(BucketBase):
-    def __init__(self, storage, db, name):
+    def __init__(self, storage, db, name, indexes=()):
         self._storage = storage
         self._db = db
         self._name = name
-        self._db.cursor().execute('''
+        self._indexes = frozenset(indexes)
+        self._db.execute('''
             CREATE TABLE IF NOT EXISTS {0} (
               id INTEGER PRIMARY KEY AUTOINCREMENT,
               k VARCHAR UNIQUE,
               v BLOG
             )
         '''.format(name))
+        for field in self._indexes:
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_{1} ON {0}(json_extract(v, \'{2}\'))'.format(
+                    name, storage._to_table_name(field), _json_path(field))
+            )
+
+    @property
+    def indexes(self):
+        return self._indexes
+
+    def _select(self, fields):
+        # indexed fields narrow the rows in SQL, the exact match is still checked on the decoded objects
+        where, params = [], []
+        for field, value in sorted(fields.items()):
+            # json_extract yields text and numbers (booleans as 0/1), null and containers are left to the match
+            if field in self._indexes and isinstance(value, (_string_types, numbers.Number)):
+                where.append('json_extract(v, \'{0}\')=?'.format(_json_path(field)))
+                params.append(value)
+        if not where:
+            return self.items()
+        sql = 'SELECT k, v FROM {0} WHERE {1}'.format(self._name, ' AND '.join(where))
+        return ((row[0], _loads(row[1])) for row in self._db.query(sql, params))
+
+    def transaction(self):
+        return self._db.transaction()
 
     def delete(self):
-        self._db.cursor().execute(
+        self._db.execute(
             'DROP TABLE IF EXISTS {0}'.format(self._name)
         )
+        self._storage._forget(self._name)
 
     def put_object(self, key, content):
         sql = 'INSERT OR REPLACE INTO {0}(k, v) VALUES(?, ?)'.format(self._name)
-        self._db.cursor().execute(sql, (key, _dumps(content)))
+        self._db.execute(sql, (key, _dumps(content)))
 
     def get_object(self, key):
         sql = 'SELECT v FROM {0} WHERE k=?'.format(self._name)
-        one = self._db.cursor().execute(sql, (key, )).fetchone()
+        one = self._db.query_one(sql, (key, ))
         return _loads(one[0]) if one else None
 
     def delete_object(self, key):
         sql = 'DELETE FROM {0} WHERE k=?'.format(self._name)
-        self._db.cursor().execute(sql, (key, ))
+        self._db.execute(sql, (key, ))
+
+    def put_many(self, objects):
+        pairs = objects.items() if isinstance(objects, dict) else objects
+        sql = 'INSERT OR REPLACE INTO {0}(k, v) VALUES(?, ?)'.format(self._name)
+        self._db.executemany(sql, ((k, _dumps(v)) for k, v in pairs))
+
+    def get_many(self, keys):
+        return dict(self._fetch(keys))
+
+    def delete_many(self, keys):
+        sql = 'DELETE FROM {0} WHERE k=?'.format(self._name)
+        self._db.executemany(sql, ((k, ) for k in keys))
+
+    def _fetch(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), _CHUNK):
+            chunk = keys[i:i + _CHUNK]
+            sql = 'SELECT k, v FROM {0} WHERE k IN ({1})'.format(self._name, ','.join('?' * len(chunk)))
+            for row in self._db.query(sql, chunk):
+                yield row[0], _loads(row[1])
 
     def find(self, fields):
-        for k, v in self.items():
-            if set(fields.items()).issubset(set(v.items())):
+        for k, v in self._select(fields):
+            if _matches(fields, v):
                 yield k, v
 
     def find_one(self, fields):
-        for k, v in self.items():
-            if set(fields.items()).issubset(set(v.items())):
+        for k, v in self._select(fields):
+            if _matches(fields, v):
                 return k, v
         return None
 
@@ -83,35 +145,85 @@ class MockBucket(BucketBase):
 
     def __contains__(self, item):
         sql = 'SELECT COUNT(id) FROM {0} WHERE k=?'.format(self._name)
-        return self._db.cursor().execute(sql, (item, )).fetchone()[0] > 0
+        return self._db.query_one(sql, (item, ))[0] > 0
 
     def __iter__(self):
         sql = 'SELECT k FROM {0}'.format(self._name)
-        for row in self._db.cursor().execute(sql):
+        for row in self._db.query(sql):
             yield row[0]
 
     def keys(self):
         return list(self)
 
-    def items(self):
+    def items(self, keys=None):
+        if keys is not None:
+            keys = list(keys)
+            found = self.get_many(keys)
+            for k in keys:
+                if k in found:
+                    yield k, found[k]
+            return
         sql = 'SELECT k, v FROM {0}'.format(self._name)
-        for row in self._db.cursor().execute(sql):
+        for row in self._db.query(sql):
             yield row[0], _loads(row[1])
 
 
 class MockStorage(StorageBase):
-    def __init__(self, uri=':memory:'):
-        self._sqlite_db = sqlite3.connect(uri, check_same_thread=False)
+    def __init__(self, uri=':memory:', synchronous='NORMAL', group_commit=None, readers=4):
+        self._sqlite_db = SqliteConnection(
+            uri, synchronous=synchronous, group_commit=group_commit, readers=readers
+        )
+        self._sqlite_db.execute('''
+            CREATE TABLE IF NOT EXISTS bucket_indexes (
+              bucket VARCHAR,
+              field VARCHAR,
+              PRIMARY KEY (bucket, field)
+            )
+        ''')
+        try:
+            self._sqlite_db.query('SELECT json_extract(\'{}\', \'$.a\')')
+            self._json_supported = True
+        except sqlite3.OperationalError:
+            # sqlite without json1, declared indexes fall back to scanning
+            self._json_supported = False
+        self._buckets = {}
 
     def _to_table_name(self, name):
         return base64.b32encode(name.encode('utf-8')).decode('utf-8').strip('=')
 
+    def create_bucket(self, name, indexes=()):
+        table = self._to_table_name(name)
+        self._sqlite_db.executemany(
+            'INSERT OR IGNORE INTO bucket_indexes(bucket, field) VALUES(?, ?)',
+            [(table, field) for field in indexes]
+        )
+        self._buckets.pop(table, None)
+        return self.get_bucket(name)
+
     def get_bucket(self, name):
-        return MockBucket(self, self._sqlite_db, self._to_table_name(name))
+        table = self._to_table_name(name)
+        bucket = self._buckets.get(table)
+        if bucket is None:
+            indexes = ()
+            if self._json_supported:
+                indexes = [row[0] for row in self._sqlite_db.query(
+                    'SELECT field FROM bucket_indexes WHERE bucket=?', (table, ))]
+            bucket = self._buckets[table] = MockBucket(self, self._sqlite_db, table, indexes)
+        return bucket
 
     def __getitem__(self, item):
         return self.get_bucket(item)
 
+    def transaction(self):
+        return self._sqlite_db.transaction()
+
+    def reader(self):
+        return self._sqlite_db.reader()
+
+    def _forget(self, table):
+        self._sqlite_db.execute('DELETE FROM bucket_indexes WHERE bucket=?', (table, ))
+        self._buckets.pop(table, None)
+
     def delete(self, bucket):
         if isinstance(bucket, str):
             self.get_bucket(bucket).delete()
@@ -119,7 +231,7 @@ class MockStorage(StorageBase):
             bucket.delete()
 
     def __contains__(self, name):
-        return self._sqlite_db.cursor().execute(
+        return self._sqlite_db.query_one(
             'SELECT count(*) FROM sqlite_master WHERE type=? and name=?',
             ('table', self._to_table_name(name))
-        ).fetchone()[0] > 0
+        )[0] > 0
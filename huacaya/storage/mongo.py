@@ -2,6 +2,7 @@
 __author__ = 'chinfeng'
 
 from .base import BucketBase, StorageBase
+from pymongo import ReplaceOne
 from pymongo.errors import OperationFailure
 
 class MongoBucket(BucketBase):
@@ -33,14 +34,42 @@ class MongoBucket(BucketBase):
     def delete_object(self, key):
         self._collection.remove({'key': key})
 
+    def put_many(self, objects):
+        pairs = objects.items() if isinstance(objects, dict) else objects
+        requests = [ReplaceOne({'key': k}, {'key': k, 'content': v}, upsert=True) for k, v in pairs]
+        if requests:
+            self._collection.bulk_write(requests, ordered=False)
+
+    def get_many(self, keys):
+        return dict(
+            (doc['key'], doc['content'])
+            for doc in self._collection.find({'key': {'$in': list(keys)}}, {'_id': False})
+        )
+
+    def delete_many(self, keys):
+        self._collection.delete_many({'key': {'$in': list(keys)}})
+
+    def items(self, keys=None):
+        if keys is not None:
+            keys = list(keys)
+            found = self.get_many(keys)
+            for k in keys:
+                if k in found:
+                    yield k, found[k]
+            return
+        for doc in self._collection.find({}, {'_id': False}):
+            yield doc['key'], doc['content']
+
+    # (key, content) pairs like MockBucket, ServerDaoWithStorage reads find_one results this way
     def find(self, fields):
         find_fields = {'content.%s' % k: v for k, v in fields.items()}
-        for doc in self._collection.find(find_fields):
-            yield doc
+        for doc in self._collection.find(find_fields, {'_id': False}):
+            yield doc['key'], doc['content']
 
     def find_one(self, fields):
         find_fields = {'content.%s' % k: v for k, v in fields.items()}
-        return self._collection.find_one(find_fields)
+        doc = self._collection.find_one(find_fields, {'_id': False})
+        return (doc['key'], doc['content']) if doc else None
 
     def __getitem__(self, item):
         return self.get_object(item)
@@ -59,6 +88,12 @@ class MongoStorage(StorageBase):
     def __init__(self, db):
         self._db = db
 
+    def create_bucket(self, name, indexes=()):
+        bucket = self.get_bucket(name)
+        for field in indexes:
+            bucket._collection.create_index('content.%s' % field)
+        return bucket
+
     def get_bucket(self, name):
         try:
             self._db.validate_collection(name)
@@ -3,63 +3,116 @@ __author__ = 'Chinfeng'
 
 
 import uuid
-import sqlite3
 import datetime
 import itertools
 from .base import StorageBase, BucketBase
+from .connection import SqliteConnection
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
+# stays below the 999 host parameters older sqlite builds allow
+_CHUNK = 500
+
 class SqliteBucket(BucketBase):
     def __init__(self, db, name, indexes):
         self._db = db
         self._name = name
         self._indexes = indexes
 
+    def transaction(self):
+        return self._db.transaction()
+
     def drop(self):
-        self._db.cursor().executescript('''
-            DROP TABLE IF EXISTS {table}_entities;
-            DROP TABLE IF EXISTS {table}_indexes;
-            DELETE FROM settings WHERE bucket='{table}'
-        '''.format(table=self._name))
+        with self._db.transaction():
+            self._db.execute('DROP TABLE IF EXISTS {0}_entities'.format(self._name))
+            self._db.execute('DROP TABLE IF EXISTS {0}_indexes'.format(self._name))
+            self._db.execute('DELETE FROM settings WHERE bucket=?', (self._name, ))
 
     def put(self, entity):
         if not isinstance(entity, dict):
             raise ValueError('dict type support only')
 
-        cursor = self._db.cursor()
+        with self._db.transaction() as cursor:
+            if 'id' in entity:
+                cursor.execute(
+                    'INSERT OR REPLACE INTO {0}_entities(id, updated, body) VALUES(?, ?, ?)'.format(self._name),
+                    (entity['id'], datetime.datetime.now(), pickle.dumps(entity))
+                )
+            else:
+                entity['id'] = uuid.uuid4().hex
+                cursor.execute(
+                    'INSERT INTO {0}_entities (id, updated, body) VALUES(?, ?, ?)'.format(self._name),
+                    (entity['id'], datetime.datetime.now(), pickle.dumps(entity))
+                )
+
+            index_param_list = []
+            for index in self._indexes:
+                if index in entity and isinstance(entity[index], str):
+                    index_param_list.append((entity['id'], index, entity[index]))
+            cursor.executemany(
+                'INSERT OR REPLACE INTO {0}_indexes(entity_id, index_name, index_val) VALUES(?, ?, ?)'.format(self._name),
+                index_param_list
+            )
 
-        if 'id' in entity:
-            cursor.execute(
-                'INSERT OR REPLACE INTO {0}_entities(id, updated, body) VALUES(?, ?, ?)'.format(self._name),
-                (entity['id'], datetime.datetime.now(), pickle.dumps(entity))
+        return entity['id']
+
+    def put_many(self, entities):
+        rows, index_rows = [], []
+        now = datetime.datetime.now()
+        for entity in entities:
+            if not isinstance(entity, dict):
+                raise ValueError('dict type support only')
+            if 'id' not in entity:
+                entity['id'] = uuid.uuid4().hex
+            rows.append((entity['id'], now, pickle.dumps(entity)))
+            for index in self._indexes:
+                if index in entity and isinstance(entity[index], str):
+                    index_rows.append((entity['id'], index, entity[index]))
+        with self._db.transaction() as cursor:
+            cursor.executemany(
+                'INSERT OR REPLACE INTO {0}_entities(id, updated, body) VALUES(?, ?, ?)'.format(self._name), rows
             )
-        else:
-            entity['id'] = uuid.uuid4().hex
-            cursor.execute(
-                'INSERT INTO {0}_entities (id, updated, body) VALUES(?, ?, ?)'.format(self._name),
-                (entity['id'], datetime.datetime.now(), pickle.dumps(entity))
+            cursor.executemany(
+                'INSERT OR REPLACE INTO {0}_indexes(entity_id, index_name, index_val) VALUES(?, ?, ?)'.format(self._name),
+                index_rows
             )
-
-        index_param_list = []
-        for index in self._indexes:
-            if index in entity and isinstance(entity[index], str):
-                index_param_list.append((entity['id'], index, entity[index]))
-        cursor.executemany(
-            'INSERT OR REPLACE INTO {0}_indexes(entity_id, index_name, index_val) VALUES(?, ?, ?)'.format(self._name),
-            index_param_list
+        return [row[0] for row in rows]
+
+    def get_many(self, ids):
+        ids = list(ids)
+        found = {}
+        for i in range(0, len(ids), _CHUNK):
+            chunk = ids[i:i + _CHUNK]
+            for row in self._db.query(
+                    'SELECT id, body FROM {0}_entities WHERE id IN ({1})'.format(self._name, ','.join('?' * len(chunk))),
+                    chunk):
+                found[row[0]] = pickle.loads(row[1])
+        return found
+
+    def delete_many(self, ids):
+        self._db.executemany(
+            'DELETE FROM {0}_entities WHERE id=?'.format(self._name), ((i, ) for i in ids)
         )
 
-        return entity['id']
+    def items(self, keys=None):
+        if keys is not None:
+            keys = list(keys)
+            found = self.get_many(keys)
+            for k in keys:
+                if k in found:
+                    yield k, found[k]
+            return
+        for row in self._db.query('SELECT id, body FROM {0}_entities'.format(self._name)):
+            yield row[0], pickle.loads(row[1])
 
     def get(self, stub):
         if isinstance(stub, str):
-            row = self._db.cursor().execute(
+            row = self._db.query_one(
                 'SELECT body FROM {0}_entities WHERE id=?'.format(self._name),
                 (stub, )
-            ).fetchone()
+            )
             if row:
                 return pickle.loads(row[0])
             else:
@@ -68,9 +121,9 @@ class SqliteBucket(BucketBase):
             sql = ' INTERSECT '.join((
                 'SELECT entity_id FROM {0}_indexes WHERE index_name=? AND index_val=?'.format(self._name) for i in range(len(stub))
             ))
-            row = self._db.cursor().execute(
+            row = self._db.query_one(
                 sql, tuple(itertools.chain(*stub.items()))
-            ).fetchone()
+            )
             if len(row) == 1:
                 return self.get(row[0])
             elif len(row) == 0:
@@ -80,7 +133,7 @@ class SqliteBucket(BucketBase):
 
     def delete(self, stub):
         if isinstance(stub, str):
-            self._db.cursor().execute(
+            self._db.execute(
                 'DELETE FROM {0}_entities WHERE id=?'.format(self._name),
                 (stub, )
             )
@@ -88,9 +141,9 @@ class SqliteBucket(BucketBase):
             sql = ' INTERSECT '.join((
                 'SELECT entity_id FROM {0}_indexes WHERE index_name=? AND index_val=?'.format(self._name) for i in range(len(stub))
             ))
-            row = self._db.cursor().execute(
+            row = self._db.query_one(
                 sql, tuple(itertools.chain(*stub.items()))
-            ).fetchone()
+            )
             if len(row) == 1:
                 return self.delete(row[0])
             elif len(row) == 0:
@@ -103,7 +156,7 @@ class SqliteBucket(BucketBase):
             sql = ' INTERSECT '.join((
                 'SELECT entity_id FROM {0}_indexes WHERE index_name=? AND index_val=?'.format(self._name) for i in range(len(index_dict))
             ))
-            rows = self._db.cursor().execute(
+            rows = self._db.query(
                 'SELECT body FROM {0}_entities WHERE id IN ({1})'.format(self._name, sql),
                 tuple(itertools.chain(*index_dict.items()))
             )
@@ -112,22 +165,24 @@ class SqliteBucket(BucketBase):
 
     def __contains__(self, stub):
         if isinstance(stub, str):
-            return self._db.cursor().execute(
+            return self._db.query_one(
                 'SELECT COALESCE((SELECT 1 FROM {0}_entities WHERE id=?), 0)'.format(self._name),
-                (stub, )).fetchone()[0]
+                (stub, ))[0]
         elif isinstance(stub, dict):
             sql = ' INTERSECT '.join((
                 'SELECT entity_id FROM {0}_indexes WHERE index_name=? AND index_val=?'.format(self._name) for i in range(len(stub))
             ))
-            return bool(self._db.cursor().execute(
+            return bool(self._db.query_one(
                 'SELECT EXISTS({0})'.format(sql), tuple(itertools.chain(*stub.items()))
-            ).fetchone()[0])
+            )[0])
 
 class SqliteStorage(StorageBase):
-    def __init__(self, uri=':memory:'):
-        self._sqlite_db = sqlite3.connect(uri, check_same_thread=False)
+    def __init__(self, uri=':memory:', synchronous='NORMAL', group_commit=None, readers=4):
+        self._sqlite_db = SqliteConnection(
+            uri, synchronous=synchronous, group_commit=group_commit, readers=readers
+        )
         self._sqlite_db.execute('''
-          CREATE TABLE settings (
+          CREATE TABLE IF NOT EXISTS settings (
             bucket VARCHAR PRIMARY KEY,
             indexes VARCHAR
           )
@@ -136,16 +191,16 @@ class SqliteStorage(StorageBase):
     def create_bucket(self, name, indexes=()):
         # TODO
         # CREATE BUCKET TABLE
-        cursor = self._sqlite_db.cursor()
+        cursor = self._sqlite_db
         if indexes:
             cursor.execute(
                 'INSERT OR REPLACE INTO settings(bucket, indexes) VALUES(?, ?)',
                 (name, ','.join(indexes))
             )
         else:
-            indexes_val = cursor.execute(
+            indexes_val = cursor.query_one(
                 'SELECT COALESCE((SELECT indexes FROM settings WHERE bucket=?), NULL)', (name, )
-            ).fetchone()[0]
+            )[0]
             indexes = indexes_val.split(',') if indexes_val else ()
         cursor.execute('''
           CREATE TABLE IF NOT EXISTS {table}_entities (
@@ -166,9 +221,9 @@ class SqliteStorage(StorageBase):
         return SqliteBucket(self._sqlite_db, name, indexes)
 
     def get_bucket(self, name):
-        indexes_str = self._sqlite_db.cursor().execute(
+        indexes_str = self._sqlite_db.query_one(
             'SELECT COALESCE((SELECT indexes FROM settings WHERE bucket=?), NULL)', (name, )
-        ).fetchone()[0]
+        )[0]
         return SqliteBucket(self._sqlite_db, name, indexes_str.split(',') if indexes_str else ())
 
     def drop(self, bucket):
@@ -178,6 +233,12 @@ class SqliteStorage(StorageBase):
             bucket.drop()
 
     def __contains__(self, item):
-        return self._sqlite_db.cursor().execute(
+        return self._sqlite_db.query_one(
             'SELECT COALESCE((SELECT 1 FROM settings WHERE bucket=?), 0)', (item, )
-        ).fetchone()[0]
+        )[0]
+
+    def transaction(self):
+        return self._sqlite_db.transaction()
+
+    def reader(self):
+        return self._sqlite_db.reader()
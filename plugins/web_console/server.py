@@ -3,6 +3,7 @@ __author__ = 'chinfeng'
 
 from wsgiref.util import FileWrapper
 from gumpy.deco import *
+from gumpy.executor import on_done
 import os
 import threading
 import json
@@ -47,11 +48,13 @@ def _repo(framework):
 
 def _list(framework):
     rt = []
+    usage = framework.resource_usage()
     for bdl in framework.bundles.values():
         rt.append(dict(
             name=bdl.name,
             state=bdl.state[1],
-            uri=bdl.uri
+            uri=bdl.uri,
+            usage=usage.get(bdl.name)
         ))
     return rt
 
@@ -59,6 +62,10 @@ class WSGIApplication(object):
     def __init__(self, framework):
         self._framework = framework
 
+    def _save_state(self, future):
+        # runs on the executor as the action completes, before the request waiting on it returns
+        self._framework.save_state()
+
     def __call__(self, environ, start_response):
         try:
             path = environ['PATH_INFO']
@@ -76,6 +83,11 @@ class WSGIApplication(object):
                     start_response('200 OK', headers)
                     for chunk in FileWrapper(fd):
                         yield chunk
+            elif path == '/metrics':
+                # rendered on the server thread from snapshots, the executor is never involved
+                text = self._framework.metrics.render(max_age=1.0)
+                start_response('200 OK', [('content-type', 'text/plain; version=0.0.4; charset=utf-8'), ])
+                yield text.encode('utf-8')
             else:
                 path = (environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')).split('/')
                 action = path[1]
@@ -85,18 +97,25 @@ class WSGIApplication(object):
                     rt = _repo(self._framework)
                 elif action == 'list':
                     rt = _list(self._framework)
+                elif action == 'calls':
+                    metrics = self._framework.call_metrics
+                    rt = metrics.snapshot() if metrics else {}
                 elif action == 'install' and environ["REQUEST_METHOD"].lower() == 'post':
                     _f = self._framework.install_bundle(params['uri'])
-                    _f.add_done_callback(lambda rt: self._framework.save_state())
+                    on_done(_f, self._save_state)
                     rt = dict(install_result=u'ok')
                 elif action == 'start' and environ["REQUEST_METHOD"].lower() == 'post':
                     _f = self._framework.bundles[params['name']].start()
-                    _f.add_done_callback(lambda rt: self._framework.save_state())
+                    on_done(_f, self._save_state)
                     rt = dict(start_result=u'ok')
                 elif action == 'stop' and environ["REQUEST_METHOD"].lower() == 'post':
                     _f = self._framework.bundles[params['name']].stop()
-                    _f.add_done_callback(lambda rt: self._framework.save_state())
+                    on_done(_f, self._save_state)
                     rt = dict(start_result=u'ok')
+                elif action == 'uninstall' and environ["REQUEST_METHOD"].lower() == 'post':
+                    _f = self._framework.uninstall_bundle(params['name'])
+                    on_done(_f, self._save_state)
+                    rt = dict(uninstall_result=u'ok')
                 else:
                     start_response('404 NOT FOUND', [('Content-type', 'text/plain'), ])
                     yield '404: Not Found'.encode('utf-8')
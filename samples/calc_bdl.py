@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import time
+from gumpy.deco import *
+
+__symbol__ = 'calc_bdl'
+
+
+@service
+@provide('sample_calc')
+@properties(version=1, route='calc', ranking=1)
+class SimpleCalculator(object):
+    def add(self, a, b):
+        return a + b
+
+
+@service
+@provide('sample_calc')
+@properties(version=2, route='calc', region='eu')
+class PreciseCalculator(object):
+    def add(self, a, b):
+        return float(a) + float(b)
+
+    def fail(self, msg):
+        raise ValueError(msg)
+
+    def delay(self, seconds, value):
+        # cooperative, other tasks of the executor run while it waits
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            yield
+        yield value
+
+
+@service
+class CalculatorClient(object):
+    def on_start(self):
+        self.calculators = set()
+
+    @bind('sample_calc', '0..n', filter='(&(route=calc)(version>=2))')
+    def calculator(self, calc):
+        self.calculators.add(calc)
+
+    @calculator.unbind
+    def calculator(self, calc):
+        self.calculators.remove(calc)
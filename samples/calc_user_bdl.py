@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+from gumpy.deco import *
+
+__symbol__ = 'calc_user_bdl'
+
+
+@service
+class CalculatorUser(object):
+    def on_start(self):
+        self.calculators = set()
+        self.messages = []
+
+    @bind('sample_calc', '0..n')
+    def calculator(self, calc):
+        self.calculators.add(calc)
+
+    @calculator.unbind
+    def calculator(self, calc):
+        self.calculators.remove(calc)
+
+    @event
+    def on_calc_event(self, txt):
+        self.messages.append(txt)
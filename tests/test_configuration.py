@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from gumpy import configuration
+from gumpy.configuration import LocalConfiguration, JournalConfiguration, SqliteConfiguration
+from gumpy.framework import Framework
+
+
+class LocalConfigurationTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._writes = []
+        self._atomic_write = configuration._atomic_write
+
+        def _counting_write(fn, text):
+            self._writes.append(os.path.basename(fn))
+            self._atomic_write(fn, text)
+
+        configuration._atomic_write = _counting_write
+
+    def tearDown(self):
+        configuration._atomic_write = self._atomic_write
+        shutil.rmtree(self._dir)
+
+    def _load(self, key):
+        with open(os.path.join(self._dir, key)) as fd:
+            return json.load(fd)
+
+    def test_only_dirty_documents_written(self):
+        conf = LocalConfiguration(self._dir, flush_delay=None)
+        conf['a']['x'] = 1
+        conf['b']['y'] = 2
+        conf.close()
+        self.assertEqual(sorted(self._writes), ['a', 'b'])
+
+        del self._writes[:]
+        conf = LocalConfiguration(self._dir, flush_delay=None)
+        conf['a']['x'] = 1
+        self.assertEqual(conf['b']['y'], 2)
+        self.assertFalse(conf['a'].dirty)
+        conf.close()
+        self.assertEqual(self._writes, [])
+
+        conf['b']['y'] = 3
+        conf['b']['y'] = 2
+        conf.close()
+        self.assertEqual(self._writes, [])
+
+        conf['a']['nested'] = {'k': 1}
+        conf.close()
+        conf['a']['nested']['k'] = 2
+        conf.close()
+        self.assertEqual(self._writes, ['a', 'a'])
+        self.assertEqual(self._load('a'), {'x': 1, 'nested': {'k': 2}})
+        self.assertEqual([fn for fn in os.listdir(self._dir) if fn.startswith('.')], [])
+
+    def test_write_behind_coalesces(self):
+        conf = LocalConfiguration(self._dir, flush_delay=0.05)
+        for i in range(10):
+            conf['a']['x'] = i
+            conf['b']['x'] = i
+        self.assertEqual(self._writes, [])
+        for i in range(100):
+            if len(self._writes) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sorted(self._writes), ['a', 'b'])
+        self.assertEqual(self._load('a'), {'x': 9})
+
+        conf['a']['x'] = 10
+        conf.close()
+        self.assertEqual(sorted(self._writes), ['a', 'a', 'b'])
+        self.assertEqual(self._load('a'), {'x': 10})
+
+    def test_reload_drops_pending_changes(self):
+        conf = LocalConfiguration(self._dir, flush_delay=None)
+        conf['a']['x'] = 1
+        conf.flush()
+        conf['a']['x'] = 2
+        conf.reload()
+        self.assertEqual(conf['a']['x'], 1)
+        conf.close()
+        self.assertEqual(self._writes, ['a'])
+
+
+    def test_poll_changes(self):
+        conf = LocalConfiguration(self._dir, flush_delay=None)
+        conf['a']['x'] = 1
+        conf['a']['y'] = 1
+        conf.flush()
+        self.assertEqual(conf.poll_changes(), {})
+
+        with open(os.path.join(self._dir, 'a'), 'w') as fd:
+            json.dump({'x': 2, 'z': 3}, fd)
+        with open(os.path.join(self._dir, 'b'), 'w') as fd:
+            json.dump({'k': 1}, fd)
+        conf['a']['w'] = 0
+        # a document read for the first time is the baseline, not a change
+        self.assertEqual(conf.poll_changes(['a', 'b']), {'a': {'x': 2, 'y': None, 'z': 3}})
+        self.assertEqual(conf.poll_changes(['a', 'b']), {})
+        # the unsaved local change survives the external edit and is written next
+        conf.close()
+        self.assertEqual(self._load('a'), {'w': 0, 'x': 2, 'z': 3})
+        self.assertEqual(conf.poll_changes(), {})
+
+    def test_poll_changes_after_unchanged_flush(self):
+        conf = LocalConfiguration(self._dir, flush_delay=None)
+        conf['a']['k'] = 1
+        conf.flush()
+        conf['a']['k'] = 2
+        conf['a']['k'] = 1
+        # back to what was written, nothing goes to the file
+        conf.flush()
+        pt = os.path.join(self._dir, 'a')
+        with open(pt, 'w') as fd:
+            json.dump({'k': 5}, fd)
+        os.utime(pt, (1, 1))
+        self.assertEqual(conf.poll_changes(), {'a': {'k': 5}})
+        self.assertEqual(conf['a']['k'], 5)
+        conf.close()
+        self.assertEqual(self._load('a'), {'k': 5})
+
+class JournalConfigurationTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _journal_lines(self, key):
+        with open(os.path.join(self._dir, key + '.journal')) as fd:
+            return fd.read().splitlines()
+
+    def test_replay_and_compact(self):
+        conf = JournalConfiguration(self._dir, compact_delay=None)
+        doc = conf['bdl']
+        doc['big'] = list(range(1000))
+        doc['x'] = 1
+        doc['x'] = 1
+        doc['y'] = {'a': 1}
+        doc.pop('x')
+        self.assertEqual(len(self._journal_lines('bdl')), 4)
+        # a change costs one record, however large the document
+        doc['z'] = 2
+        self.assertLess(len(self._journal_lines('bdl')[-1]), 30)
+        conf.close()
+
+        with open(os.path.join(self._dir, 'bdl.journal'), 'a') as fd:
+            fd.write('{"k": "torn", "v"')
+        conf = JournalConfiguration(self._dir, compact_delay=None)
+        self.assertEqual(conf['bdl']['y'], {'a': 1})
+        self.assertEqual(conf['bdl']['z'], 2)
+        self.assertIsNone(conf['bdl'].get('x'))
+        self.assertEqual(conf['bdl'].records, 5)
+        conf['bdl']['w'] = 0
+        self.assertEqual(self._journal_lines('bdl')[-1], '{"k": "w", "v": 0}')
+
+        self.assertEqual(conf.compact(), 1)
+        self.assertEqual(self._journal_lines('bdl'), [])
+        conf['bdl']['z'] = 3
+        conf.close()
+        conf = JournalConfiguration(self._dir, compact_delay=None)
+        self.assertEqual(sorted(conf['bdl'].keys()), ['big', 'w', 'y', 'z'])
+        self.assertEqual(conf['bdl']['z'], 3)
+        conf.close()
+
+    def test_background_compaction(self):
+        conf = JournalConfiguration(self._dir, compact_delay=0.01, compact_records=10, compact_ratio=1)
+        for i in range(10):
+            conf['bdl']['x'] = i
+        for i in range(100):
+            if not conf['bdl'].records:
+                break
+            time.sleep(0.01)
+        self.assertEqual(conf['bdl'].records, 0)
+        self.assertEqual(self._load('bdl'), {'x': 9})
+        conf.close()
+
+    def _load(self, key):
+        with open(os.path.join(self._dir, key)) as fd:
+            return json.load(fd)
+
+
+class SqliteConfigurationTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_shared_between_stores(self):
+        # versions checked on every read, commits of the other store show at once
+        one, two = SqliteConfiguration(self._dir), SqliteConfiguration(self._dir, check_interval=0)
+        try:
+            one['bdl']['x'] = {'a': 1}
+            one['bdl'].y = 2
+            self.assertEqual(two['bdl']['x'], {'a': 1})
+            self.assertEqual(two['bdl'].y, 2)
+            self.assertEqual(sorted(two['bdl'].keys()), ['x', 'y'])
+            self.assertIsNone(two['bdl'].get('z'))
+            self.assertRaises(KeyError, lambda: two['other']['z'])
+
+            # cached reads stay cached until the other store commits
+            self.assertIn('y', two._cache['bdl'])
+            one['bdl']['y'] = 2
+            self.assertIn('y', two._cache['bdl'])
+            one['bdl']['y'] = 3
+            self.assertEqual(two['bdl']['y'], 3)
+            self.assertEqual(two['bdl'].pop('y'), 3)
+            version = two['bdl'].version
+            self.assertEqual(two['bdl'].version, version)
+            one['bdl']['q'] = 1
+            self.assertNotEqual(two['bdl'].version, version)
+            one['bdl'].pop('q')
+            self.assertEqual(dict(one['bdl'].items()), {'x': {'a': 1}})
+        finally:
+            one.close()
+            two.close()
+
+    def test_framework_state(self):
+        fmk = Framework(SqliteConfiguration(self._dir))
+        fmk.configuration['.state']['samples.mod_only_bdl'] = True
+        fmk.restore_state()
+        fmk.__executor__.loop()
+        bdl = fmk.get_bundle('mod_only_bdl')
+        self.assertEqual(bdl.state, bdl.ST_ACTIVE)
+        fmk.stop()
+        fmk.__executor__.loop()
+        fmk.close()
+
+        conf = SqliteConfiguration(self._dir)
+        self.assertEqual(dict(conf['.state'].items()), {'samples.mod_only_bdl': False})
+        self.assertEqual(sorted(conf['.wiring'].keys()), ['bundles', 'edges', 'order'])
+        conf.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
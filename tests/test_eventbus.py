@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import os
+import sys
+import time
+import subprocess
+import unittest
+from gumpy import eventbus
+from gumpy.eventbus import EventBus
+from gumpy.framework import Framework
+
+_PUBLISH = '''
+import sys
+from gumpy.eventbus import EventBus
+bus = EventBus(sys.argv[1])
+bus.publish('on_calc_event', ('from %d' % bus.head, ))
+bus.close()
+'''
+
+
+@unittest.skipUnless(eventbus.SUPPORTED, 'shared memory event bus not supported')
+class EventBusTestCase(unittest.TestCase):
+    def setUp(self):
+        self._name = 'test-{0}'.format(os.getpid())
+
+    def tearDown(self):
+        eventbus.unlink(self._name)
+
+    def test_publish_and_poll(self):
+        a = EventBus(self._name, slots=4, slot_size=256)
+        b = EventBus(self._name)
+        received = []
+        b._handlers.append(lambda *evt: received.append(evt))
+        a._handlers.append(lambda *evt: received.append(('own', ) + evt))
+        try:
+            a.publish('on_changed', ('k', ), {'v': 1})
+            self.assertEqual(b.poll(), 1)
+            self.assertEqual(a.poll(), 0)
+            self.assertEqual(received, [('on_changed', ('k', ), {'v': 1})])
+
+            for i in range(6):
+                a.publish('on_changed', (i, ))
+            self.assertEqual(b.poll(), 4)
+            self.assertEqual(b.lost, 2)
+            self.assertEqual([evt[1] for evt in received[1:]], [(2, ), (3, ), (4, ), (5, )])
+            self.assertRaises(ValueError, a.publish, 'on_changed', ('x' * 512, ))
+        finally:
+            a.close()
+            b.close()
+
+    def test_doorbell(self):
+        a = EventBus(self._name)
+        b = EventBus(self._name, spin=0, max_wait=30.0)
+        received = []
+        b.subscribe(lambda *evt: received.append(evt))
+        try:
+            time.sleep(0.05)
+            started = time.time()
+            a.publish('on_changed', ('rung', ))
+            while not received and time.time() - started < 5.0:
+                time.sleep(0.001)
+            self.assertEqual(received, [('on_changed', ('rung', ), {})])
+            self.assertLess(time.time() - started, 1.0)
+        finally:
+            a.close()
+            started = time.time()
+            b.close()
+            self.assertLess(time.time() - started, 1.0)
+
+    def test_undecodable_event(self):
+        a = EventBus(self._name)
+        b = EventBus(self._name)
+        received = []
+        b.subscribe(lambda *evt: received.append(evt))
+        try:
+            # a pickled global is refused, the poller drops it and keeps going
+            a.publish('on_changed', (os.getcwd, ))
+            a.publish('on_changed', ('good', ))
+            started = time.time()
+            while not received and time.time() - started < 5.0:
+                time.sleep(0.001)
+            self.assertEqual(received, [('on_changed', ('good', ), {})])
+            self.assertEqual(b.lost, 1)
+            self.assertTrue(b._thread.is_alive())
+        finally:
+            a.close()
+            b.close()
+
+    def test_framework_across_processes(self):
+        fmk = Framework()
+        fmk.install_bundle('samples.calc_user_bdl')
+        fmk.__executor__.loop()
+        fmk.get_bundle('calc_user_bdl').start()
+        fmk.__executor__.loop()
+        fmk.attach_event_bus(self._name)
+        try:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            subprocess.check_call([sys.executable, '-c', _PUBLISH, self._name], cwd=root)
+            user = fmk.get_service('calc_user_bdl:CalculatorUser')
+            for _ in range(100):
+                fmk.__executor__.loop()
+                if user.messages:
+                    break
+                time.sleep(0.02)
+            self.assertEqual(user.messages, ['from 1'])
+        finally:
+            fmk._close_event_bus()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 __author__ = 'Chinfeng'
 
 import gumpy
+import time
 import unittest
 import functools
+import threading
+from gumpy.executor import _cpu_timer
 try:
     from Queue import Empty
 except ImportError:
@@ -60,5 +63,42 @@ class ExecutorTestCase(unittest.TestCase):
             except Empty:
                 break
 
+    def test_wait_for(self):
+        from gumpy.executor import WaitFor
+        extr = self._executor
+        steps = []
+
+        def _work(n):
+            for i in range(n):
+                yield i
+
+        def _waiter():
+            futures = [extr.call(functools.partial(_work, 5)), extr.call(functools.partial(_work, 3))]
+            steps.append(extr.queue_depth)
+            yield WaitFor(futures)
+            steps.append([f.is_done for f in futures])
+            yield 'resumed'
+
+        f = extr.call(_waiter)
+        extr.loop()
+        # the waiter is off the queue while it sleeps, and resumes once both futures are done
+        self.assertEqual(steps, [2, [True, True]])
+        self.assertEqual(f.result(), 'resumed')
+
+    @unittest.skipIf(_cpu_timer is None, 'no per-thread cpu clock')
+    def test_cpu_timer_per_thread(self):
+        def _spin():
+            until = time.time() + 0.3
+            while time.time() < until:
+                pass
+
+        started = _cpu_timer()
+        t = threading.Thread(target=_spin)
+        t.start()
+        t.join()
+        # another thread burning cpu is not charged to this one
+        self.assertLess(_cpu_timer() - started, 0.1)
+
+
 if __name__ == '__main__':
     unittest.main()
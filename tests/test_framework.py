@@ -0,0 +1,712 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import gc
+import os
+import sys
+import json
+import shutil
+import operator
+import tempfile
+import threading
+import time
+import unittest
+import samples
+from gumpy.framework import Framework, Consumer
+from gumpy.deco import cached
+from gumpy.configuration import LocalConfiguration, JournalConfiguration, SqliteConfiguration
+
+
+def _sample_path(fn):
+    return os.path.join(os.path.dirname(samples.__file__), fn)
+
+
+class FrameworkTestCase(unittest.TestCase):
+    def setUp(self):
+        fmk = Framework()
+        fmk.install_bundle('samples.mod_bdl')
+        fmk.install_bundle(_sample_path('file_bdl.py'))
+        fmk.install_bundle('samples.mod_only_bdl')
+        fmk.__executor__.loop()
+        for bn in ('mod_bdl', 'file_bdl', 'mod_only_bdl'):
+            fmk.get_bundle(bn).start()
+        fmk.__executor__.loop()
+        self._fmk = fmk
+
+    def tearDown(self):
+        self._fmk = None
+
+    def test_bundle_stop_dismisses_in_one_pass(self):
+        fmk = self._fmk
+        msa = fmk.get_service('mod_bdl:SampleServiceA')
+        file_bdl = fmk.get_bundle('file_bdl')
+        stopping = set(file_bdl.service_references.values())
+
+        bound = []
+        _bind = Consumer.bind
+
+        def _recording_bind(consumer, reference):
+            rt = _bind(consumer, reference)
+            if rt:
+                bound.append(reference)
+            return rt
+
+        Consumer.bind = _recording_bind
+        try:
+            file_bdl.stop()
+            fmk.__executor__.loop()
+        finally:
+            Consumer.bind = _bind
+
+        self.assertEqual(file_bdl.state, file_bdl.ST_RESOLVED)
+        self.assertFalse(stopping.intersection(bound))
+        self.assertEqual(len(msa.ones), 0)
+        self.assertEqual(len(msa.twos), 2)
+        self.assertEqual(list(msa.only), [fmk.get_service('mod_only_bdl:SampleServiceOnly')])
+
+    def test_uninstall_bundle(self):
+        fmk = self._fmk
+        msa = fmk.get_service('mod_bdl:SampleServiceA')
+        f = fmk.uninstall_bundle('file_bdl')
+        fmk.__executor__.loop()
+        self.assertIs(f.result(), True)
+        self.assertNotIn('file_bdl', fmk.bundles)
+        self.assertNotIn('file_bdl', sys.modules)
+        self.assertEqual(len(msa.ones), 0)
+
+        f = fmk.uninstall_bundle('mod_only_bdl')
+        fmk.__executor__.loop()
+        self.assertIs(f.result(), True)
+        self.assertNotIn('samples.mod_only_bdl', sys.modules)
+        self.assertFalse(hasattr(samples, 'mod_only_bdl'))
+        self.assertFalse(fmk.get_service_reference('mod_bdl:SampleServiceA').is_satisfied)
+
+        fmk.install_bundle('samples.mod_only_bdl')
+        fmk.__executor__.loop()
+        fmk.get_bundle('mod_only_bdl').start()
+        fmk.__executor__.loop()
+        self.assertEqual(list(msa.only), [fmk.get_service('mod_only_bdl:SampleServiceOnly')])
+
+
+class FrameworkStateTestCase(unittest.TestCase):
+    def test_restore_and_stop_in_dependency_order(self):
+        fmk = Framework()
+        file_uri = _sample_path('file_bdl.py')
+        for uri in ('samples.mod_bdl', file_uri, 'samples.mod_only_bdl'):
+            fmk.configuration['.state'][uri] = True
+        fmk.restore_state()
+        fmk.__executor__.loop()
+
+        self.assertEqual(fmk.plan_bundles(), [['mod_only_bdl'], ['mod_bdl'], ['file_bdl']])
+        for bdl in fmk.bundles.values():
+            self.assertEqual(bdl.state, bdl.ST_ACTIVE)
+            self.assertIn('install', fmk.timing[bdl.name])
+            self.assertIn('start', fmk.timing[bdl.name])
+        msa = fmk.get_service('mod_bdl:SampleServiceA')
+        self.assertEqual(len(msa.ones), 1)
+        self.assertEqual(len(msa.only), 1)
+
+        fmk.stop()
+        fmk.__executor__.loop()
+        for bdl in fmk.bundles.values():
+            self.assertEqual(bdl.state, bdl.ST_RESOLVED)
+            self.assertIn('stop', fmk.timing[bdl.name])
+        self.assertTrue(all(fmk.configuration['.state'].values()))
+
+    def test_close_stops_in_dependency_order(self):
+        conf_dir = tempfile.mkdtemp()
+        try:
+            fmk = Framework(LocalConfiguration(conf_dir))
+            file_uri = _sample_path('file_bdl.py')
+            for uri in ('samples.mod_bdl', file_uri, 'samples.mod_only_bdl'):
+                fmk.configuration['.state'][uri] = True
+            fmk.restore_state()
+            fmk.__executor__.loop()
+
+            stopped = []
+            for bdl in fmk.bundles.values():
+                bdl._deactivator = lambda name=bdl.name: stopped.append(name)
+            fmk.close()
+            self.assertEqual(stopped, ['file_bdl', 'mod_bdl', 'mod_only_bdl'])
+            for bdl in fmk.bundles.values():
+                self.assertEqual(bdl.state, bdl.ST_RESOLVED)
+            with open(os.path.join(conf_dir, '.state')) as fd:
+                self.assertTrue(all(json.load(fd).values()))
+        finally:
+            shutil.rmtree(conf_dir)
+
+    def test_stop_closes_configuration_after_bundles(self):
+        conf_dir = tempfile.mkdtemp()
+        try:
+            fmk = Framework(LocalConfiguration(conf_dir))
+            fmk.configuration['.state']['samples.mod_only_bdl'] = True
+            fmk.restore_state()
+            fmk.__executor__.loop()
+
+            def _deactivator():
+                # still open while bundles stop, closing it writes this out
+                fmk.configuration['shutdown']['mod_only_bdl'] = True
+
+            fmk.get_bundle('mod_only_bdl')._deactivator = _deactivator
+            fmk.stop()
+            fmk.__executor__.loop()
+            with open(os.path.join(conf_dir, 'shutdown')) as fd:
+                self.assertEqual(json.load(fd), {'mod_only_bdl': True})
+        finally:
+            shutil.rmtree(conf_dir)
+
+    def _restart(self, conf_dir, tamper=None):
+        fmk = Framework(LocalConfiguration(conf_dir))
+        if tamper:
+            tamper(fmk.configuration['.wiring'])
+        searched = []
+        _lookup = fmk._index.lookup
+
+        def _recording_lookup(*args, **kwargs):
+            searched.append(True)
+            return _lookup(*args, **kwargs)
+
+        fmk._index.lookup = _recording_lookup
+        fmk.restore_state()
+        fmk.__executor__.loop()
+        del fmk._index.lookup
+        return fmk, bool(searched)
+
+    def test_warm_start_from_wiring_snapshot(self):
+        conf_dir = tempfile.mkdtemp()
+        try:
+            fmk = Framework(LocalConfiguration(conf_dir))
+            for uri in ('samples.mod_bdl', _sample_path('file_bdl.py'), 'samples.mod_only_bdl'):
+                fmk.configuration['.state'][uri] = True
+            fmk.restore_state()
+            fmk.__executor__.loop()
+            wiring = fmk.wiring_snapshot()
+            fmk.stop()
+            fmk.__executor__.loop()
+            self.assertTrue(os.path.exists(os.path.join(conf_dir, '.wiring')))
+
+            fmk, searched = self._restart(conf_dir)
+            self.assertFalse(searched)
+            self.assertEqual(fmk.wiring_snapshot()['edges'], wiring['edges'])
+            fmk.stop()
+            fmk.__executor__.loop()
+
+            def _tamper(doc):
+                for bundle in doc['bundles'].values():
+                    bundle['hash'] = 'outdated'
+
+            fmk, searched = self._restart(conf_dir, _tamper)
+            self.assertTrue(searched)
+            self.assertEqual(fmk.wiring_snapshot()['edges'], wiring['edges'])
+        finally:
+            fmk = None
+            gc.collect()
+            shutil.rmtree(conf_dir)
+
+
+class ServiceFilterTestCase(unittest.TestCase):
+    def setUp(self):
+        fmk = Framework()
+        fmk.install_bundle('samples.calc_bdl')
+        fmk.__executor__.loop()
+        fmk.get_bundle('calc_bdl').start()
+        fmk.__executor__.loop()
+        self._fmk = fmk
+
+    def test_filter_lookup(self):
+        fmk = self._fmk
+        simple = fmk.get_service('calc_bdl:SimpleCalculator')
+        precise = fmk.get_service('calc_bdl:PreciseCalculator')
+
+        self.assertIs(fmk.get_service('(&(route=calc)(version>=2))'), precise)
+        self.assertIs(fmk.get_service('(route=calc)'), simple)  # higher ranking first
+        self.assertIs(fmk.get_service('(!(route=*))'), fmk.get_service('calc_bdl:CalculatorClient'))
+        self.assertEqual(
+            [sr.name for sr in fmk.find_service_references('(|(version<=1)(region~=EU))', 'sample_calc')],
+            ['SimpleCalculator', 'PreciseCalculator'])
+        self.assertIsNone(fmk.get_service('(version>=3)'))
+        self.assertEqual(fmk.get_service('calc_bdl:CalculatorClient').calculators, {precise})
+
+        fmk.get('calc_bdl:SimpleCalculator').set_properties(version=3)
+        self.assertIs(fmk.get_service('(version>=3)'), simple)
+        self.assertEqual(fmk.get_service('calc_bdl:CalculatorClient').calculators, {simple, precise})
+
+        # a property change that flips the filter off unbinds the consumer
+        fmk.get('calc_bdl:PreciseCalculator').set_properties(route='legacy')
+        self.assertEqual(fmk.get_service('calc_bdl:CalculatorClient').calculators, {simple})
+        self.assertEqual(next(iter(fmk.get('calc_bdl:CalculatorClient').consumers)).consumed_resources,
+                         {fmk.get('calc_bdl:SimpleCalculator')})
+        fmk.get('calc_bdl:SimpleCalculator').set_properties(version=1)
+        self.assertEqual(fmk.get_service('calc_bdl:CalculatorClient').calculators, set())
+
+    def test_invalid_filter(self):
+        from gumpy.filters import InvalidFilterError
+        for expr in ('(route=calc', '(&)', '(route)', '(route=calc))'):
+            self.assertRaises(InvalidFilterError, self._fmk.get_service, expr)
+
+
+class ResourceAccountingTestCase(unittest.TestCase):
+    def test_usage_per_bundle(self):
+        fmk = Framework()
+        fmk.enable_accounting(interval=0)
+        try:
+            for bn in ('calc_bdl', 'calc_user_bdl'):
+                fmk.install_bundle('samples.{0}'.format(bn))
+            fmk.__executor__.loop()
+            for bn in ('calc_bdl', 'calc_user_bdl'):
+                fmk.get_bundle(bn).start()
+            usage = fmk.resource_usage()
+            self.assertEqual(usage['calc_bdl']['futures'], 1)
+            self.assertEqual(usage['calc_bdl']['steps'], 0)
+
+            fmk.__executor__.loop()
+            usage = fmk.resource_usage()
+            self.assertEqual(usage['calc_bdl']['futures'], 0)
+            self.assertGreater(usage['calc_bdl']['steps'], 0)
+            self.assertGreater(usage['calc_bdl']['wall_time'], 0)
+            self.assertEqual(usage['calc_bdl']['services'], 3)
+            self.assertEqual(usage['calc_user_bdl']['events'], 1)
+            if fmk.accountant._trace_memory:
+                self.assertGreater(usage['calc_bdl']['memory'], 0)
+            else:
+                self.assertIsNone(usage['calc_bdl']['memory'])
+        finally:
+            fmk.disable_accounting()
+        self.assertEqual(fmk.resource_usage(), {})
+
+
+_HOT_BDL = """
+from gumpy.deco import *
+
+__symbol__ = 'hot_bdl'
+
+
+@service
+@provide('hot_res')
+class HotProvider(object):
+    def value(self):
+        return {value}
+
+
+@service
+class HotSteady(object):
+    pass
+
+
+@service
+class HotConsumer(object):
+    @bind('hot_res', '1..1')
+    def provider(self, provider):
+        self.current = provider
+
+    @provider.unbind
+    def provider(self, provider):
+        self.current = None
+"""
+
+
+class HotReloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._pt = os.path.join(self._dir, 'hot_bdl.py')
+        self._write(1, 0)
+        fmk = Framework()
+        fmk.install_bundle(self._pt)
+        fmk.__executor__.loop()
+        fmk.get_bundle('hot_bdl').start()
+        fmk.__executor__.loop()
+        self._fmk = fmk
+
+    def tearDown(self):
+        self._fmk = None
+        sys.modules.pop('hot_bdl', None)
+        shutil.rmtree(self._dir)
+
+    def _write(self, value, mtime):
+        with open(self._pt, 'w') as fd:
+            fd.write(_HOT_BDL.format(value=value))
+        os.utime(self._pt, (mtime, mtime))
+
+    def test_reload_changed_services_only(self):
+        fmk = self._fmk
+        steady = fmk.get_service('hot_bdl:HotSteady')
+        consumer = fmk.get_service('hot_bdl:HotConsumer')
+        self.assertEqual(consumer.current.value(), 1)
+
+        f = fmk.reload_bundle('hot_bdl')
+        fmk.__executor__.loop()
+        self.assertEqual(f.result(), [])
+
+        self._write(2, 100)
+        f = fmk.reload_bundle('hot_bdl')
+        fmk.__executor__.loop()
+        self.assertEqual(f.result(), ['HotProvider'])
+        self.assertIs(fmk.get_service('hot_bdl:HotSteady'), steady)
+        self.assertIs(fmk.get_service('hot_bdl:HotConsumer'), consumer)
+        self.assertIs(consumer.current, fmk.get_service('hot_bdl:HotProvider'))
+        self.assertEqual(consumer.current.value(), 2)
+
+    def test_watcher(self):
+        fmk = self._fmk
+        watcher = fmk.watch_bundles(interval=60)
+        try:
+            self.assertEqual(watcher.check(), [])
+            os.utime(self._pt, (200, 200))
+            self.assertEqual(watcher.check(), [])
+            self._write(3, 300)
+            futures = watcher.check()
+            fmk.__executor__.loop()
+            self.assertEqual([f.result() for f in futures], [['HotProvider']])
+            self.assertEqual(fmk.get_service('hot_bdl:HotConsumer').current.value(), 3)
+        finally:
+            fmk.unwatch_bundles()
+
+
+_PKG_INIT = """
+__symbol__ = 'pkg_hot_bdl'
+
+from .impl import *
+"""
+
+_PKG_IMPL = """
+from gumpy.deco import *
+from .helper import scale
+
+
+@service
+class PkgProvider(object):
+    def value(self):
+        return scale(1)
+"""
+
+
+class PackageReloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._pkg = os.path.join(self._dir, 'pkg_hot_bdl')
+        os.mkdir(self._pkg)
+        self._write('__init__.py', _PKG_INIT, 0)
+        self._write('impl.py', _PKG_IMPL, 0)
+        self._write('helper.py', 'def scale(x):\n    return x * 1\n', 0)
+        sys.path.insert(0, self._dir)
+        fmk = Framework()
+        fmk.install_bundle('pkg_hot_bdl')
+        fmk.__executor__.loop()
+        fmk.get_bundle('pkg_hot_bdl').start()
+        fmk.__executor__.loop()
+        self._fmk = fmk
+
+    def tearDown(self):
+        self._fmk = None
+        sys.path.remove(self._dir)
+        for name in [n for n in sys.modules if n == 'pkg_hot_bdl' or n.startswith('pkg_hot_bdl.')]:
+            sys.modules.pop(name)
+        shutil.rmtree(self._dir)
+
+    def _write(self, fn, text, mtime):
+        pt = os.path.join(self._pkg, fn)
+        with open(pt, 'w') as fd:
+            fd.write(text)
+        os.utime(pt, (mtime, mtime))
+
+    def test_reload_submodules(self):
+        fmk = self._fmk
+        self.assertEqual(fmk.get_service('pkg_hot_bdl:PkgProvider').value(), 1)
+        # only the helper changes, impl imports from it and runs again after it
+        self._write('helper.py', 'def scale(x):\n    return x * 2\n', 100)
+        f = fmk.reload_bundle('pkg_hot_bdl')
+        fmk.__executor__.loop()
+        f.result()
+        self.assertEqual(fmk.get_service('pkg_hot_bdl:PkgProvider').value(), 2)
+
+
+class StartupProfilingTestCase(unittest.TestCase):
+    def test_startup_phases(self):
+        fmk = Framework()
+        profiler = fmk.enable_profiling()
+        for uri in ('samples.mod_bdl', _sample_path('file_bdl.py'), 'samples.mod_only_bdl'):
+            fmk.configuration['.state'][uri] = True
+        fmk.restore_state()
+        fmk.__executor__.loop()
+        self.assertIs(fmk.disable_profiling(), profiler)
+
+        phases = {(r.phase, r.bundle) for r in profiler.records}
+        for bn in ('mod_bdl', 'file_bdl', 'mod_only_bdl'):
+            for phase in ('import', 'scan', 'activate', 'digest'):
+                self.assertIn((phase, bn), phases)
+        self.assertIn(('start', 'mod_bdl:SampleServiceA'), phases)
+        self.assertIn('start mod_bdl:SampleServiceA;digest mod_bdl', [l.rsplit(' ', 1)[0] for l in profiler.folded()])
+        summary = profiler.summary()
+        self.assertEqual(summary, sorted(summary, key=lambda item: item[3], reverse=True))
+
+        fd, pt = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            profiler.write(pt)
+            with open(pt) as f:
+                events = json.load(f)['traceEvents']
+            self.assertEqual(len(events), len(profiler.records))
+            self.assertTrue(all(e['ph'] == 'X' and e['dur'] >= 0 for e in events))
+        finally:
+            os.remove(pt)
+
+
+_CACHE_BDL = """
+from gumpy.deco import *
+
+__symbol__ = 'cache_bdl'
+
+
+@service
+class CachedSum(object):
+    def on_start(self):
+        self.calculators = set()
+        self.computed = 0
+
+    @bind('sample_calc', '0..n')
+    def calculator(self, calc):
+        self.calculators.add(calc)
+
+    @calculator.unbind
+    def calculator(self, calc):
+        self.calculators.remove(calc)
+
+    @cached()
+    def total(self, a, b):
+        self.computed += 1
+        return sum(calc.add(a, b) for calc in self.calculators)
+"""
+
+
+class _Slow(object):
+    def __init__(self):
+        self.computed = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    @cached(maxsize=2)
+    def square(self, n):
+        self.computed += 1
+        self.entered.set()
+        self.release.wait(5)
+        return n * n
+
+    @cached(ttl=0.05)
+    def ident(self, n, **kwargs):
+        self.computed += 1
+        return n
+
+
+class CachedCallTestCase(unittest.TestCase):
+    def test_invalidated_by_events_and_bindings(self):
+        d = tempfile.mkdtemp()
+        try:
+            pt = os.path.join(d, 'cache_bdl.py')
+            with open(pt, 'w') as fd:
+                fd.write(_CACHE_BDL)
+            fmk = Framework()
+            fmk.install_bundle('samples.calc_bdl')
+            fmk.install_bundle(pt)
+            fmk.__executor__.loop()
+            for bn in ('calc_bdl', 'cache_bdl'):
+                fmk.get_bundle(bn).start()
+            fmk.__executor__.loop()
+            svc = fmk.get_service('cache_bdl:CachedSum')
+
+            self.assertEqual(svc.total(1, 2), 6)
+            self.assertEqual(svc.total(1, 2), 6)
+            self.assertEqual(svc.computed, 1)
+            self.assertEqual(svc.total.cache_info()['hits'], 1)
+
+            fmk.get_bundle('cache_bdl').em.on_configuration_changed.send('key', 1)
+            self.assertEqual(svc.total(1, 2), 6)
+            self.assertEqual(svc.computed, 2)
+
+            fmk.get_bundle('calc_bdl').stop()
+            fmk.__executor__.loop()
+            self.assertEqual(svc.total(1, 2), 0)
+            self.assertEqual(svc.computed, 3)
+        finally:
+            sys.modules.pop('cache_bdl', None)
+            shutil.rmtree(d)
+
+    def test_lru_and_ttl(self):
+        slow = _Slow()
+        slow.release.set()
+        for n in (1, 2, 1, 3, 1, 2):
+            slow.square(n)
+        # 2 is the least recently used when 3 comes in
+        self.assertEqual(slow.computed, 4)
+        self.assertEqual(slow.square.cache_info()['currsize'], 2)
+
+        slow.computed = 0
+        slow.ident(1, flag=True)
+        slow.ident(1, flag=True)
+        slow.ident([1])
+        slow.ident([1])
+        self.assertEqual(slow.computed, 3)
+        time.sleep(0.1)
+        slow.ident(1, flag=True)
+        self.assertEqual(slow.computed, 4)
+        # positional and keyword arguments never share a key
+        self.assertEqual(slow.ident(('n', 1)), ('n', 1))
+        self.assertEqual(slow.ident(n=1), 1)
+
+    def test_falsy_instance(self):
+        class _Empty(_Slow):
+            def __len__(self):
+                return 0
+
+        empty = _Empty()
+        empty.release.set()
+        self.assertEqual(empty.square(2), 4)
+        self.assertEqual(empty.square(2), 4)
+        self.assertEqual(empty.computed, 1)
+
+    def test_concurrent_misses_compute_once(self):
+        slow = _Slow()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(slow.square(3))) for i in range(4)]
+        threads[0].start()
+        slow.entered.wait(5)
+        for t in threads[1:]:
+            t.start()
+        time.sleep(0.05)
+        slow.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [9] * 4)
+        self.assertEqual(slow.computed, 1)
+        info = slow.square.cache_info()
+        self.assertEqual((info['misses'], info['waits']), (1, 3))
+
+
+_CONF_BDL = """
+from gumpy.deco import *
+
+__symbol__ = 'conf_bdl'
+
+
+@service
+class ConfiguredService(object):
+    def on_start(self):
+        self.changes = []
+
+    @event
+    def on_configuration_changed(self, key, value):
+        self.changes.append((key, value))
+
+    @configuration(a='a', b=('b', ), c=('c', 'none'))
+    def settings(self, a, b, c):
+        return a, b, c
+"""
+
+
+class ConfigurationWatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._conf_dir = os.path.join(self._dir, 'conf')
+        os.mkdir(self._conf_dir)
+        pt = os.path.join(self._dir, 'conf_bdl.py')
+        with open(pt, 'w') as fd:
+            fd.write(_CONF_BDL)
+        self._write({'a': 1, 'b': 2})
+        fmk = Framework(LocalConfiguration(self._conf_dir, flush_delay=None))
+        fmk.install_bundle(pt)
+        fmk.__executor__.loop()
+        fmk.get_bundle('conf_bdl').start()
+        fmk.__executor__.loop()
+        self._fmk = fmk
+
+    def tearDown(self):
+        self._fmk.close()
+        self._fmk = None
+        sys.modules.pop('conf_bdl', None)
+        shutil.rmtree(self._dir)
+
+    def _write(self, conf):
+        with open(os.path.join(self._conf_dir, 'conf_bdl'), 'w') as fd:
+            json.dump(conf, fd)
+
+    def test_external_edits_delivered_per_key(self):
+        fmk = self._fmk
+        svc = fmk.get_service('conf_bdl:ConfiguredService')
+        watcher = fmk.watch_configuration(interval=60)
+        self.assertEqual(watcher.check(), {})
+        self._write({'a': 1, 'b': 3, 'c': 4})
+        self.assertEqual(watcher.check(), {'conf_bdl': {'b': 3, 'c': 4}})
+        fmk.__executor__.loop()
+        self.assertEqual(svc.changes, [('b', 3), ('c', 4)])
+        self.assertEqual(fmk.configuration['conf_bdl']['c'], 4)
+
+    def test_configuration_snapshot(self):
+        fmk = self._fmk
+        svc = fmk.get_service('conf_bdl:ConfiguredService')
+        bdl = fmk.get_bundle('conf_bdl')
+        self.assertEqual(svc.settings(), (1, 2, 'none'))
+        self.assertEqual(svc.settings(b=0), (1, 2, 'none'))
+        snapshot = bdl.configuration_snapshot
+        self.assertIs(bdl.configuration_snapshot, snapshot)
+
+        fmk.configuration['conf_bdl']['c'] = 'set'
+        self.assertEqual(svc.settings(), (1, 2, 'set'))
+        self.assertIsNot(bdl.configuration_snapshot, snapshot)
+        self.assertEqual(snapshot.get('c'), None)
+
+        fmk.configuration['conf_bdl']['nested'] = {'x': [1]}
+        nested = bdl.configuration_snapshot['nested']
+        self.assertEqual(nested['x'], (1, ))
+        self.assertRaises(TypeError, operator.setitem, nested, 'x', 2)
+        self.assertFalse(hasattr(nested, 'pop'))
+
+        self._write({'a': 5})
+        fmk.configuration.reload()
+        self.assertEqual(svc.settings(), (5, None, 'none'))
+
+
+class SharedConfigurationWatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._pt = os.path.join(self._dir, 'conf_bdl.py')
+        with open(self._pt, 'w') as fd:
+            fd.write(_CONF_BDL)
+
+    def tearDown(self):
+        sys.modules.pop('conf_bdl', None)
+        shutil.rmtree(self._dir)
+
+    def _watch(self, store):
+        # the second store stands for another process sharing the configuration
+        other = store(self._dir)
+        other['conf_bdl']['a'] = 1
+        fmk = Framework(store(self._dir))
+        try:
+            fmk.install_bundle(self._pt)
+            fmk.__executor__.loop()
+            fmk.get_bundle('conf_bdl').start()
+            fmk.__executor__.loop()
+            svc = fmk.get_service('conf_bdl:ConfiguredService')
+            watcher = fmk.watch_configuration(interval=60)
+            self.assertEqual(watcher.check(), {})
+            fmk.configuration['conf_bdl']['a'] = 2
+            self.assertEqual(watcher.check(), {})
+            other['conf_bdl']['b'] = 3
+            other.persist()
+            self.assertEqual(watcher.check(), {'conf_bdl': {'b': 3}})
+            self.assertEqual(watcher.check(), {})
+            fmk.__executor__.loop()
+            self.assertEqual(svc.changes, [('b', 3)])
+            self.assertEqual(svc.settings(), (2, 3, 'none'))
+        finally:
+            fmk.close()
+            other.close()
+
+    def test_journal(self):
+        self._watch(lambda path: JournalConfiguration(path, compact_delay=None))
+
+    def test_sqlite(self):
+        self._watch(SqliteConfiguration)
+
+
+if __name__ == '__main__':
+    unittest.main()
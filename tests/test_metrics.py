@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import threading
+import unittest
+from gumpy.framework import Framework
+from gumpy.metrics import LatencyHistogram, MetricsRegistry, _bucket_index, _bucket_bounds
+
+
+class LatencyHistogramTestCase(unittest.TestCase):
+    def test_buckets(self):
+        for micros in (0, 1, 15, 16, 17, 31, 32, 33, 1000, 123456, 2 ** 30 + 7):
+            lower, upper = _bucket_bounds(_bucket_index(micros))
+            self.assertTrue(lower <= micros < upper)
+            self.assertLessEqual(upper - lower, max(1, micros / 16.0 * 1.01))
+
+    def test_quantiles(self):
+        h = LatencyHistogram()
+        for i in range(1, 1001):
+            h.record(i / 1e6)
+        self.assertEqual(h.count, 1000)
+        self.assertAlmostEqual(h.quantile(0.5), 500 / 1e6, delta=500 / 1e6 * 0.07)
+        self.assertAlmostEqual(h.quantile(0.99), 990 / 1e6, delta=990 / 1e6 * 0.07)
+        self.assertEqual(h.snapshot()['max'], 1000 / 1e6)
+
+
+class CallMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        fmk = Framework()
+        fmk.install_bundle('samples.calc_bdl')
+        fmk.__executor__.loop()
+        fmk.get_bundle('calc_bdl').start()
+        fmk.__executor__.loop()
+        self._fmk = fmk
+
+    def test_service_calls(self):
+        fmk = self._fmk
+        client = fmk.get_service('calc_bdl:CalculatorClient')
+        plain = fmk.get_service('calc_bdl:PreciseCalculator')
+        metrics = fmk.enable_call_metrics()
+
+        calc = fmk.get_service('calc_bdl:PreciseCalculator')
+        self.assertIsNot(calc, plain)
+        self.assertIs(fmk.get_service('calc_bdl:PreciseCalculator'), calc)
+        for i in range(10):
+            calc.add(i, 1)
+        self.assertRaises(ValueError, calc.fail, 'expected')
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['calc_bdl:PreciseCalculator.add']['calls'], 10)
+        self.assertEqual(snapshot['calc_bdl:PreciseCalculator.add']['errors'], 0)
+        self.assertEqual(snapshot['calc_bdl:PreciseCalculator.fail']['errors'], 1)
+
+        fmk.get('calc_bdl:SimpleCalculator').set_properties(version=3)
+        simple = fmk.get_service('calc_bdl:SimpleCalculator')
+        self.assertIn(simple, client.calculators)
+        self.assertTrue(client.calculator.unbind(fmk.get('calc_bdl:SimpleCalculator')))
+        self.assertEqual(client.calculators, {plain})
+
+        self.assertIs(fmk.disable_call_metrics(), metrics)
+        self.assertIs(fmk.get_service('calc_bdl:PreciseCalculator'), plain)
+
+
+    def test_errors_from_threads(self):
+        self._fmk.enable_call_metrics()
+        calc = self._fmk.get_service('calc_bdl:PreciseCalculator')
+
+        def _fail():
+            for i in range(500):
+                try:
+                    calc.fail('expected')
+                except ValueError:
+                    pass
+
+        threads = [threading.Thread(target=_fail) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = self._fmk.call_metrics.snapshot()['calc_bdl:PreciseCalculator.fail']
+        self.assertEqual((stats['calls'], stats['errors']), (4000, 4000))
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+    def test_render(self):
+        registry = MetricsRegistry()
+        requests = registry.counter('requests_total', 'Requests', ('path', ))
+        registry.gauge('temperature', 'Temperature', function=lambda: 21.5)
+        latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        requests.labels('/a"b').inc()
+        requests.labels('/a"b').inc(2)
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+        text = registry.render()
+        self.assertIn('# TYPE requests_total counter\nrequests_total{path="/a\\"b"} 3\n', text)
+        self.assertIn('temperature 21.5\n', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3\n', text)
+        self.assertIn('latency_seconds_count 3\n', text)
+
+        requests.inc()
+        self.assertIs(registry.render(max_age=60), text)
+        self.assertIsNot(registry.render(), text)
+
+    def test_framework_series(self):
+        fmk = Framework()
+        fmk.restore_state({'samples.calc_bdl': True, 'samples.calc_user_bdl': True})
+        fmk.__executor__.loop()
+        fmk.em.on_calc_event.send('delivered')
+        fmk.em.on_other_event.send('ignored')
+        fmk.enable_call_metrics()
+        fmk.get_service('calc_bdl:SimpleCalculator').add(1, 2)
+
+        text = fmk.metrics.render()
+        self.assertIn('gumpy_bundles{state="ACTIVE"} 2\n', text)
+        self.assertIn('gumpy_services{status="satisfied"} 4\n', text)
+        self.assertIn('gumpy_executor_queue_depth 0\n', text)
+        self.assertIn('gumpy_event_deliveries_total{event="on_calc_event"} 1\n', text)
+        self.assertIn('gumpy_binding_changes_total{change="bind"} 3\n', text)
+        self.assertIn('gumpy_bundle_action_seconds_count{action="start"} 2\n', text)
+        self.assertIn('gumpy_service_calls_total{service="calc_bdl:SimpleCalculator",method="add"} 1\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
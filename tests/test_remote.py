@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import os
+import sys
+import subprocess
+import threading
+import unittest
+from gumpy.framework import Framework
+from gumpy.remote import RemoteCallError, RemoteConnection, ConnectionPool, AuthenticationError, KIND_CALL, SECRET_ENV
+
+_SECRET = b'remote-test-secret'
+
+_SERVE_CALC = '''
+import sys
+import threading
+from gumpy.framework import Framework
+fmk = Framework()
+fmk.install_bundle('samples.calc_bdl')
+fmk.__executor__.loop()
+fmk.get_bundle('calc_bdl').start()
+fmk.__executor__.loop()
+sys.stdout.write('%d\\n' % fmk.listen(port=0).address[1])
+sys.stdout.flush()
+t = threading.Thread(target=lambda: (sys.stdin.read(), fmk.__executor__.close()))
+t.daemon = True
+t.start()
+fmk.__executor__.loop(True)
+'''
+
+
+def _calc_framework():
+    fmk = Framework()
+    fmk.remote_secret = _SECRET
+    fmk.install_bundle('samples.calc_bdl')
+    fmk.__executor__.loop()
+    fmk.get_bundle('calc_bdl').start()
+    fmk.__executor__.loop()
+    return fmk
+
+
+class RemoteTestCase(unittest.TestCase):
+    def setUp(self):
+        self._server_fmk = _calc_framework()
+        self._port = self._server_fmk.listen(port=0).address[1]
+        self._loop = threading.Thread(target=self._server_fmk.__executor__.loop, args=(True, ))
+        self._loop.daemon = True
+        self._loop.start()
+        self._client_fmk = Framework()
+        self._client_fmk.remote_secret = _SECRET
+
+    def tearDown(self):
+        self._client_fmk._close_remote()
+        self._server_fmk._close_remote()
+        self._server_fmk.__executor__.close()
+        self._loop.join()
+
+    def test_call(self):
+        calc = self._client_fmk.get_service('gum://127.0.0.1:%d/calc_bdl:PreciseCalculator' % self._port)
+        self.assertEqual(calc.add(1, 2), 3.0)
+        self.assertEqual(calc.add.spawn(2, b=3).result(), 5.0)
+        self.assertRaises(RemoteCallError, calc.fail, 'expected')
+        self.assertRaises(RemoteCallError, calc.missing)
+        absent = self._client_fmk.get_service('gum://127.0.0.1:%d/calc_bdl:Absent' % self._port)
+        self.assertRaises(RemoteCallError, absent.add, 1, 2)
+
+    def test_concurrent_calls(self):
+        calc = self._client_fmk.get_service('gum://127.0.0.1:%d/calc_bdl:SimpleCalculator' % self._port)
+        results = {}
+
+        def _worker(n):
+            results[n] = [calc.add(n, i) for i in range(50)]
+
+        threads = [threading.Thread(target=_worker, args=(n, )) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for n in range(8):
+            self.assertEqual(results[n], [n + i for i in range(50)])
+
+    def test_batch(self):
+        uri = 'gum://127.0.0.1:%d/calc_bdl:PreciseCalculator' % self._port
+        with self._client_fmk.batch(uri) as b:
+            slow = b.delay(0.5, 'slow')
+            sums = [b.add(i, i) for i in range(10)]
+            failed = b.fail('in batch')
+        self.assertEqual([f.result() for f in sums], [float(i * 2) for i in range(10)])
+        self.assertFalse(slow.is_done)  # later calls streamed back first
+        self.assertRaises(RemoteCallError, failed.result)
+        self.assertEqual(slow.result(), 'slow')
+
+    def test_micro_batching(self):
+        pool = self._client_fmk.connect('127.0.0.1', self._port, batch_window=0.05)
+        frames = []
+        _send = RemoteConnection.send
+
+        def _recording_send(conn, data):
+            frames.append(data)
+            return _send(conn, data)
+
+        RemoteConnection.send = _recording_send
+        try:
+            calc = self._client_fmk.get_service('gum://127.0.0.1:%d/calc_bdl:SimpleCalculator' % self._port)
+            futures = [calc.add.spawn(i, 1) for i in range(20)]
+            self.assertEqual([f.result() for f in futures], [i + 1 for i in range(20)])
+        finally:
+            RemoteConnection.send = _send
+            pool.batch_window = 0
+        self.assertEqual(len(frames), 1)
+
+    def test_pool_connects_outside_lock(self):
+        pool = ConnectionPool('127.0.0.1', self._port, size=2, secret=_SECRET)
+        first = pool.connection()
+        connecting, release = threading.Event(), threading.Event()
+        _init = RemoteConnection.__init__
+
+        def _slow_init(conn, *args, **kwargs):
+            connecting.set()
+            release.wait(5)
+            _init(conn, *args, **kwargs)
+
+        RemoteConnection.__init__ = _slow_init
+        try:
+            slow = []
+            t = threading.Thread(target=lambda: slow.append(pool.connection()))
+            t.start()
+            self.assertTrue(connecting.wait(5))
+            # a peer still connecting leaves the established connection to everybody else
+            other = []
+            t2 = threading.Thread(target=lambda: other.append(pool.connection()))
+            t2.start()
+            t2.join(2)
+            self.assertEqual(other, [first])
+        finally:
+            RemoteConnection.__init__ = _init
+            release.set()
+        t.join()
+        self.assertEqual(len(slow), 1)
+        self.assertIsNot(slow[0], first)
+        for conn in (first, slow[0]):
+            conn.close()
+
+    def test_authentication(self):
+        self.assertRaises(AuthenticationError, RemoteConnection, '127.0.0.1', self._port, secret=b'wrong')
+        self.assertRaises(AuthenticationError, RemoteConnection, '127.0.0.1', self._port, secret=None)
+        conn = RemoteConnection('127.0.0.1', self._port, secret=_SECRET)
+        try:
+            # a pickled callable is refused by the server, the connection keeps serving
+            refused = conn.submit(KIND_CALL, ('calc_bdl:SimpleCalculator', 'add', (os.getcwd, 1), {}))
+            self.assertRaises(RemoteCallError, refused.result)
+            self.assertEqual(conn.submit(KIND_CALL, ('calc_bdl:SimpleCalculator', 'add', (1, 1), {})).result(), 2)
+        finally:
+            conn.close()
+
+    def test_loopback_process(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env[SECRET_ENV] = _SECRET.decode('ascii')
+        proc = subprocess.Popen([sys.executable, '-c', _SERVE_CALC], cwd=root, env=env,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            port = int(proc.stdout.readline())
+            calc = self._client_fmk.get_service('gum://127.0.0.1:%d/calc_bdl:SimpleCalculator' % port)
+            self.assertEqual(calc.add(20, 22), 42)
+        finally:
+            proc.stdin.close()
+            proc.wait()
+            proc.stdout.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
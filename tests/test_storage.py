@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 __author__ = 'chinfeng'
 
+import os
 import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 import uuid
 
@@ -51,6 +57,53 @@ class StorageTestCase(unittest.TestCase):
         storage.delete('t')
         self.assertNotIn('t', storage)
 
+    def test_mock_indexes(self):
+        from huacaya.storage import mock
+        storage = mock.MockStorage()
+        bkt = storage.create_bucket('accounts', ('username', 'age'))
+        self.assertIs(storage.get_bucket('accounts'), bkt)
+        self.assertEqual(bkt.indexes, frozenset(('username', 'age')))
+        for i in range(20):
+            bkt.put_object('u%d' % i, {'username': 'user%d' % i, 'age': i % 5, 'active': i % 2 == 0})
+
+        plan = storage._sqlite_db.query(
+            'EXPLAIN QUERY PLAN SELECT k, v FROM {0} WHERE json_extract(v, \'$."username"\')=?'.format(bkt._name),
+            ('user3', ))
+        self.assertIn('USING INDEX', ' '.join(str(row[-1]) for row in plan))
+
+        self.assertEqual(bkt.find_one({'username': 'user3'}), ('u3', {'username': 'user3', 'age': 3, 'active': False}))
+        self.assertIsNone(bkt.find_one({'username': 'user3', 'age': 4}))
+        self.assertEqual(sorted(k for k, v in bkt.find({'age': 2, 'active': True})), ['u12', 'u2'])
+        # fields without an index are scanned
+        self.assertEqual(len(list(bkt.find({'active': True}))), 10)
+        bkt.items = lambda keys=None: self.fail('indexed lookup scanned the bucket')
+        self.assertEqual(bkt.find_one({'username': u'user4'})[0], 'u4')
+        self.assertEqual(sorted(k for k, v in bkt.find({'age': 2.0})), ['u12', 'u17', 'u2', 'u7'])
+        del bkt.items
+        # creating it again keeps the objects and the indexes
+        bkt = storage.create_bucket('accounts', ('username', ))
+        self.assertEqual(bkt.indexes, frozenset(('username', 'age')))
+        self.assertEqual(bkt.find_one({'username': 'user3'})[0], 'u3')
+
+        self.assertEqual(storage.get_bucket('plain').indexes, frozenset())
+        storage.delete('accounts')
+        self.assertNotIn('accounts', storage)
+        self.assertEqual(storage.get_bucket('accounts').indexes, frozenset())
+
+    def test_mock_bulk(self):
+        from huacaya.storage import mock
+        bkt = mock.MockStorage().get_bucket('bulk')
+        bkt.put_many(dict(('k%d' % i, {'n': i}) for i in range(1200)))
+        self.assertEqual(len(bkt.keys()), 1200)
+        found = bkt.get_many(['k%d' % i for i in range(0, 1200, 2)] + ['missing'])
+        self.assertEqual(len(found), 600)
+        self.assertEqual(found['k10'], {'n': 10})
+        self.assertEqual(list(bkt.items(keys=['k3', 'missing', 'k1'])), [('k3', {'n': 3}), ('k1', {'n': 1})])
+        bkt.put_many([('k1', {'n': -1})])
+        self.assertEqual(bkt.get_object('k1'), {'n': -1})
+        bkt.delete_many('k%d' % i for i in range(1000))
+        self.assertEqual(sorted(bkt.keys()), sorted('k%d' % i for i in range(1000, 1200)))
+
     def test_sqlite(self):
         from huacaya.storage.sqlite import SqliteStorage
         storage = SqliteStorage()
@@ -97,3 +150,231 @@ class StorageTestCase(unittest.TestCase):
 
         storage.drop('t')
         self.assertNotIn('t', storage)
+
+    def test_sqlite_bulk(self):
+        from huacaya.storage.sqlite import SqliteStorage
+        storage = SqliteStorage()
+        bkt = storage.create_bucket('t', ('name', ))
+        ids = bkt.put_many([{'name': 'bulk_%d' % i} for i in range(10)])
+        self.assertEqual(len(ids), 10)
+        self.assertIn({'name': 'bulk_4'}, bkt)
+        found = bkt.get_many(ids[:3] + ['missing'])
+        self.assertEqual(sorted(found), sorted(ids[:3]))
+        self.assertEqual([e['name'] for k, e in bkt.items(keys=ids[2:4])], ['bulk_2', 'bulk_3'])
+        bkt.delete_many(ids[:5])
+        self.assertEqual(len(bkt.get_many(ids)), 5)
+        storage.drop('t')
+
+    def test_transaction(self):
+        from huacaya.storage.mock import MockStorage
+        storage = MockStorage()
+        bkt = storage.create_bucket('tx')
+        with storage.transaction():
+            bkt.put_object('a', {'n': 1})
+            with bkt.transaction():
+                bkt.put_object('b', {'n': 2})
+            self.assertEqual(bkt.get_object('b'), {'n': 2})
+        self.assertEqual(sorted(bkt.keys()), ['a', 'b'])
+
+        def _failing():
+            with storage.transaction():
+                bkt.put_object('c', {'n': 3})
+                bkt.delete_object('a')
+                raise RuntimeError('rollback')
+
+        self.assertRaises(RuntimeError, _failing)
+        self.assertEqual(sorted(bkt.keys()), ['a', 'b'])
+
+    def test_failed_commit(self):
+        from huacaya.storage.connection import SqliteConnection
+        db = SqliteConnection()
+        db._db.execute('PRAGMA foreign_keys=ON')
+        db.execute('CREATE TABLE parent(id INTEGER PRIMARY KEY)')
+        db.execute('CREATE TABLE child(id INTEGER, parent INTEGER '
+                   'REFERENCES parent(id) DEFERRABLE INITIALLY DEFERRED)')
+
+        def _orphan():
+            # the deferred foreign key is only checked by COMMIT
+            with db.transaction():
+                db.execute('INSERT INTO child VALUES(1, 42)')
+
+        self.assertRaises(sqlite3.IntegrityError, _orphan)
+        # rolled back, the next write starts a transaction of its own
+        db.execute('INSERT INTO parent VALUES(1)')
+        self.assertEqual(db.query_one('SELECT COUNT(*) FROM child'), (0, ))
+        self.assertEqual(db.query_one('SELECT COUNT(*) FROM parent'), (1, ))
+        db.close()
+
+    def test_group_commit(self):
+        from huacaya.storage.mock import MockStorage
+        from huacaya.storage.sqlite import SqliteStorage
+        path = tempfile.mkdtemp()
+        try:
+            storage = MockStorage(os.path.join(path, 'mock.db'), group_commit=0.02)
+            self.assertEqual(storage._sqlite_db.journal_mode, 'wal')
+            bkt = storage.create_bucket('gc')
+            commits = storage._sqlite_db.commits
+            errors = []
+
+            def _writer(n):
+                try:
+                    for i in range(5):
+                        bkt.put_object('k%d_%d' % (n, i), {'n': n, 'i': i})
+                except Exception as err:
+                    errors.append(err)
+
+            threads = [threading.Thread(target=_writer, args=(n, )) for n in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(len(list(bkt.keys())), 40)
+            self.assertLess(storage._sqlite_db.commits - commits, 40)
+
+            # a failing write is rolled back alone, its batch still commits
+            db = storage._sqlite_db
+            results = []
+
+            def _statement(sql):
+                try:
+                    results.append(db.execute(sql))
+                except Exception as err:
+                    results.append(type(err).__name__)
+
+            insert = "INSERT INTO {0}(k, v) VALUES(?, '{{}}')".format(bkt._name)
+            threads = [threading.Thread(target=_statement, args=(sql, )) for sql in (
+                insert.replace('?', "'x1'"), 'INSERT INTO missing VALUES(1)', insert.replace('?', "'x2'")
+            )]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(sorted(map(str, results)), ['1', '1', 'OperationalError'])
+            self.assertIn('x1', bkt)
+            self.assertIn('x2', bkt)
+            storage._sqlite_db.close()
+
+            storage = SqliteStorage(os.path.join(path, 'sqlite.db'), synchronous='FULL')
+            self.assertEqual(storage._sqlite_db.journal_mode, 'wal')
+            bkt = storage.create_bucket('t', ('name', ))
+            self.assertRaises(ValueError, lambda: SqliteStorage(synchronous='SOMETIMES'))
+            with storage.transaction():
+                bkt.put({'id': 'a', 'name': 'a'})
+                bkt.put({'id': 'b', 'name': 'b'})
+            self.assertIn({'name': 'b'}, bkt)
+            storage._sqlite_db.close()
+            storage = SqliteStorage(os.path.join(path, 'sqlite.db'))
+            self.assertIn('t', storage)
+            self.assertIn({'name': 'a'}, storage.get_bucket('t'))
+            storage._sqlite_db.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_reader_pool(self):
+        from huacaya.storage.mock import MockStorage
+        self.assertEqual(MockStorage()._sqlite_db.readers, 0)
+        path = tempfile.mkdtemp()
+        try:
+            storage = MockStorage(os.path.join(path, 'mock.db'), readers=2)
+            db = storage._sqlite_db
+            bkt = storage.create_bucket('pool', ('n', ))
+            bkt.put_many(('k%d' % i, {'n': i}) for i in range(50))
+            errors = []
+
+            def _reader():
+                try:
+                    for i in range(50):
+                        self.assertEqual(bkt.get_object('k%d' % i), {'n': i})
+                        self.assertEqual(bkt.find_one({'n': i})[0], 'k%d' % i)
+                except Exception as err:
+                    errors.append(err)
+
+            threads = [threading.Thread(target=_reader) for n in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(errors, [])
+            self.assertLessEqual(db._opened, 2)
+
+            # readers only see committed rows, the writer's own transaction sees its changes
+            with storage.transaction():
+                bkt.put_object('new', {'n': -1})
+                self.assertIn('new', bkt)
+                seen = []
+                t = threading.Thread(target=lambda: seen.append('new' in bkt))
+                t.start()
+                t.join()
+                self.assertEqual(seen, [False])
+            self.assertIn('new', bkt)
+
+            with storage.reader():
+                pinned = db._local.reader
+                self.assertEqual(bkt.get_object('new'), {'n': -1})
+                self.assertIs(db._local.reader, pinned)
+                self.assertRaises(sqlite3.OperationalError, pinned.execute, 'DELETE FROM bucket_indexes')
+            self.assertIsNone(db._local.reader)
+            db.close()
+        finally:
+            shutil.rmtree(path)
+
+    def test_cached_storage(self):
+        from huacaya.storage.mock import MockStorage
+        from huacaya.storage.cache import CachedStorage
+        storage = CachedStorage(MockStorage(), maxsize=3)
+        bkt = storage.create_bucket('cached', ('n', ))
+        self.assertIs(storage.get_bucket('cached'), bkt)
+        bkt.put_object('a', {'n': 1, 'tags': ['x']})
+
+        self.assertIn('a', bkt)
+        obj = bkt.get_object('a')
+        self.assertEqual(obj, {'n': 1, 'tags': ['x']})
+        self.assertEqual(bkt.cache_info(), dict(hits=1, misses=1, maxsize=3, currsize=1))
+        # callers get copies, mutating one leaves the cache intact
+        obj['tags'].append('y')
+        self.assertEqual(bkt.get_object('a'), {'n': 1, 'tags': ['x']})
+
+        self.assertNotIn('missing', bkt)
+        self.assertIsNone(bkt.get_object('missing'))
+        self.assertEqual(bkt.cache_info()['misses'], 2)
+
+        bkt.put_object('a', {'n': 2})
+        bkt.put_object('missing', {'n': 3})
+        self.assertEqual(bkt.get_object('a'), {'n': 2})
+        self.assertEqual(bkt.get_object('missing'), {'n': 3})
+        bkt.delete_object('a')
+        self.assertNotIn('a', bkt)
+        self.assertEqual(bkt.find_one({'n': 3}), ('missing', {'n': 3}))
+
+        bkt.put_many(('k%d' % i, {'n': i}) for i in range(5))
+        self.assertEqual(sorted(bkt.get_many(['k1', 'k2', 'nope'])), ['k1', 'k2'])
+        info = bkt.cache_info()
+        self.assertEqual(list(bkt.items(keys=['k2', 'nope', 'k1'])), [('k2', {'n': 2}), ('k1', {'n': 1})])
+        self.assertEqual(bkt.cache_info()['hits'], info['hits'] + 3)
+        self.assertLessEqual(bkt.cache_info()['currsize'], 3)
+        bkt.delete_many(['k1', 'k2'])
+        self.assertEqual(bkt.get_many(['k1', 'k2', 'k3']), {'k3': {'n': 3}})
+
+        # changes made behind the cache show up once the ttl expires
+        storage = CachedStorage(MockStorage(), ttl=0.05)
+        bkt = storage.create_bucket('ttl')
+        bkt.put_object('a', {'n': 1})
+        self.assertEqual(bkt.get_object('a'), {'n': 1})
+        bkt._bucket.put_object('a', {'n': 2})
+        self.assertEqual(bkt.get_object('a'), {'n': 1})
+        time.sleep(0.06)
+        self.assertEqual(bkt.get_object('a'), {'n': 2})
+
+        storage.delete('ttl')
+        self.assertNotIn('ttl', storage)
+        bkt = storage.get_bucket('ttl')
+        self.assertNotIn('a', bkt)
+        self.assertEqual(storage.cache_info(), {'ttl': dict(hits=0, misses=1, maxsize=1024, currsize=1)})
+
+    def test_cached_storage_refuses_entity_buckets(self):
+        from huacaya.storage.sqlite import SqliteStorage
+        from huacaya.storage.cache import CachedStorage
+        # sqlite writes through put/update, keys the cache could not invalidate
+        storage = CachedStorage(SqliteStorage())
+        self.assertRaises(TypeError, storage.create_bucket, 'entities')
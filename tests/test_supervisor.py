@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import time
+import threading
+import unittest
+from gumpy.framework import Framework
+from gumpy.configuration import LocalConfiguration
+from gumpy.remote import RemoteServer
+from gumpy.supervisor import ServiceDirectory, WorkerLink, assign_bundles, _DirectoryResolver
+
+_SECRET = b'supervisor-test-secret'
+
+
+def _started_framework(*names):
+    fmk = Framework()
+    fmk.remote_secret = _SECRET
+    for name in names:
+        fmk.install_bundle('samples.{0}'.format(name))
+    fmk.__executor__.loop()
+    for name in names:
+        fmk.get_bundle(name).start()
+    fmk.__executor__.loop()
+    fmk.listen(port=0)
+    return fmk
+
+
+def _settle(fmk):
+    # tasks queued before this one have run once it is done
+    fmk.call(lambda: None).wait()
+
+
+class SupervisorTestCase(unittest.TestCase):
+    def setUp(self):
+        self._directory = ServiceDirectory()
+        self._server = RemoteServer(_DirectoryResolver(self._directory), port=0, secret=_SECRET).start()
+        self._calc_fmk = _started_framework('calc_bdl')
+        self._user_fmk = _started_framework('calc_user_bdl')
+        self._loops = []
+        for fmk in (self._calc_fmk, self._user_fmk):
+            t = threading.Thread(target=fmk.__executor__.loop, args=(True, ))
+            t.daemon = True
+            t.start()
+            self._loops.append(t)
+        self._links = [
+            WorkerLink(self._calc_fmk, 0, self._server.address),
+            WorkerLink(self._user_fmk, 1, self._server.address),
+        ]
+
+    def tearDown(self):
+        for link in self._links:
+            link.close()
+        self._calc_fmk._close_remote()
+        self._user_fmk._close_remote()
+        self._server.close()
+        for fmk, t in zip((self._calc_fmk, self._user_fmk), self._loops):
+            fmk.__executor__.close()
+            t.join()
+
+    def _sync(self):
+        for link in self._links:
+            link.sync()
+        for fmk in (self._calc_fmk, self._user_fmk):
+            _settle(fmk)
+
+    def test_services_shared_across_workers(self):
+        self._sync()
+        self._sync()
+        user = self._user_fmk.get_service('calc_user_bdl:CalculatorUser')
+        self.assertEqual(len(user.calculators), 2)
+        self.assertEqual(sorted(calc.add(1, 2) for calc in user.calculators), [3, 3.0])
+        self.assertEqual(self._user_fmk.get_service('calc_bdl:SimpleCalculator').add(20, 22), 42)
+        self.assertEqual(self._user_fmk.get_service('(version>=2)').add(1, 1), 2.0)
+
+        self._calc_fmk.em.on_calc_event.send('relayed')
+        for _ in range(50):
+            if user.messages:
+                break
+            time.sleep(0.02)
+        self.assertEqual(user.messages, ['relayed'])
+
+        self._links[0].close()
+        self._links[1].sync()
+        _settle(self._user_fmk)
+        self.assertEqual(user.calculators, set())
+        self.assertIsNone(self._user_fmk.get_service('calc_bdl:SimpleCalculator'))
+
+    def test_worker_leaves_shared_state(self):
+        conf = LocalConfiguration()
+        conf['.state']['samples.calc_bdl'] = True
+        fmk = Framework(conf, persist_state=False)
+        fmk.restore_state({'samples.calc_bdl': True, 'samples.absent_bdl': True})
+        fmk.__executor__.loop()
+        self.assertEqual(fmk.get_bundle('calc_bdl').state, fmk.get_bundle('calc_bdl').ST_ACTIVE)
+        fmk.stop()
+        fmk.__executor__.loop()
+        self.assertEqual(dict(conf['.state'].items()), {'samples.calc_bdl': True})
+        self.assertEqual(dict(conf['.wiring'].items()), {})
+
+    def test_assign_bundles(self):
+        conf = LocalConfiguration()
+        for uri in ('b', 'a', 'c', 'd'):
+            conf['.state'][uri] = True
+        conf['.state']['stopped'] = False
+        conf['.workers']['d'] = 0
+        self.assertEqual(assign_bundles(conf, 2), {0: ['a', 'c', 'd'], 1: ['b']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+__author__ = 'chinfeng'
+
+import os
+import sys
+import json
+import threading
+import unittest
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+from gumpy.framework import Framework
+
+try:
+    from urllib2 import urlopen, Request
+except ImportError:
+    from urllib.request import urlopen, Request
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugins'))
+from web_console.server import WSGIApplication
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class WebConsoleTestCase(unittest.TestCase):
+    def setUp(self):
+        self._fmk = Framework()
+        self._loop = threading.Thread(target=self._fmk.__executor__.loop, args=(True, ))
+        self._loop.daemon = True
+        self._loop.start()
+        self._httpd = make_server('127.0.0.1', 0, WSGIApplication(self._fmk), handler_class=_QuietHandler)
+        self._server = threading.Thread(target=self._httpd.serve_forever)
+        self._server.daemon = True
+        self._server.start()
+
+    def tearDown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._fmk.__executor__.close()
+        self._loop.join()
+
+    def _post(self, action, **params):
+        req = Request('http://127.0.0.1:%d/%s' % (self._httpd.server_port, action),
+                      json.dumps(params).encode('utf-8'), {'Content-Type': 'application/json'})
+        resp = urlopen(req, timeout=10)
+        try:
+            return json.loads(resp.read().decode('utf-8'))
+        finally:
+            resp.close()
+
+    def test_actions_save_state(self):
+        state = self._fmk.configuration['.state']
+        self.assertEqual(self._post('install', uri='samples.calc_bdl'), {'install_result': 'ok'})
+        self.assertEqual(state['samples.calc_bdl'], False)
+        self.assertEqual(self._post('start', name='calc_bdl'), {'start_result': 'ok'})
+        self.assertEqual(self._fmk.get_bundle('calc_bdl').state, self._fmk.get_bundle('calc_bdl').ST_ACTIVE)
+        self.assertEqual(state['samples.calc_bdl'], True)
+        self._post('stop', name='calc_bdl')
+        self.assertEqual(state['samples.calc_bdl'], False)
+        self.assertEqual(self._post('uninstall', name='calc_bdl'), {'uninstall_result': 'ok'})
+        self.assertNotIn('calc_bdl', self._fmk.bundles)
+        self.assertNotIn('samples.calc_bdl', state.keys())
+
+
+if __name__ == '__main__':
+    unittest.main()